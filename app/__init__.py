@@ -2,16 +2,28 @@
 Main application lookup
 """
 import logging
-from app.logbuffer import LogBuffer
+from app.logbuffer import LogBuffer, TaskLogBuffer
 import app.report
 from .manifest import Manifest
 from .directory import Directory
+from .snapshot import DirectorySnapshot
 from .suite import Suite
+from .suiterun import SuiteRun
+from .diskorder import DiskOrder
+from .retry import RetryBundle
+from .hashcache import HashCache
+from .stagecache import StageCache
+from .bundle import OutputBundle
+from .timings import Timings
+from .ledger import Ledger
+from .checkpoint import Checkpoint
+from .runner import ScriptRunner
+from .probe import ProbeCache
 from .exception import (
     ColophonException, EndStagesProcessing,
     StageProcessingFailure, TemplateRenderFailure
 )
-from .process import exec_command, write_output
+from .process import exec_command, write_output, append_results, merge_results
 from .job import ColophonJob
 
 # pylint: disable=invalid-name
@@ -19,6 +31,16 @@ install_path: str = None
 manifest: Manifest = None
 suite: Suite = None
 sourcedir: Directory = None
+retry: RetryBundle = None
+hashcache: HashCache = None
+stagecache: StageCache = None
+diskorder: DiskOrder = None
+bundle: OutputBundle = None
+timings: Timings = Timings()
+ledger: Ledger = Ledger()
+checkpoint: Checkpoint = Checkpoint()
+runner: ScriptRunner = ScriptRunner()
+probes: ProbeCache = ProbeCache()
 workdir: str = None
 logger: logging.Logger = None
 globalctx: dict = {}
@@ -0,0 +1,369 @@
+"""
+Colophon output bundle (zip or zstd compressed tar) functionality
+"""
+import os
+import time
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+import app
+from app.checkpoint import JOURNAL_FILE
+
+# Compression choices for the output bundle
+COMPRESSION_CHOICES = ('best', 'fast', 'store', 'zstd')
+# Deflate levels for the zip compression choices; None to store uncompressed
+_DEFLATE_LEVELS = {'best': 9, 'fast': 1, 'store': None}
+# File extensions of formats which are already compressed
+COMPRESSED_EXTENSIONS = {
+    '7z', 'bz2', 'flac', 'gif', 'gz', 'jp2', 'jpeg', 'jpg', 'm4a', 'mkv', 'mov', 'mp3',
+    'mp4', 'ogg', 'png', 'tgz', 'webm', 'webp', 'xz', 'zip', 'zst'
+}
+# Files within the workdir which are never bundled; the checkpoint journal is only
+# used to resume the run within the workdir
+NOT_BUNDLED = (JOURNAL_FILE,)
+# Size of the start of a file checked to see if it compresses
+_SAMPLE_SIZE = 64 * 1024
+# Files where the sample compresses to more than this ratio are stored instead
+_STORE_RATIO = 0.95
+# Size of reads from files being added to the bundle
+_CHUNK_SIZE = 1024 * 1024
+# Deflated members larger than this are spooled to a temp file until written
+_SPOOL_SIZE = 16 * 1024 * 1024
+# Sizes and offsets from this on, and this many members, need the zip64 extensions; the
+# zip records then have all bits set in their place
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT = 0xFFFF
+# Zip records; the same layouts as the zipfile module reads
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_ZIP64_END = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_END = struct.Struct('<4s4H2LH')
+
+def already_compressed(filepath: str) -> bool:
+    """
+    Check if the file appears to already be compressed, either by its extension or by
+    checking if a sample from the start of the file compresses.
+    """
+    if os.path.splitext(filepath)[1][1:].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    with open(filepath, 'rb') as sfile:
+        sample = sfile.read(_SAMPLE_SIZE)
+    return len(sample) >= 1024 and len(zlib.compress(sample, 1)) > len(sample) * _STORE_RATIO
+
+
+def _dos_datetime(mtime: float) -> tuple[int, int]:
+    """The zip (MS-DOS) date and time of a modification time, clamped to years 1980-2107"""
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    elif year > 2107:
+        year, month, day, hour, minute, second = 2107, 12, 31, 23, 59, 58
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+class _ZipMember:
+    """A file to be written into a zip bundle, either deflated ahead of time or stored"""
+    __slots__ = ('filepath', 'arcname', 'fstat', 'crc', 'size', 'csize', 'data')
+
+    def __init__(self, filepath: str, arcname: str):
+        self.filepath: str = filepath
+        self.arcname: str = arcname
+        self.fstat: os.stat_result = os.stat(filepath)
+        self.crc: int = 0
+        self.size: int = self.fstat.st_size
+        self.csize: int = self.fstat.st_size
+        # The deflated file contents; None if the file is stored
+        self.data: tempfile.SpooledTemporaryFile = None
+
+    def deflate(self, level: int):
+        """Deflate the file contents as a raw deflate stream, spooled until written"""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # pylint: disable=consider-using-with
+        self.data = tempfile.SpooledTemporaryFile(_SPOOL_SIZE)
+        self.crc, self.size = 0, 0
+        with open(self.filepath, 'rb') as src:
+            while chunk := src.read(_CHUNK_SIZE):
+                self.crc = zlib.crc32(chunk, self.crc)
+                self.size += len(chunk)
+                self.data.write(compressor.compress(chunk))
+        self.data.write(compressor.flush())
+        self.csize = self.data.tell()
+
+    @property
+    def method(self) -> int:
+        """The zip compression method of the member"""
+        return zipfile.ZIP_STORED if self.data is None else zipfile.ZIP_DEFLATED
+
+    @property
+    def flags(self) -> int:
+        """The zip general purpose flags; names which are not ASCII are flagged as UTF-8"""
+        return 0 if self.arcname.isascii() else 0x800
+
+class _ZipArchive:
+    """
+    A zip file written from members compressed concurrently. Each file is deflated as a
+    raw deflate stream on the pool (zlib releases the GIL while compressing), then written
+    along with its headers into the zip file one member at a time on the writer thread.
+    Stored files are copied straight into the zip file by the writer thread.
+    """
+    def __init__(self, bfile, level: int, workers: int):
+        self._file = bfile
+        self._level = level
+        # Each member written, with the offset of its local header
+        self._members = []
+        self._futures = []
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    def add(self, filepath: str, arcname: str):
+        """Queue a file to be compressed and written into the zip file"""
+        self._futures.append(self._pool.submit(self._compress, filepath, arcname))
+
+    def _compress(self, filepath: str, arcname: str) -> Future:
+        """Deflate a file if it compresses, then queue it to be written; on the pool"""
+        member = _ZipMember(filepath, arcname)
+        if self._level is not None and not already_compressed(filepath):
+            member.deflate(self._level)
+        return self._writer.submit(self._write, member)
+
+    def _write(self, member: _ZipMember):
+        """Write a member and its local header into the zip file; on the writer thread"""
+        offset = self._file.tell()
+        name = member.arcname.encode()
+        zip64 = max(member.size, member.csize) >= _ZIP64_LIMIT
+        extra = struct.pack('<2H2Q', 1, 16, member.size, member.csize) if zip64 else b''
+        date, dtime = _dos_datetime(member.fstat.st_mtime)
+        self._file.write(_LOCAL_HEADER.pack(
+            b'PK\x03\x04', 45 if zip64 else 20, 0, member.flags, member.method, dtime, date,
+            member.crc, *((0xFFFFFFFF, 0xFFFFFFFF) if zip64 else (member.csize, member.size)),
+            len(name), len(extra)
+        ) + name + extra)
+        if member.data is not None:
+            member.data.seek(0)
+            shutil.copyfileobj(member.data, self._file, _CHUNK_SIZE)
+            member.data.close()
+            self._members.append((member, offset))
+            return
+        # Stored files are read as they are copied; the header is then updated with
+        # the checksum and sizes of what was read
+        member.size = 0
+        with open(member.filepath, 'rb') as src:
+            while chunk := src.read(_CHUNK_SIZE):
+                member.crc = zlib.crc32(chunk, member.crc)
+                member.size += len(chunk)
+                self._file.write(chunk)
+        member.csize = member.size
+        if member.size >= _ZIP64_LIMIT and not zip64:
+            raise app.ColophonException(
+                f"File grew too large while being added to the output bundle: {member.filepath}"
+            )
+        end = self._file.tell()
+        self._file.seek(offset + 14)
+        if zip64:
+            self._file.write(struct.pack('<L', member.crc))
+            self._file.seek(offset + _LOCAL_HEADER.size + len(name) + 4)
+            self._file.write(struct.pack('<2Q', member.size, member.csize))
+        else:
+            self._file.write(struct.pack('<3L', member.crc, member.csize, member.size))
+        self._file.seek(end)
+        self._members.append((member, offset))
+
+    @staticmethod
+    def _central_header(member: _ZipMember, offset: int) -> bytes:
+        """The central directory record of a member"""
+        values = (member.size, member.csize, offset)
+        zip64 = [value for value in values if value >= _ZIP64_LIMIT]
+        size, csize, offset = (
+            0xFFFFFFFF if value >= _ZIP64_LIMIT else value for value in values
+        )
+        extra = struct.pack(f'<2H{len(zip64)}Q', 1, 8 * len(zip64), *zip64) if zip64 else b''
+        version = 45 if zip64 else 20
+        date, dtime = _dos_datetime(member.fstat.st_mtime)
+        name = member.arcname.encode()
+        # Made on Unix, so the file mode is kept
+        return _CENTRAL_HEADER.pack(
+            b'PK\x01\x02', version, 3, version, 0, member.flags, member.method, dtime, date,
+            member.crc, csize, size, len(name), len(extra), 0, 0, 0,
+            (member.fstat.st_mode & 0xFFFF) << 16, offset
+        ) + name + extra
+
+    def flush(self):
+        """Wait for all queued files to be written"""
+        while self._futures:
+            self._futures.pop(0).result().result()
+
+    def close(self):
+        """Write all queued files, then the central directory, completing the zip file"""
+        self.flush()
+        self.shutdown()
+        start = self._file.tell()
+        for member, offset in self._members:
+            self._file.write(self._central_header(member, offset))
+        end = self._file.tell()
+        count = len(self._members)
+        fields = (count, end - start, start)
+        if count >= _ZIP64_COUNT or max(start, end - start) >= _ZIP64_LIMIT:
+            self._file.write(_ZIP64_END.pack(
+                b'PK\x06\x06', _ZIP64_END.size - 12, 45, 45, 0, 0, count, *fields
+            ))
+            self._file.write(_ZIP64_LOCATOR.pack(b'PK\x06\x07', 0, end, 1))
+            fields = (0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF)
+        self._file.write(_END.pack(b'PK\x05\x06', 0, 0, fields[0], *fields, 0))
+        self._file.close()
+
+    def abort(self):
+        """Stop writing the zip file, leaving it incomplete"""
+        self.shutdown(cancel=True)
+        with contextlib.suppress(OSError):
+            self._file.close()
+
+    def shutdown(self, cancel: bool=False):
+        """Stop the thread pools, once any queued files are written unless cancelled"""
+        for pool in (self._pool, self._writer):
+            pool.shutdown(wait=True, cancel_futures=cancel)
+
+class _TarArchive:
+    """A zstd compressed tar file; compressed by the zstd library using a thread per core"""
+    def __init__(self, bfile, zstandard):
+        self._files = contextlib.ExitStack()
+        zstd_writer = self._files.enter_context(
+            zstandard.ZstdCompressor(threads=-1).stream_writer(bfile, closefd=True)
+        )
+        self._tar = self._files.enter_context(tarfile.open(fileobj=zstd_writer, mode='w|'))
+
+    def add(self, filepath: str, arcname: str):
+        """Write a file into the tar file"""
+        self._tar.add(filepath, arcname=arcname, recursive=False)
+
+    def flush(self):
+        """Files are written as they are added"""
+
+    def close(self):
+        """Complete the tar file"""
+        self._files.close()
+
+    def abort(self):
+        """Stop writing the tar file, leaving it incomplete"""
+        with contextlib.suppress(OSError, ValueError, tarfile.TarError):
+            self._files.close()
+
+class OutputBundle:
+    """
+    The output bundle for the run. Files may be added while the run is still in progress
+    (e.g. the output of each manifest row as its stages complete), and are written to the
+    bundle in the background. Files which are already compressed are stored as is.
+    The bundle is written to a partial file, which is only renamed to the bundle file
+    once the bundle is complete, so a failed run never leaves an incomplete bundle.
+    """
+    def __init__(self, compression: str='best', workers: int=None):
+        if compression not in COMPRESSION_CHOICES:
+            raise app.ColophonException(f"Unknown output compression: {compression}")
+        self.compression = compression
+        self.added = set()
+        # The bundle file once complete; until then, it is written to the partial file
+        self.filepath = None
+        self.partpath = None
+        # Paths within the bundle are relative to the workdir of the run
+        self.rootdir = app.workdir
+        self._lock = threading.Lock()
+        # The zip or tar file being written
+        self._archive = None
+        self._open(workers)
+
+    def _suffix(self) -> str:
+        """The file extension of the bundle"""
+        return '.tar.zst' if self.compression == 'zstd' else '.zip'
+
+    def _open(self, workers: int):
+        """Create the partial bundle file in the temp directory"""
+        if self.compression == 'zstd':
+            try:
+                # pylint: disable=import-outside-toplevel
+                import zstandard
+            except ImportError:
+                raise app.ColophonException(
+                    "Output compression 'zstd' requires the zstandard Python package."
+                ) from None
+        fdesc, self.partpath = tempfile.mkstemp(
+            prefix='colophon_', suffix=f"{self._suffix()}.part"
+        )
+        if self.compression == 'zstd':
+            self._archive = _TarArchive(os.fdopen(fdesc, 'wb'), zstandard)
+        else:
+            self._archive = _ZipArchive(
+                os.fdopen(fdesc, 'wb'), _DEFLATE_LEVELS[self.compression],
+                workers if workers else os.cpu_count()
+            )
+
+    def add_tree(self, dirpath: str, exclude: tuple=()):
+        """
+        Add all files within the directory to the bundle
+        args:
+            dirpath: A directory within the workdir
+            exclude: Paths of files relative to the directory to not add
+        """
+        for root, _, files in os.walk(dirpath):
+            for fname in sorted(files):
+                if exclude and os.path.relpath(os.path.join(root, fname), dirpath) in exclude:
+                    continue
+                self.add(os.path.join(root, fname))
+
+    def add(self, filepath: str):
+        """
+        Add a file from within the workdir to the bundle; files already added, and those
+        never bundled, are ignored. For zip bundles, the file is written in the background.
+        args:
+            filepath: The full path to the file
+        """
+        arcname = filepath.removeprefix(self.rootdir).lstrip("/")
+        with self._lock:
+            if arcname in self.added or arcname in NOT_BUNDLED:
+                return
+            self.added.add(arcname)
+            self._archive.add(filepath, arcname)
+
+    def flush(self, exclude: tuple=()):
+        """
+        Add any files in the workdir not already added, and wait for them to be written
+        args:
+            exclude: Paths of files relative to the workdir to not add yet
+        """
+        self.add_tree(self.rootdir, exclude)
+        self._archive.flush()
+
+    def close(self) -> str:
+        """
+        Add any files in the workdir not already added, then complete the bundle
+        returns:
+            The full path to the bundle file
+        """
+        self.flush()
+        self._archive.close()
+        with tempfile.NamedTemporaryFile(
+            prefix='colophon_', suffix=self._suffix(), delete=False
+        ) as btemp:
+            self.filepath = btemp.name
+        os.replace(self.partpath, self.filepath)
+        self.partpath = None
+        return self.filepath
+
+    def abort(self):
+        """Stop writing the bundle and remove the partial bundle file, if not complete"""
+        if self.partpath is None:
+            return
+        self._archive.abort()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.partpath)
+        self.partpath = None
+
+    def __repr__(self):
+        return (
+            f"OutputBundle(filename={os.path.basename(self.filepath or self.partpath)}, "
+            f"compression={self.compression}, files={len(self.added)})"
+        )
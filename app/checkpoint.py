@@ -0,0 +1,153 @@
+"""
+Colophon checkpoint journal of completed stages, so an interrupted run can be resumed
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import app
+
+# Filename of the journal within the workdir
+JOURNAL_FILE = "checkpoint.jsonl"
+# Files within the workdir kept when resuming; all other files directly within the
+# workdir are reports from the interrupted run, which are created again
+KEEP_ON_RESUME = (JOURNAL_FILE, "colophon.log")
+# Maximum seconds between flushing the journal to disk
+SYNC_INTERVAL = 1.0
+
+class Checkpoint:
+    """
+    A journal within the workdir recording each stage run as it completes. The first line
+    identifies the run (the manifest, suite, and source directory), with each following
+    line being a completed stage run. When resumed, stages in the journal are not run
+    again; instead their recorded exit code is used along with the output already in the
+    workdir. Output of stages which did not complete is removed and the stage run again.
+    """
+    def __init__(self):
+        self.filepath = None
+        self.workdir = None
+        # Completed stage runs from the journal being resumed, by stage output dir
+        self.completed = {}
+        self.resumed = False
+        self._file = None
+        self._synced = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def run_identity(manifest: str, suites: str|list, sourcedir: str) -> dict:
+        """Identify a run by its input files, so a resumed run uses the same inputs"""
+        identity = {'dir': [os.path.realpath(sourcedir)]}
+        def file_identity(path: str) -> list:
+            fstat = os.stat(path)
+            return [os.path.realpath(path), fstat.st_size, fstat.st_mtime_ns]
+        identity['manifest'] = file_identity(manifest)
+        if isinstance(suites, str) or len(suites) == 1:
+            identity['suite'] = file_identity(suites if isinstance(suites, str) else suites[0])
+        else:
+            identity['suites'] = [file_identity(suite) for suite in suites]
+        return identity
+
+    def start(self, workdir: str, identity: dict, resume: bool=False):
+        """
+        Start the journal for the run; when resuming, load the existing journal first
+        args:
+            workdir: The workdir of the run
+            identity: The run identity from run_identity()
+            resume: If set, continue the run from the journal in the workdir
+        """
+        self.workdir = workdir
+        self.filepath = os.path.join(workdir, JOURNAL_FILE)
+        self.completed = {}
+        self.resumed = resume
+        if resume:
+            self._load(identity)
+            for fname in os.listdir(workdir):
+                fpath = os.path.join(workdir, fname)
+                if fname not in KEEP_ON_RESUME and os.path.isfile(fpath):
+                    os.remove(fpath)
+        # pylint: disable=consider-using-with
+        self._file = open(self.filepath, 'a', encoding='utf8')
+        if not resume:
+            self._write({"run": identity})
+        app.logger.info(f"Loaded {self}")
+
+    def _load(self, identity: dict):
+        """Load the completed stage runs from the journal"""
+        try:
+            with open(self.filepath, 'rb+') as jfile:
+                lines = jfile.read().split(b"\n")
+                # Last line is incomplete if the run was interrupted while writing it, and
+                # is removed so following records are not appended to it
+                if lines[-1]:
+                    jfile.truncate(jfile.tell() - len(lines[-1]))
+        except FileNotFoundError:
+            raise app.ColophonException(
+                f"Unable to resume; no checkpoint journal in workdir: {self.filepath}"
+            ) from None
+        header = json.loads(lines[0]) if len(lines) > 1 else {}
+        if header.get("run") != identity:
+            raise app.ColophonException(
+                "Unable to resume; the manifest, suite, or source directory is not "
+                f"the same as for the run in the workdir: {header.get('run')}"
+            )
+        for line in lines[1:-1]:
+            record = json.loads(line)
+            self.completed[record["stage-dir"]] = record
+
+    def _write(self, record: dict):
+        """Append a record to the journal, syncing it to disk at most every SYNC_INTERVAL"""
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            if time.monotonic() - self._synced >= SYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._synced = time.monotonic()
+
+    def record(self, stagedir: str, ecode: int, usage: dict=None, restored: bool=False):
+        """
+        Record a stage run as completed, once its output has been written
+        args:
+            stagedir: The full path to the stage output directory
+            ecode: The script exit code
+            usage: The resource usage record from the script run
+            restored: If the output was replayed from the stage cache rather than run
+        """
+        if self._file is None:
+            return
+        self._write({
+            "stage-dir": os.path.relpath(stagedir, self.workdir),
+            "ecode": ecode,
+            "usage": usage,
+            "restored": restored,
+        })
+
+    def done(self, stagedir: str) -> dict:
+        """
+        Get the completed stage run from the journal being resumed. If the stage did not
+        complete, any output it had written is removed so it can be run again.
+        args:
+            stagedir: The full path to the stage output directory
+        returns:
+            The journal record (with 'ecode', 'usage', and 'restored'), or None if the
+            stage must be run
+        """
+        if not self.resumed:
+            return None
+        if (record := self.completed.get(os.path.relpath(stagedir, self.workdir))) is not None:
+            return record
+        shutil.rmtree(stagedir, ignore_errors=True)
+        return None
+
+    def close(self):
+        """Close the journal"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+
+    def __repr__(self):
+        return (
+            f"Checkpoint(filename={os.path.basename(self.filepath or '')}, "
+            f"resumed={self.resumed}, completed={len(self.completed)})"
+        )
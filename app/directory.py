@@ -2,46 +2,126 @@
 Colophon filesystem directory functionality
 """
 import os
+import sys
+import time
+import functools
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from collections.abc import MutableMapping
 import app
+from app.fileindex import FileIndex
+from app.hashing import file_digest
+from app.helpers import peak_rss
+from app.snapshot import DirectorySnapshot
+
+# Number of threads used to scan directories; scanning is dominated by filesystem latency
+SCAN_WORKERS = 16
+
+def glob_match(relpath: str, globs: list) -> bool:
+    """
+    Check if a path matches any of the globs. A glob may match either the full relative
+    path (where '*' also matches '/') or just the final name component.
+    args:
+        relpath: The path relative to the source directory
+        globs: A list of glob patterns
+    """
+    name = os.path.basename(relpath)
+    return any(fnmatchcase(relpath, glob) or fnmatchcase(name, glob) for glob in globs)
 
 class FileInfo(MutableMapping):
-    """File metadata for a file"""
-    def __init__(self, filepath: str):
-        self.file: dict = {}
-        self.file['name'] = os.path.basename(filepath)
-        self.file['path'] = os.path.dirname(filepath)
-        fsplit = os.path.splitext(self.file['name'])
-        self.file['base'] = fsplit[0]
-        self.file['ext'] = fsplit[1][1:]
-        fstat = os.stat(filepath)
-        self.file['size'] = fstat.st_size
+    """
+    File metadata for a file. Uses slots rather than a per-file dict as there may be
+    millions of instances; the mapping interface provides the file fields for templates.
+    """
+    # Fields available via the mapping interface; i.e. 'file.name' in templates
+    FIELDS = ('name', 'path', 'base', 'ext', 'size')
+    __slots__ = ('name', 'path', 'size', 'mtime_ns', 'inode', 'associated', '_extra')
+
+    def __init__(self, filepath: str, fstat: os.stat_result=None):
+        fpath, _, self.name = filepath.rpartition('/')
+        # Same as os.path.split(), which is much slower when loading millions of files
+        if fpath.endswith('/') or (not fpath and filepath.startswith('/')):
+            fpath = os.path.split(filepath)[0]
+        # Many files share the same directory path
+        self.path: str = sys.intern(fpath)
+        fstat = fstat if fstat else os.stat(filepath)
+        self.size: int = fstat.st_size
+        self.mtime_ns: int = fstat.st_mtime_ns
+        self.inode: int = fstat.st_ino
         # Has file been associated with row in the manifest (empty string is unassociated)
         self.associated: str = ''
+        # Any additional fields set on the file
+        self._extra: dict = None
+
+    @property
+    def base(self) -> str:
+        """The filename without its extension"""
+        return os.path.splitext(self.name)[0]
+
+    @property
+    def ext(self) -> str:
+        """The file extension, without the leading dot"""
+        return os.path.splitext(self.name)[1][1:]
 
     @property
     def filepath(self):
         """Return the full filepath of file"""
-        return os.path.join(self.file['path'], self.file['name'])
+        return os.path.join(self.path, self.name)
+
+    def stat(self) -> os.stat_result:
+        """Stat the file, raising ColophonException if it changed since it was loaded"""
+        fstat = os.stat(self.filepath)
+        loaded = (self.size, self.mtime_ns, self.inode)
+        if (fstat.st_size, fstat.st_mtime_ns, fstat.st_ino) != loaded:
+            raise app.ColophonException(f"File was modified during run: {self.filepath}")
+        return fstat
+
+    def digest(self, algo: str="md5") -> str:
+        """
+        Get the hash of the file contents, using the persistent hash cache if enabled
+        args:
+            algo: The hash algorithm; e.g. md5, sha1, sha256
+        returns:
+            The lowercase hex digest
+        """
+        if app.hashcache is None:
+            return file_digest(self.filepath, algo)
+        return app.hashcache.digest(self.filepath, algo, self.stat())
 
     def __iter__(self):
-        for key in self.file:
-            yield key
+        yield from self.FIELDS
+        if self._extra:
+            yield from self._extra
 
     def __len__(self):
-        return len(self.file)
+        return len(self.FIELDS) + (len(self._extra) if self._extra else 0)
 
     def __getitem__(self, key):
-        return self.file[key]
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
 
     def __setitem__(self, key, val):
-        self.file[key] = val
+        if key in self.FIELDS:
+            if key in ('base', 'ext'):
+                raise app.ColophonException(f"Cannot set derived file field: {key}")
+            setattr(self, key, val)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = val
 
     def __delitem__(self, key):
-        del self.file[key]
+        if key in self.FIELDS:
+            raise app.ColophonException(f"Cannot remove file field: {key}")
+        if not self._extra or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
 
     def __repr__(self):
-        return f"FileInfo({self.filepath}, size={self.file['size']}, associated={self.associated})"
+        return f"FileInfo({self.filepath}, size={self.size}, associated={self.associated})"
 
 class Directory(MutableMapping):
     """
@@ -49,9 +129,17 @@ class Directory(MutableMapping):
     """
     _instantiated: bool = False
 
-    def __init__(self, dirpath: str=None):
+    def __init__(
+        self, dirpath: str=None, include: list=None, exclude: list=None,
+        snapshot: DirectorySnapshot=None
+    ):
         self.dirpath = None
         self.filelist = None
+        self._index = None
+        self.include = include if include else []
+        self.exclude = exclude if exclude else []
+        # If set, only directories changed since the snapshot are scanned
+        self.snapshot = snapshot
         if dirpath:
             self.load(dirpath)
 
@@ -79,14 +167,91 @@ class Directory(MutableMapping):
                 f"Unable to read from specified directory: {os.path.abspath(self.dirpath)}"
             )
         self.filelist = {}
+        self._index = None
         self.chdir()
         app.logger.info(f"Building file list for: {os.path.basename(self.dirpath)}")
-        for root, _, files in os.walk('.'):
-            for filename in files:
-                filepath = os.path.join(root, filename).removeprefix("./")
-                self.filelist[filepath] = FileInfo(filepath)
+        started = time.monotonic()
+        scanned = self.scan('.')
+        if self.snapshot is not None:
+            self.snapshot.save(scanned)
+            app.logger.info(f"Updated {self.snapshot}")
+        # Assemble in the same order as a top-down os.walk(); files of a directory
+        # followed by each of its subdirectories in turn
+        dirstack = ['.']
+        while dirstack:
+            files, subdirs = scanned[dirstack.pop()]
+            for filepath, fstat in files:
+                self.filelist[filepath] = FileInfo(filepath, fstat)
+            dirstack.extend(reversed(subdirs))
+        elapsed = time.monotonic() - started
+        app.logger.info(
+            f"Scanned {len(self.filelist)} files in {len(scanned)} directories in {elapsed:.2f}s "
+            f"({len(self.filelist) / elapsed if elapsed else 0:.0f} files/sec); "
+            f"peak memory usage (RSS): {peak_rss()}"
+        )
         app.logger.info(f"Loaded {self}")
 
+    def scan(self, top: str, workers: int=SCAN_WORKERS) -> dict:
+        """
+        Scan a directory tree, scanning subdirectories concurrently
+        args:
+            top: The directory to scan from
+            workers: Number of directories to scan at once
+        returns:
+            A dict of each scanned directory to a tuple of:
+              - A list of (filepath, stat) pairs for included files in the directory
+              - A list of subdirectories
+        """
+        scanned = {}
+        scan_dir = self._scan_dir
+        if self.snapshot is not None:
+            scan_dir = functools.partial(self.snapshot.scan_dir, scan_dir=self._scan_dir)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(scan_dir, top)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirpath, files, subdirs = future.result()
+                    scanned[dirpath] = (files, subdirs)
+                    pending |= {pool.submit(scan_dir, subdir) for subdir in subdirs}
+        return scanned
+
+    def _scan_dir(self, dirpath: str) -> tuple[str, list, list]:
+        """
+        Scan a single directory, re-using the stat from the directory entries
+        returns:
+            tuple(str, list, list): The directory, (filepath, stat) pairs, subdirectories
+        """
+        files, subdirs = [], []
+        try:
+            with os.scandir(dirpath) as dentries:
+                for dentry in dentries:
+                    relpath = os.path.join(dirpath, dentry.name).removeprefix("./")
+                    if self.exclude and glob_match(relpath, self.exclude):
+                        continue
+                    # Same as os.walk(); symlinks to directories are not followed
+                    if dentry.is_dir():
+                        if not dentry.is_symlink():
+                            subdirs.append(relpath)
+                        continue
+                    if self.include and not glob_match(relpath, self.include):
+                        continue
+                    try:
+                        files.append((relpath, dentry.stat()))
+                    except OSError as exc:
+                        app.logger.warning(f"Unable to read file: {exc}")
+        except OSError as exc:
+            # Same as os.walk(); unreadable directories are skipped
+            app.logger.warning(f"Unable to scan directory: {exc}")
+        return dirpath, files, subdirs
+
+    @property
+    def index(self) -> FileIndex:
+        """Return name indexes over the filelist, building them if needed"""
+        if self._index is None:
+            self._index = FileIndex(self.filelist if self.filelist is not None else {})
+        return self._index
+
     def files(self, associated: bool=True):
         """Iterate through files, returning only either associated/unassociated files"""
         for fpair in self:
@@ -101,13 +266,14 @@ class Directory(MutableMapping):
 
     def __setitem__(self, key, val):
         self.filelist[key] = val
+        self._index = None
 
     def __delitem__(self, key):
         del self.filelist[key]
+        self._index = None
 
     def __iter__(self):
-        for fpair in self.filelist.items():
-            yield fpair
+        yield from self.filelist.items()
 
     def __repr__(self):
         return (
@@ -0,0 +1,142 @@
+"""
+Colophon ordering of stage runs by where the files they read are stored on disk
+"""
+import os
+import fcntl
+import struct
+import threading
+import app
+from app.manifest import ManifestEntry
+from app.suite import SuiteStage
+from app.template import template_variables
+
+# ioctl to get the extents of a file on Linux; _IOWR('f', 11, struct fiemap)
+FS_IOC_FIEMAP = 0xC020660B
+# struct fiemap: start, length, flags, mapped extents, extent count, reserved
+_FIEMAP = struct.Struct('=QQLLLL')
+# struct fiemap_extent: logical, physical, length, reserved, flags, reserved
+_FIEMAP_EXTENT = struct.Struct('=QQQ16xL12x')
+
+def physical_offset(filepath: str) -> int:
+    """
+    Get the position on disk of the start of the file
+    returns:
+        The physical byte offset of the file's first extent, 0 if the file has no extents,
+        or None if the filesystem cannot report it
+    """
+    request = bytearray(_FIEMAP.pack(0, 2**64 - 1, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+    try:
+        with open(filepath, 'rb') as ffile:
+            fcntl.ioctl(ffile.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    if _FIEMAP.unpack_from(request)[3] == 0:
+        return 0
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP.size)[1]
+
+class DiskOrder:
+    """
+    Orders manifest rows, and the stages of each row, by where on disk the files they
+    read are stored. Rows are run in order of their largest file, and the stages of a
+    row grouped by the largest file each reads, so all stages reading a file run
+    together while it is still in the page cache, and files are read in the order they
+    are laid out on disk. Where the filesystem cannot report the position of files on
+    disk, files are ordered by directory and inode instead.
+    """
+    def __init__(self):
+        # File path to its position on disk
+        self.positions = {}
+        self._lock = threading.Lock()
+
+    def position(self, filepath: str) -> tuple:
+        """The sort key for where the file is stored on disk"""
+        if (position := self.positions.get(filepath)) is None:
+            try:
+                fstat = os.stat(filepath)
+            except OSError:
+                return ()
+            offset = physical_offset(filepath)
+            if offset is None:
+                position = (fstat.st_dev, os.path.dirname(filepath), fstat.st_ino)
+            else:
+                position = (fstat.st_dev, '', offset)
+            with self._lock:
+                self.positions[filepath] = position
+        return position
+
+    def _largest_position(self, filepaths: list) -> tuple:
+        """The sort key of the largest of the files; reading it takes the most time"""
+        # pylint: disable=unsubscriptable-object,unsupported-membership-test
+        sizes = [
+            (app.sourcedir[fpath].size if fpath in app.sourcedir else 0, fpath)
+            for fpath in filepaths
+        ]
+        if not sizes:
+            return ()
+        return self.position(max(sizes, key=lambda size: size[0])[1])
+
+    def order_entries(self, entries: list) -> list:
+        """
+        Order manifest rows by the position on disk of their largest associated file
+        args:
+            entries: The manifest entries
+        returns:
+            The entries, reordered; rows without files first, in manifest order
+        """
+        return sorted(entries, key=lambda entry: self._largest_position(entry.associated))
+
+    @staticmethod
+    def stage_files(stage: SuiteStage, entry: ManifestEntry) -> list:
+        """
+        Get the associated files of a manifest row which a stage reads; that is, the files
+        of the fields its script (or arguments) make use of
+        args:
+            stage: The stage
+            entry: The manifest entry the stage is run with
+        returns:
+            A list of file paths
+        """
+        templates = [stage.raw_script] if stage.raw_script else []
+        for aval in stage.raw_args.values():
+            templates.extend(aval if isinstance(aval, list) else [aval])
+        associated = set(entry.associated)
+        filepaths = []
+        for template in templates:
+            if not isinstance(template, str):
+                continue
+            for field in sorted(template_variables(template) or ()):
+                values = entry[field] if field in entry else None
+                for value in values if isinstance(values, list) else [values]:
+                    if isinstance(value, str) and value in associated:
+                        filepaths.append(value)
+        return filepaths
+
+    def order_stages(self, stages: list, entry: ManifestEntry) -> list:
+        """
+        Order stages by the position on disk of the largest file each reads, with each
+        stage still coming after the stages it needs
+        args:
+            stages: The stages, in suite order
+            entry: The manifest entry the stages are run with
+        returns:
+            The stages, reordered; stages not reading any files first, in suite order
+        """
+        pending = sorted(
+            stages, key=lambda stage: self._largest_position(self.stage_files(stage, entry))
+        )
+        ordered, names = [], set()
+        while pending:
+            # Suite stages are already in an order where some stage is always ready
+            stage = next(
+                stage for stage in pending if all(need in names for need in stage.needs)
+            )
+            pending.remove(stage)
+            ordered.append(stage)
+            names.add(stage.name)
+        return ordered
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self):
+        return f"DiskOrder(files={len(self)})"
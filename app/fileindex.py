@@ -0,0 +1,138 @@
+"""
+Colophon file name indexes for planning file matches
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+import app
+from app.template import render_template_string, references_variable
+
+# File rule conditions which can be served from a name index; regex last, as it is only
+# looked up when no other condition narrows the candidates
+INDEXED_CONDITIONS = ('equals', 'startswith', 'endswith', 'regex')
+# Only rules comparing against the file name can be served from a name index
+_FILE_NAME_VALUE = re.compile(r'^\{\{\s*file\.name\s*\}\}$')
+
+def plan_conditions(file_match: dict) -> list:
+    """
+    Determine which conditions of a file rule can be served from the name index.
+    args:
+        file_match: A file rule from the suite's manifest.files
+    returns:
+        A list of condition keys which can be looked up in a FileIndex; an empty
+        list means the rule must fall back to a full directory scan
+    """
+    if not _FILE_NAME_VALUE.match(file_match.get('value', '{{ file.name }}')):
+        return []
+    return [
+        ckey for ckey in INDEXED_CONDITIONS
+        if isinstance(file_match.get(ckey), str)
+        # Regex patterns are not rendered
+        and (ckey == 'regex' or not references_variable(file_match[ckey], 'file'))
+    ]
+
+class FileIndex:
+    """
+    Indexes over file names from a Directory filelist, allowing the candidate files for
+    equals/startswith/endswith conditions to be found without scanning every file.
+    Regex patterns are never rendered, so the files each pattern matches are the same for
+    every manifest row; these are found with a single pass over the files the first time
+    the pattern is looked up. Candidates are always returned in the same order as the
+    filelist.
+    """
+    def __init__(self, filelist: dict):
+        self.entries = list(filelist.items())
+        self._indexes = {}
+        self._regexes = {}
+
+    def _index(self, ignorecase: bool) -> dict:
+        """Build (or return already built) indexes for the given case sensitivity"""
+        if ignorecase not in self._indexes:
+            names = [
+                finfo['name'].lower() if ignorecase else finfo['name']
+                for _, finfo in self.entries
+            ]
+            equals = defaultdict(list)
+            for pos, name in enumerate(names):
+                equals[name].append(pos)
+            prefixes = sorted(zip(names, range(len(names))))
+            suffixes = sorted(zip((name[::-1] for name in names), range(len(names))))
+            self._indexes[ignorecase] = {
+                'names': names,
+                'equals': dict(equals),
+                'startswith': ([key for key, _ in prefixes], [pos for _, pos in prefixes]),
+                'endswith': ([key for key, _ in suffixes], [pos for _, pos in suffixes]),
+            }
+        return self._indexes[ignorecase]
+
+    @staticmethod
+    def _sorted_range(keys: list, positions: list, prefix: str) -> list:
+        """Return positions for all sorted keys starting with prefix"""
+        matched = []
+        for idx in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[idx].startswith(prefix):
+                break
+            matched.append(positions[idx])
+        return matched
+
+    def _regex_positions(self, pattern: str, ignorecase: bool) -> list:
+        """Return positions for all file names the regex pattern matches"""
+        if (pattern, ignorecase) not in self._regexes:
+            names = self._index(ignorecase)['names']
+            search = re.compile(pattern, re.IGNORECASE if ignorecase else 0).search
+            self._regexes[(pattern, ignorecase)] = [
+                pos for pos, name in enumerate(names) if search(name)
+            ]
+        return self._regexes[(pattern, ignorecase)]
+
+    def lookup(self, ckey: str, cstr: str, ignorecase: bool=False) -> list:
+        """
+        Find the positions of files whose name could satisfy a single condition
+        args:
+            ckey: The condition type; one of INDEXED_CONDITIONS
+            cstr: The rendered condition value, or the pattern for regex
+            ignorecase: Whether the comparison is case insensitive
+        returns:
+            A list of positions into entries (unordered)
+        """
+        if ckey == 'regex':
+            return self._regex_positions(cstr, ignorecase)
+        index = self._index(ignorecase)
+        cstr = cstr.lower() if ignorecase else cstr
+        if ckey == 'equals':
+            return index['equals'].get(cstr, [])
+        if ckey == 'startswith':
+            return self._sorted_range(*index['startswith'], cstr)
+        return self._sorted_range(*index['endswith'], cstr[::-1])
+
+    def candidates(self, file_match: dict, planned: list, context: dict):
+        """
+        Get the candidate files which might match the file rule for the given context.
+        args:
+            file_match: A file rule from the suite's manifest.files
+            planned: The condition keys from plan_conditions() for the rule
+            context: The manifest entry context (without the 'file' variable)
+        returns:
+            A list of (fpath, FileInfo) pairs in filelist order, or None if the
+            rule cannot be served from the index
+        """
+        ignorecase = file_match.get('ignorecase', False)
+        best = None
+        for ckey in planned:
+            if ckey == 'regex':
+                # Finding the files the pattern matches takes a pass over every file the
+                # first time, so is only done if no other condition gave candidates
+                if best is None:
+                    best = self.lookup(ckey, file_match[ckey], ignorecase)
+                continue
+            try:
+                cstr = render_template_string(file_match[ckey], context)
+            except (TypeError, app.TemplateRenderFailure):
+                # Let the full scan handle (and report) render failures
+                return None
+            positions = self.lookup(ckey, cstr, ignorecase)
+            if best is None or len(positions) < len(best):
+                best = positions
+        if best is None:
+            return None
+        return [self.entries[pos] for pos in sorted(best)]
@@ -4,7 +4,8 @@ Colophon file matching logic
 import app
 from app.manifest import ManifestEntry
 from app.directory import FileInfo
-from app.helpers import value_match
+from app.fileindex import plan_conditions
+from app.helpers import compiled_match
 
 class FileMatcher:
     """
@@ -17,6 +18,8 @@ class FileMatcher:
         self.failures = []
         self.entry = entry
         self.fmatch = file_match
+        self.planned = plan_conditions(self.fmatch)
+        self.compiled = compiled_match(self.fmatch.get('value', '{{ file.name }}'), self.fmatch)
         self.optional = self.fmatch.get('optional', False)
         self.linkedto = self.fmatch.get('linkedto', None)
         self.multiple = (
@@ -133,6 +136,16 @@ class FileMatcher:
             else:
                 self.files.append(filepath)
 
+    def candidates(self, entry_ctx: dict):
+        """
+        Iterate over the files which could match for the given context; uses the
+        directory name index when the rule allows, otherwise every file.
+        """
+        planned = None
+        if self.planned:
+            planned = app.sourcedir.index.candidates(self.fmatch, self.planned, entry_ctx)
+        return iter(app.sourcedir) if planned is None else iter(planned)
+
     def process(self):
         """
         Run the file matching process
@@ -158,9 +171,11 @@ class FileMatcher:
 
             # Search all files to find a match
             try:
-                for fpath, finfo in app.sourcedir:
-                    context = {**entry_ctx, **{'file': dict(finfo)}}
-                    if value_match(self.fmatch.get('value', '{{ file.name }}'), self.fmatch, context):
+                candidates = self.candidates(entry_ctx)
+                # Conditions which are the same for every file are rendered only once
+                bound = self.compiled.bind(entry_ctx)
+                for fpath, finfo in candidates:
+                    if bound.matches(finfo):
                         self.set_label(fpath)
                         self.associate_file(finfo)
                         self.set_file(filepath=finfo.filepath)
@@ -0,0 +1,131 @@
+"""
+Colophon persistent file hash cache
+"""
+import os
+import pathlib
+import threading
+import app
+from app.hashing import multi_digest
+from app.helpers import cache_path, replaced_file
+
+class HashCache:
+    """
+    A persistent cache of file hashes, stored as an append-only tab separated file
+    so it may also be read and appended to by scripts. Each line is:
+        ALGO  DIGEST  SIZE  MTIME_NS  INODE  REALPATH
+    A cached hash is only used if the file's size, mtime (in nanoseconds), and inode are
+    unchanged; otherwise the hash is computed again and a new line appended. When the
+    file is loaded, it is compacted if it holds many superseded lines.
+    """
+    def __init__(self, filepath: str=None):
+        self.filepath = None
+        self.hashes = None
+        self._lock = threading.Lock()
+        if filepath:
+            self.load(filepath)
+
+    @staticmethod
+    def default_path() -> str:
+        """The default location of the hash cache file"""
+        return cache_path('hashes.tsv')
+
+    def load(self, filepath: str=None):
+        """Load the cache file, creating it if it does not yet exist"""
+        self.filepath = os.path.abspath(filepath) if filepath else self.filepath
+        self.hashes = {}
+        lines = 0
+        try:
+            pathlib.Path(self.filepath).parent.mkdir(parents=True, exist_ok=True)
+            pathlib.Path(self.filepath).touch()
+            with open(self.filepath, 'r', encoding='utf8') as cfile:
+                for line in cfile:
+                    lines += 1
+                    fields = line.rstrip('\n').split('\t', 5)
+                    if len(fields) != 6 or not all(fld.isdigit() for fld in fields[2:5]):
+                        continue
+                    algo, digest, size, mtime_ns, inode, realpath = fields
+                    self.hashes[(realpath, algo)] = (int(size), int(mtime_ns), int(inode), digest)
+        except OSError as exc:
+            raise app.ColophonException(
+                f"Unable to use hash cache file {self.filepath}: {exc}"
+            ) from None
+        # Compact if over half the lines have been superseded
+        if lines > 2 * len(self.hashes):
+            self.compact()
+        app.logger.info(f"Loaded {self}")
+
+    def compact(self):
+        """Rewrite the cache file keeping only the latest line for each file and algorithm"""
+        with self._lock:
+            with replaced_file(self.filepath) as tfile:
+                for (realpath, algo), (size, mtime_ns, inode, digest) in self.hashes.items():
+                    tfile.write(f"{algo}\t{digest}\t{size}\t{mtime_ns}\t{inode}\t{realpath}\n")
+
+    @staticmethod
+    def identity(fstat: os.stat_result) -> tuple:
+        """The identity of a file version used to decide if a cached hash is still valid"""
+        return (fstat.st_size, fstat.st_mtime_ns, fstat.st_ino)
+
+    def lookup(self, filepath: str, algo: str, fstat: os.stat_result=None) -> str:
+        """
+        Get a cached hash for a file
+        args:
+            filepath: The file to get a hash for
+            algo: The hash algorithm
+            fstat: The file's stat result, if already known
+        returns:
+            The cached hex digest, or None if not cached or the file has changed
+        """
+        fstat = fstat if fstat else os.stat(filepath)
+        cached = self.hashes.get((os.path.realpath(filepath), algo))
+        if cached and cached[:3] == self.identity(fstat):
+            return cached[3]
+        return None
+
+    def store(self, filepath: str, algo: str, digest: str, fstat: os.stat_result=None):
+        """
+        Add a file hash to the cache
+        args:
+            filepath: The file the hash is for
+            algo: The hash algorithm
+            digest: The hex digest
+            fstat: The file's stat result at the time the hash was computed
+        """
+        fstat = fstat if fstat else os.stat(filepath)
+        realpath = os.path.realpath(filepath)
+        # Such paths cannot be stored in the line based file
+        if '\t' in realpath or '\n' in realpath:
+            return
+        size, mtime_ns, inode = self.identity(fstat)
+        with self._lock:
+            self.hashes[(realpath, algo)] = (size, mtime_ns, inode, digest)
+            with open(self.filepath, 'a', encoding='utf8') as cfile:
+                cfile.write(f"{algo}\t{digest}\t{size}\t{mtime_ns}\t{inode}\t{realpath}\n")
+
+    def digest(self, filepath: str, algo: str, fstat: os.stat_result=None) -> str:
+        """
+        Get the hash for a file, from the cache if still valid, otherwise computing
+        it and adding it to the cache.
+        """
+        return self.digests(filepath, [algo], fstat)[algo]
+
+    def digests(self, filepath: str, algos: list, fstat: os.stat_result=None) -> dict:
+        """
+        Get hashes for multiple algorithms for a file, from the cache if still valid.
+        Any hashes not in the cache are computed from a single read of the file.
+        returns:
+            A dict of algorithm name to hex digest
+        """
+        fstat = fstat if fstat else os.stat(filepath)
+        digests = {algo: self.lookup(filepath, algo, fstat) for algo in algos}
+        if missing := [algo for algo, digest in digests.items() if digest is None]:
+            for algo, digest in multi_digest(filepath, missing).items():
+                self.store(filepath, algo, digest, fstat)
+                digests[algo] = digest
+        return digests
+
+    def __len__(self):
+        return len(self.hashes) if self.hashes is not None else 0
+
+    def __repr__(self):
+        return f"HashCache(filename={os.path.basename(self.filepath)}, hashes={len(self)})"
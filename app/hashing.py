@@ -0,0 +1,193 @@
+"""
+Colophon in-process file hashing and hash verification
+"""
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import app
+
+# Size of each read when hashing a file; a multiple of common filesystem block sizes
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+# Algorithms supported when verifying hashes; same as the verify-hash script
+ALLOWED_ALGOS = ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512')
+
+def multi_digest(filepath: str, algos: list, chunk_size: int=HASH_CHUNK_SIZE) -> dict:
+    """
+    Compute hex digests for multiple algorithms while reading the file only once.
+    When more than one algorithm is requested, each algorithm hashes in its own thread
+    (hashlib releases the GIL for large updates) while the next chunk is being read.
+    args:
+        filepath: The file to hash
+        algos: The hashlib algorithm names; e.g. ['md5', 'sha256']
+        chunk_size: The size of each read
+    returns:
+        A dict of algorithm name to lowercase hex digest
+    """
+    hashers = {algo: hashlib.new(algo) for algo in algos}
+    with open(filepath, 'rb', buffering=0) as hfile:
+        if len(hashers) == 1:
+            hasher = next(iter(hashers.values()))
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            while nread := hfile.readinto(buf):
+                hasher.update(view[:nread])
+        else:
+            # Double buffer: hash one chunk while reading into the other
+            bufs = [bytearray(chunk_size), bytearray(chunk_size)]
+            pending = []
+            with ThreadPoolExecutor(max_workers=len(hashers)) as pool:
+                idx = 0
+                while nread := hfile.readinto(bufs[idx]):
+                    for future in pending:
+                        future.result()
+                    view = memoryview(bufs[idx])[:nread]
+                    pending = [pool.submit(hasher.update, view) for hasher in hashers.values()]
+                    idx = 1 - idx
+                for future in pending:
+                    future.result()
+    return {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
+
+def file_digest(filepath: str, algo: str) -> str:
+    """
+    Compute the hex digest of a file's contents
+    args:
+        filepath: The file to hash
+        algo: The hashlib algorithm name; e.g. md5, sha1, sha256
+    returns:
+        The lowercase hex digest
+    """
+    return multi_digest(filepath, [algo])[algo]
+
+def file_digests(filepath: str, algos: list) -> dict:
+    """
+    Get hex digests for a file, using the persistent hash cache if enabled
+    args:
+        filepath: The file to hash
+        algos: The hashlib algorithm names
+    returns:
+        A dict of algorithm name to lowercase hex digest
+    """
+    if app.hashcache is None:
+        return multi_digest(filepath, algos)
+    return app.hashcache.digests(filepath, algos)
+
+def _first_word_lower(text: str) -> str:
+    """First whitespace separated word of the first line, lowercased"""
+    words = text.lower().split('\n', 1)[0].split()
+    return words[0] if words else ''
+
+def _read_hash(hash_file: str) -> str:
+    """The hash from a hash file; the first word of its first line, lowercased"""
+    with open(hash_file, 'r', encoding='utf8', errors='replace') as hfh:
+        return _first_word_lower(hfh.read())
+
+def _unsupported(algo: str) -> str:
+    """The failure message for a hash algorithm which is not supported"""
+    return f"Unsupported hash algorithm: {algo}. Supported: {' '.join(ALLOWED_ALGOS)}"
+
+def _arguments_problem(check_file: str, hash_files: list, hash_str: str, algo: str) -> tuple:
+    """
+    Check the arguments to verify_hash(), the same as the verify-hash script does
+    returns:
+        tuple(int, str): The exit code and failure message of the first problem found,
+            or None if the arguments are okay
+    """
+    missing = [hfile for hfile in hash_files if not os.path.isfile(hfile)]
+    problems = [
+        (not check_file, 5, "Failure: Missing required check-file"),
+        (not os.path.isfile(check_file or ''), 3, f"File to check does not exist: {check_file}"),
+        (missing, 3, f"Hash file does not exist: {missing[0] if missing else ''}"),
+        (algo and algo not in ALLOWED_ALGOS, 5, _unsupported(algo)),
+        (hash_files and hash_str, 5, "Can only verify either hash-file or hash-str, but not both."),
+        (hash_str and not algo, 5, "An algo must be provided when verifying a hash-str."),
+        (
+            not hash_files and not hash_str
+            and not (algo and os.path.isfile(f"{check_file}.{algo}")),
+            5, "No hash source provided."
+        ),
+    ]
+    return next(((ecode, msg) for failed, ecode, msg in problems if failed), None)
+
+def verify_hash(
+    check_file: str,
+    hash_file: str|list=None,
+    hash_str: str=None,
+    algo: str=None
+) -> tuple[int, list, list, list]:
+    """
+    Verify a file's contents match the given hash(es). Behaves the same as the
+    verify-hash script, except any number of hash files may be given, all of which
+    are verified from a single read of the file.
+    args:
+        check_file: The file to verify
+        hash_file: A file (or list of files) containing a hash to verify against
+        hash_str: A string hash to verify against
+        algo: The algorithm; if not set, taken from the hash file extension
+    returns:
+        tuple(int, list, list, list): Exit code, stdout lines, stderr lines, results
+    """
+    stdout, stderr = [], []
+    def fail(ecode, msg):
+        stderr.append(f"{msg}\n".encode())
+        return ecode, stdout, stderr, []
+
+    hash_files = [hash_file] if isinstance(hash_file, str) else list(hash_file or [])
+    if (problem := _arguments_problem(check_file, hash_files, hash_str, algo)) is not None:
+        return fail(*problem)
+    if not hash_files and not hash_str:
+        hash_files = [f"{check_file}.{algo}"]
+        stdout.append(f"No hash source provided. Assuming: {hash_files[0]}\n".encode())
+
+    # Pairs of (algorithm, expected hash)
+    expected = []
+    if hash_str:
+        expected.append((algo, _first_word_lower(hash_str)))
+        stdout.append(f"Read hash {expected[-1][1]} from hash string\n".encode())
+    for hfile in hash_files:
+        halgo = algo
+        if not halgo:
+            halgo = hfile.rsplit('.', 1)[-1]
+            stdout.append(f"No algorithm provided. Trying extension from: {hfile}\n".encode())
+            if halgo not in ALLOWED_ALGOS:
+                return fail(5, _unsupported(halgo))
+        expected.append((halgo, _read_hash(hfile)))
+        stdout.append(f"Read hash {expected[-1][1]} from {hfile}\n".encode())
+
+    computed = file_digests(check_file, list(dict.fromkeys(halgo for halgo, _ in expected)))
+    results = []
+    for halgo, hverify in expected:
+        stdout.append(f"Computed hash {computed[halgo]} from {check_file} using {halgo}\n".encode())
+        if hverify != computed[halgo]:
+            stdout.append(b"Hashes do NOT match.\n")
+        results.append({
+            "filepath": check_file,
+            "algorithm": halgo,
+            "expected": hverify,
+            "computed": computed[halgo],
+            "matched": hverify == computed[halgo],
+        })
+
+    if not all(result["matched"] for result in results):
+        stdout.append(b"Hash check failed.\n")
+        return 1, stdout, stderr, results
+    stdout.append(b"Hash checked and verified as matching.\n")
+    return 0, stdout, stderr, results
+
+def verify_hash_stage(args: dict, results_path: str) -> tuple[int, list, list]:
+    """
+    Run a 'verify-hash:' suite stage in-process, adding results to the results JSON
+    the same as the verify-hash script.
+    args:
+        args: The rendered stage arguments; check-file, hash-file, hash-str, algo
+        results_path: The results JSON file for the stage
+    returns:
+        tuple(int, list, list): Exit code, stdout lines as list, stderr lines as list
+    """
+    app.logger.debug(f"Executing (native=verify-hash): {args}")
+    ecode, stdout, stderr, results = verify_hash(
+        args.get('check-file'), args.get('hash-file'), args.get('hash-str'), args.get('algo')
+    )
+    if results:
+        app.append_results(results_path, 'verify-hash', results)
+    app.logger.debug(f"Command exited with code: {ecode}")
+    return ecode, stdout, stderr
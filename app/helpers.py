@@ -1,11 +1,18 @@
 """
 Helper functions
 """
+import os
 import re
+import resource
+import tempfile
+from contextlib import contextmanager
 import app
-from app.template import render_template_string
+from app.template import render_template_string, references_variable
 
 CACHED_REGEX = {}
+CACHED_MATCHES = {}
+# A template which is only a single file field; e.g. '{{ file.name }}'
+_FILE_FIELD = re.compile(r'^\{\{\s*file\.(\w+)\s*\}\}$')
 
 def cached_re_search(pattern: str, string: str, flags: int = 0):
     """
@@ -54,11 +61,161 @@ def value_match(value: str, conditions: dict, context: dict = None):
                 re.IGNORECASE if ignorecase else 0
             ) is not None
         elif ckey in ('greaterthan', 'lessthan'):
-            if ckey == 'lessthan':
-                vstr, cstr = cstr, vstr
-            matched &= vstr.isdigit() and cstr.isdigit() and int(vstr) > int(cstr)
+            matched &= _compare_numeric(ckey, vstr, cstr)
     return matched
 
+def _compare_numeric(ckey: str, vstr: str, cstr: str) -> bool:
+    """Check a greaterthan/lessthan condition; both must be integer strings"""
+    if ckey == 'lessthan':
+        vstr, cstr = cstr, vstr
+    return vstr.isdigit() and cstr.isdigit() and int(vstr) > int(cstr)
+
+def _file_field(finfo, field: str):
+    """Get a file field the same way a template would; an attribute, else a key, else empty"""
+    try:
+        return getattr(finfo, field)
+    except AttributeError:
+        return finfo.get(field, '')
+
+def compiled_match(value: str, conditions: dict) -> 'CompiledMatch':
+    """
+    Get a CompiledMatch for the value and conditions, re-using a cached instance if available.
+    """
+    match_key = (value, tuple(conditions.items()))
+    if match_key not in CACHED_MATCHES:
+        CACHED_MATCHES[match_key] = CompiledMatch(value, conditions)
+    return CACHED_MATCHES[match_key]
+
+class CompiledMatch:
+    """
+    A value_match() for file rules, split into two phases. Templates which do not make
+    use of the 'file' variable are rendered only once per manifest row (see bind()),
+    and templates which are only a file field (e.g. '{{ file.name }}') are read directly
+    from the file; leaving only plain string/regex comparisons to be done for each file.
+    """
+    def __init__(self, value: str, conditions: dict):
+        self.ignorecase = conditions.get('ignorecase', False)
+        self.conditions = [
+            (ckey, cval) for ckey, cval in conditions.items()
+            if ckey not in ("ignorecase", "multiple", "optional")
+        ]
+        self.templates = [value] + [cval for _, cval in self.conditions]
+        # For each template; None if the same for every file, the field name if it is only
+        # a file field, otherwise True if it must be rendered for each file
+        self.file_refs = []
+        for template in self.templates:
+            file_ref = None
+            if references_variable(template, 'file'):
+                fmatch = _FILE_FIELD.match(template)
+                file_ref = fmatch.group(1) if fmatch else True
+            self.file_refs.append(file_ref)
+
+    def bind(self, context: dict) -> 'BoundMatch':
+        """
+        Bind the match to the context for a manifest row
+        args:
+            context: The manifest entry context; the 'file' variable will be set in it
+        """
+        return BoundMatch(self, context)
+
+class BoundMatch:
+    """A CompiledMatch bound to a single manifest row context, to test files against"""
+    def __init__(self, compiled: CompiledMatch, context: dict):
+        self.compiled = compiled
+        self.context = context
+        self._rendered = None
+
+    def matches(self, finfo) -> bool:
+        """
+        Check if the file matches all conditions for the row
+        raises:
+            TemplateRenderFailure if a template fails to render
+        """
+        compiled = self.compiled
+        ignorecase = compiled.ignorecase
+        self.context['file'] = finfo
+        # Rendered when the first file is checked, so any render failures are raised
+        # at the same point as with value_match()
+        if self._rendered is None:
+            self._rendered = [
+                None if file_ref else _prerender_value(template, self.context, ignorecase)
+                for template, file_ref in zip(compiled.templates, compiled.file_refs)
+            ]
+        strs = []
+        for template, file_ref, rendered in zip(
+            compiled.templates, compiled.file_refs, self._rendered
+        ):
+            if file_ref is None:
+                strs.append(rendered)
+            elif file_ref is True:
+                strs.append(_prerender_value(template, self.context, ignorecase))
+            else:
+                fstr = str(_file_field(finfo, file_ref))
+                strs.append(fstr.lower() if ignorecase else fstr)
+
+        return all(
+            _condition_met(ckey, cval, strs[0], cstr, ignorecase)
+            for (ckey, cval), cstr in zip(compiled.conditions, strs[1:])
+        )
+
+def _condition_met(ckey: str, cval: str, vstr: str, cstr: str, ignorecase: bool) -> bool:
+    """Check a single condition of a match against rendered strings; unknown keys are met"""
+    if ckey == 'equals':
+        return vstr == cstr
+    if ckey == 'startswith':
+        return vstr.startswith(cstr)
+    if ckey == 'endswith':
+        return vstr.endswith(cstr)
+    if ckey == 'regex':
+        return cached_re_search(
+            cval,   # Intentionally not rendering Regex patterns
+            vstr,
+            re.IGNORECASE if ignorecase else 0
+        ) is not None
+    if ckey in ('greaterthan', 'lessthan'):
+        return _compare_numeric(ckey, vstr, cstr)
+    return True
+
+def cache_path(*parts: str) -> str:
+    """
+    A path within Colophon's directory of the user's cache home
+    args:
+        parts: The path components within the directory
+    returns:
+        The path, under $XDG_CACHE_HOME if set, else ~/.cache
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'colophon', *parts)
+
+@contextmanager
+def replaced_file(filepath: str, mode: str = 'w'):
+    """
+    Write a file in full before it replaces any existing file at the path, so the path
+    never holds a partially written file; the file is written to a temporary file in the
+    same directory, which is removed if writing fails
+    args:
+        filepath: The path of the file to write
+        mode: The mode to open the file with; 'w' for text or 'wb' for binary
+    returns:
+        The temporary file to write to
+    """
+    with tempfile.NamedTemporaryFile(
+        mode, encoding=None if 'b' in mode else 'utf8', dir=os.path.dirname(filepath),
+        delete=False
+    ) as tfile:
+        try:
+            yield tfile
+        except BaseException:
+            tfile.close()
+            os.unlink(tfile.name)
+            raise
+    os.replace(tfile.name, filepath)
+
+def peak_rss() -> str:
+    """Return the peak resident memory used by the process so far, as a readable string"""
+    # On Linux, ru_maxrss is in kilobytes
+    return f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB"
+
 class ExitCode:
     """Helper class for exit codes"""
     def __init__(self, exit_code: str):
@@ -2,30 +2,40 @@
 Colophon job running functionality
 """
 import os
-import tempfile
-import zipfile
+import pathlib
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import app
 from app.manifest import ManifestEntry
 from app.suite import SuiteStage
+from app.helpers import peak_rss
+from app.timings import timed
 
 class ColophonJob:
     """Class to organize steps in running a Colophon job"""
 
     @staticmethod
-    def apply_filters():
-        """Pass manifest through suite to filter out rows to ignore"""
+    @timed('apply_filters')
+    def apply_filters(entries: list=None):
+        """
+        Pass manifest through suite to filter out rows to ignore
+        Args:
+            entries: The manifest entries to filter; defaults to the whole manifest
+        """
         app.logger.debug("Applying suite filter to manifest...")
-        for entry in app.manifest:
+        for entry in (entries if entries is not None else app.manifest):
             entry.filtered = app.suite.filter(entry)
 
-    @staticmethod
-    def label_files(ignore_missing: bool):
+    @classmethod
+    @timed('label_files')
+    def label_files(cls, ignore_missing: bool, entries: list=None):
         """
         For each manifest row, match/associate files to that row.
         Args:
             ignore_missing: If True, then ignore manifest entries when no files are matched
+            entries: The manifest entries to label; defaults to the whole manifest
         """
-        for entry in app.manifest:
+        for entry in (entries if entries is not None else app.manifest):
             # TODO make log buffering thread safe
             app.LogBuffer.start_buffer()
             app.logger.debug(f"Labeling files for manifest row: {app.suite.manifest_id(entry)}")
@@ -37,6 +47,12 @@ class ColophonJob:
                     entry.failures.append(fmsg)
                     app.logger.error(fmsg)
             app.LogBuffer.end_buffer(discard=entry.skipped)
+        if entries is None:
+            cls.log_row_counts()
+
+    @staticmethod
+    def log_row_counts():
+        """Log the number of manifest rows selected, filtered, and ignored"""
         app.logger.debug(
             f"Manifest rows: selected={app.manifest.selected()}, "
             f"filtered={app.manifest.skipped(ignored=False)}, "
@@ -44,110 +60,406 @@ class ColophonJob:
         )
 
     @classmethod
-    def run_stages(cls):
-        """For each manifest row, run scripts from stages"""
-        for entry in app.manifest:
-            if entry.skipped or entry.failures:
-                continue
-            try:
+    @timed('run_stages')
+    def run_stages(cls, jobs: int=1, entries: list=None, stage_jobs: int=1):
+        """
+        For each manifest row, run scripts from stages
+        Args:
+            jobs: The number of manifest rows to run stages on concurrently
+            entries: The manifest entries to run stages for; defaults to the whole manifest
+            stage_jobs: The number of stages of each manifest row to run concurrently
+        """
+        entries = [
+            entry if not entry.skipped and not entry.failures else None
+            for entry in (entries if entries is not None else app.manifest)
+        ]
+        # Rows sharing an id would write their output into the same directory
+        app.manifest.check_ids([
+            app.suite.manifest_id(entry) if entry is not None else None for entry in entries
+        ])
+        entries = [entry for entry in entries if entry is not None]
+        if app.diskorder is not None:
+            entries = app.diskorder.order_entries(entries)
+        if jobs <= 1 and stage_jobs <= 1:
+            for entry in entries:
+                cls._run_entry(entry)
+            return
+
+        app.logger.debug(f"Running stages for {len(entries)} manifest rows using {jobs} jobs")
+        logbuf = app.TaskLogBuffer.start_buffer()
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                futures = [
+                    pool.submit(cls._run_entry_task, logbuf, idx, entry, stage_jobs)
+                    for idx, entry in enumerate(entries)
+                ]
+                # Write logs for each row in manifest order as they complete
+                for idx, future in enumerate(futures):
+                    future.result()
+                    logbuf.flush_task(idx)
+        finally:
+            app.TaskLogBuffer.end_buffer()
+
+    @classmethod
+    def run_suites(
+        cls, runs: list, ignore_missing: bool, jobs: int=1, stream: bool=False,
+        chunk_size: int=1000, stage_jobs: int=1
+    ):
+        """
+        Filter, label, and run stages for each suite in turn, against the same manifest rows
+        and source directory.
+        Args:
+            runs: The SuiteRun of each suite
+            ignore_missing: If True, then ignore manifest entries when no files are matched
+            jobs: The number of manifest rows to run stages on concurrently
+            stream: If True, process the manifest in chunks of rows; see run_streaming()
+            chunk_size: The number of manifest rows to process at a time when streaming
+            stage_jobs: The number of stages of each manifest row to run concurrently
+        """
+        for _ in cls._each_suite(runs):
+            if len(runs) > 1:
+                app.logger.info(f"Running {app.suite}")
+            if stream:
+                cls.run_streaming(ignore_missing, jobs, chunk_size, stage_jobs)
+            else:
+                cls.apply_filters()
+                cls.label_files(ignore_missing)
+                cls.run_stages(jobs, stage_jobs=stage_jobs)
+
+    @staticmethod
+    def _each_suite(runs: list=None):
+        """Make each suite run active in turn; without any, only the current suite is used"""
+        if not runs:
+            yield None
+            return
+        for run in runs:
+            with run:
+                yield run
+
+    @classmethod
+    def run_streaming(
+        cls, ignore_missing: bool, jobs: int=1, chunk_size: int=1000, stage_jobs: int=1
+    ):
+        """
+        Filter, label, and run stages for the manifest a chunk of rows at a time, writing
+        each chunk to the manifest CSV report as it completes. Only the status of each
+        row is kept once its chunk is complete.
+        Args:
+            ignore_missing: If True, then ignore manifest entries when no files are matched
+            jobs: The number of manifest rows to run stages on concurrently
+            chunk_size: The number of manifest rows to process at a time
+            stage_jobs: The number of stages of each manifest row to run concurrently
+        """
+        for chunk in app.manifest.chunks(chunk_size):
+            app.logger.debug(
+                f"Processing manifest rows {len(app.manifest) + 1} to "
+                f"{len(app.manifest) + len(chunk)} of {app.manifest.rows}"
+            )
+            cls.apply_filters(chunk)
+            cls.label_files(ignore_missing, chunk)
+            cls.run_stages(jobs, chunk, stage_jobs)
+            app.report.ManifestReport.append(chunk)
+            app.manifest.retain(chunk)
+        cls.log_row_counts()
+
+    @classmethod
+    def _run_entry_task(cls, logbuf, idx: int, entry: ManifestEntry, stage_jobs: int=1):
+        """Run stages on a single entry within a worker thread, buffering its logs"""
+        with logbuf.task(idx):
+            cls._run_entry(entry, stage_jobs)
+
+    @classmethod
+    def _run_entry(cls, entry: ManifestEntry, stage_jobs: int=1):
+        """Run stages on a single entry, stopping early if a script requested it"""
+        try:
+            if stage_jobs > 1 or app.diskorder is not None:
+                cls._run_stages_concurrently(entry, stage_jobs)
+            else:
                 cls._run_stages_on(entry)
-            except app.EndStagesProcessing:
-                pass
+        except app.EndStagesProcessing:
+            pass
+        # Output for the row is complete, so can be compressed while other rows run
+        if app.bundle is not None:
+            app.bundle.add_tree(os.path.join(app.workdir, app.suite.manifest_id(entry)))
 
     @classmethod
     def _run_stages_on(cls, entry: ManifestEntry):
         """Run stages on a single entry"""
-        mfid = app.suite.manifest_id(entry)
         for stage in app.suite.stages():
-            app.logger.debug(f"Running Stage(stage={stage.name}, manifest-id={mfid})")
-            stage_basedir = os.path.join(app.workdir, mfid, stage.name)
-            try:
-                cls._run_scripts_for(stage, stage_basedir, entry)
-            except app.StageProcessingFailure:
-                fmsg = (
-                    f"Stage could not be processed (stage={stage.name}, manifest-id={mfid}); "
-                    "see logs for details."
-                )
-                entry.failures.append(fmsg)
-                app.logger.error(fmsg)
-            except app.TemplateRenderFailure as exc:
-                fmsg = (
-                    f"Stage could not be processed (stage={stage.name}, manifest-id={mfid}); "
-                    f"script template render failed. Error was: {exc}"
-                )
-                entry.failures.append(fmsg)
-                app.logger.error(fmsg)
+            cls._run_stage(stage, entry)
+
+    @classmethod
+    def _run_stages_concurrently(cls, entry: ManifestEntry, stage_jobs: int):
+        """
+        Run stages on a single entry, up to stage_jobs stages at a time, with each stage
+        started once the stages it needs have completed. Once a script requests the entry
+        be skipped, no further stages are started. Stages are started in suite order, or
+        when ordering work by disk location, grouped by the files they read.
+        """
+        stages = list(app.suite.stages())
+        failures = {stage.name: [] for stage in stages}
+        logbuf = app.TaskLogBuffer.the_buffer
+        parent = logbuf.current_task() if logbuf else None
+        pending = (
+            app.diskorder.order_stages(stages, entry) if app.diskorder is not None
+            else list(stages)
+        )
+        completed, running = set(), {}
+        end_stages = False
+        with ThreadPoolExecutor(max_workers=stage_jobs) as pool:
+            while pending or running:
+                for stage in cls._take_ready_stages(
+                    pending, completed, 0 if end_stages else stage_jobs - len(running)
+                ):
+                    running[pool.submit(
+                        cls._run_stage_task, logbuf, parent, stages.index(stage), stage,
+                        entry, failures[stage.name]
+                    )] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed.add(running.pop(future).name)
+                    try:
+                        future.result()
+                    except app.EndStagesProcessing:
+                        end_stages = True
+        # Failures and runs are kept in stage order, the same as running stages in turn
+        for stage in stages:
+            entry.failures.extend(failures[stage.name])
+        app.ledger.order_entry(app.suite.manifest_id(entry), [stage.name for stage in stages])
+        if end_stages:
+            raise app.EndStagesProcessing
 
     @staticmethod
-    def _run_scripts_for(stage: SuiteStage, stage_basedir: str, entry: ManifestEntry):
+    def _take_ready_stages(pending: list, completed: set, slots: int) -> list:
+        """
+        Take the next stages to start from the pending stages; those which the stages
+        they need have all completed
+        args:
+            pending: The stages not yet started, in the order to start them
+            completed: Names of the stages which have completed
+            slots: The most stages to take
+        returns:
+            The stages to start, which are removed from pending
+        """
+        ready = [
+            stage for stage in pending if all(need in completed for need in stage.needs)
+        ][:max(slots, 0)]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def _run_stage_task(
+        cls, logbuf, parent, idx: int, stage: SuiteStage, entry: ManifestEntry, failures: list
+    ):
+        """Run a stage within a worker thread, buffering its logs as part of its entry's"""
+        with logbuf.task(idx, parent) if logbuf else nullcontext():
+            cls._run_stage(stage, entry, failures)
+
+    @classmethod
+    def _run_stage(cls, stage: SuiteStage, entry: ManifestEntry, failures: list=None):
+        """
+        Run scripts for a stage on a single entry
+        Args:
+            stage: The stage to run
+            entry: The manifest entry to run the stage with
+            failures: Where to add failure messages; defaults to the entry's failures
+        """
+        failures = entry.failures if failures is None else failures
+        mfid = app.suite.manifest_id(entry)
+        app.logger.debug(f"Running Stage(stage={stage.name}, manifest-id={mfid})")
+        stage_basedir = os.path.join(app.workdir, mfid, stage.name)
+        try:
+            cls._run_scripts_for(stage, stage_basedir, entry, failures)
+        except app.StageProcessingFailure:
+            fmsg = (
+                f"Stage could not be processed (stage={stage.name}, manifest-id={mfid}); "
+                "see logs for details."
+            )
+            failures.append(fmsg)
+            app.logger.error(fmsg)
+        except app.TemplateRenderFailure as exc:
+            fmsg = (
+                f"Stage could not be processed (stage={stage.name}, manifest-id={mfid}); "
+                f"script template render failed. Error was: {exc}"
+            )
+            failures.append(fmsg)
+            app.logger.error(fmsg)
+
+    @classmethod
+    def _run_scripts_for(
+        cls, stage: SuiteStage, stage_basedir: str, entry: ManifestEntry, failures: list=None
+    ):
         """
         Run scripts for a stage
         Args:
             stage: The stage for which to run scripts
             stage_basedir: The directory where to write results of the script
             entry: The manifest entry to run the scripts with
+            failures: Where to add failure messages; defaults to the entry's failures
         """
-        for ready_script, stage_suffix in stage.script(entry):
-            ecode = app.write_output(
-                f"{stage_basedir}{stage_suffix}",
-                *app.exec_command(ready_script, shell=True)
-            )
+        failures = entry.failures if failures is None else failures
+        mfid = app.suite.manifest_id(entry)
+        for ready_script, stage_suffix in stage.script(entry, stage_basedir):
+            stagedir = f"{stage_basedir}{stage_suffix}"
+            rel_stagedir = os.path.relpath(stagedir, app.workdir)
+            done = app.checkpoint.done(stagedir)
+            if done is None and app.retry and app.retry.restore(rel_stagedir, app.workdir):
+                app.ledger.record_restored(mfid, stage.name, stage_suffix, rel_stagedir)
+                app.logger.debug(
+                    "Restored output of passed script from previous run "
+                    f"(stage={stage.name}{stage_suffix})"
+                )
+                continue
+            if done is not None:
+                ecode = done['ecode']
+                app.ledger.record(
+                    mfid, stage.name, stage_suffix, ecode, stagedir, done['usage'], done['restored']
+                )
+                app.logger.debug(
+                    f"Stage completed before the run was resumed (stage={stage.name}{stage_suffix})"
+                )
+            else:
+                ecode = cls._run_script(stage, ready_script, stagedir, stage_suffix, entry)
             if ecode % 2 == 1:
                 fmsg = f"Script failure (stage={stage.name}{stage_suffix}, exit={ecode}): {ready_script}"
-                entry.failures.append(fmsg)
+                failures.append(fmsg)
                 app.logger.info(fmsg)
             if ecode & 16 == 16:
                 fmsg = (
                     "Script set entry as filtered "
                     f"(stage={stage}{stage_suffix}, exit={ecode}): {ready_script}"
                 )
-                entry.filtered(fmsg)
+                entry.filtered = fmsg
                 app.logger.info(fmsg)
                 raise app.EndStagesProcessing
 
     @staticmethod
-    def generate_reports(strict: bool=False, ignore_missing: bool=False) -> int:
+    def _run_script(
+        stage: SuiteStage, ready_script, stagedir: str, stage_suffix: str, entry: ManifestEntry
+    ) -> int:
+        """
+        Run a single script for a stage, or replay its output from the stage cache if
+        unchanged, then record it as completed
+        returns:
+            The script exit code
+        """
+        mfid = app.suite.manifest_id(entry)
+        cache_key = None
+        if app.stagecache is not None:
+            cache_key = app.stagecache.key(stage.name, ready_script, entry)
+        usage, restored = {}, False
+        if cache_key and (ecode := app.stagecache.replay(cache_key, stagedir)) is not None:
+            restored = True
+            app.logger.debug(
+                f"Replayed output of unchanged stage from cache (stage={stage.name}{stage_suffix})"
+            )
+        else:
+            # Scripts write their results file within the stage directory
+            pathlib.Path(stagedir).mkdir(parents=True, exist_ok=True)
+            ecode = app.write_output(
+                stagedir,
+                *stage.execute(ready_script, stagedir, usage)
+            )
+            if cache_key:
+                app.stagecache.store(cache_key, stagedir, ecode)
+        app.ledger.record(
+            mfid, stage.name, stage_suffix, ecode, stagedir, None if restored else usage, restored
+        )
+        app.checkpoint.record(stagedir, ecode, None if restored else usage, restored)
+        return ecode
+
+    @classmethod
+    @timed('reports')
+    def generate_reports(
+        cls, strict: bool=False, ignore_missing: bool=False, runs: list=None
+    ) -> int:
         """
         Do calls to compile reports and determine exit_code
         args:
             strict: If enabled, strict mode can affect the exit_code
+            runs: The SuiteRun of each suite; when there are several, each has its own
+                reports, along with a report of the files no suite associated
         returns:
             The exit_code for the colophon run
         """
+        summaries = [cls._suite_reports(ignore_missing) for _ in cls._each_suite(runs)]
+        if runs and len(runs) > 1:
+            app.logger.debug("Generating combined unassociated files list.")
+            unassociated = app.report.UnassociatedReport.generate(runs)
+            # Only files no suite associated count as unassociated for the exit code
+            for summary in summaries:
+                summary.unassociated = unassociated
+        return max(summary.exit_code(strict) for summary in summaries)
+
+    @staticmethod
+    def _suite_reports(ignore_missing: bool=False) -> 'app.report.SummaryReport':
+        """
+        Compile the reports for the current suite
+        returns:
+            The generated summary report
+        """
+        app.logger.info(f"Peak memory usage (RSS): {peak_rss()}")
+
+        app.logger.debug("Merging stage results into results JSON.")
+        app.report.ResultsReport().generate()
+
         app.logger.debug("Generating final manifest CSV.")
         app.report.ManifestReport().generate()
 
-        if ignore_missing:
-            app.logger.debug("Generating ignored manifest rows list.")
-            app.report.IgnoredReport().generate()
-
         app.logger.debug("Generating summary JSON report.")
         summary = app.report.SummaryReport()
         summary.generate()
-        return summary.exit_code(strict)
 
-    @staticmethod
-    def create_overview():
-        """Create the overview HTML page"""
-        app.logger.debug("Generating overview HTML page.")
-        overview = app.report.OverviewPage()
-        overview.generate()
+        if ignore_missing:
+            app.logger.debug("Generating ignored manifest rows list.")
+            app.report.IgnoredReport().generate(ignored=summary.ignored)
+        return summary
+
+    @classmethod
+    def bundle_output(cls, runs: list=None):
+        """
+        Add all output other than the summary and overview to the output bundle, then add
+        the time taken to the summary
+        args:
+            runs: The SuiteRun of each suite, each with its own summary
+        """
+        if app.bundle is None:
+            app.bundle = app.OutputBundle()
+        app.logger.debug(f"Bundling output into: {app.bundle.partpath}")
+        workdirs = [run.workdir for run in runs] if runs else [app.workdir]
+        exclude = ['colophon.log'] + [
+            os.path.relpath(os.path.join(workdir, fname), app.workdir)
+            for workdir in workdirs for fname in ('summary.json', 'overview.html')
+        ]
+        with app.timings.phase('zip'):
+            app.bundle.flush(exclude=exclude)
+        for _ in cls._each_suite(runs):
+            app.report.SummaryReport.update_timings()
+
+    @classmethod
+    def create_overview(cls, runs: list=None):
+        """
+        Create the overview HTML page
+        args:
+            runs: The SuiteRun of each suite, each with its own overview
+        """
+        logpath = os.path.join(app.workdir, 'colophon.log')
+        for _ in cls._each_suite(runs):
+            app.logger.debug("Generating overview HTML page.")
+            overview = app.report.OverviewPage()
+            overview.generate(logpath=logpath)
 
     @staticmethod
     def zip_output():
-        """Save all output as zip file"""
-        with (
-            tempfile.NamedTemporaryFile(prefix='colophon_', suffix='.zip', delete=False) as ztemp,
-            zipfile.ZipFile(ztemp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zfile
-        ):
-            app.logger.debug(f"Bundling output into zip file: {ztemp.name}")
-            for root, _, files in os.walk(app.workdir):
-                for fname in files:
-                    filepath = os.path.join(root, fname)
-                    zfile.write(
-                        filepath,
-                        arcname=filepath.removeprefix(app.workdir).lstrip("/")
-                    )
-
-            # Return fullpath to zip file
-            return ztemp.name
+        """
+        Complete the output bundle with all remaining output
+        returns:
+            The full path to the output bundle file
+        """
+        if app.bundle is None:
+            app.bundle = app.OutputBundle()
+        return app.bundle.close()
@@ -0,0 +1,146 @@
+"""
+Colophon in-memory ledger of stage script runs
+"""
+import os
+import threading
+from collections import defaultdict
+import app
+
+class StageRun:
+    """A single run of a stage script (or its output restored from a previous run)"""
+    # Slots rather than grouped into further objects, as there is a run for every script
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        'manifest_id', 'stage', 'suffix', 'ecode', 'stagedir', 'outputs', 'usage', 'restored'
+    )
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, manifest_id: str, stage: str, suffix: str, ecode: int, stagedir: str,
+        outputs: list, usage: dict=None, restored: bool=False
+    ):
+        self.manifest_id: str = manifest_id
+        self.stage: str = stage
+        self.suffix: str = suffix
+        self.ecode: int = ecode
+        self.stagedir: str = stagedir
+        self.outputs: list = outputs
+        self.usage: dict = usage
+        self.restored: bool = restored
+
+    @property
+    def loop_index(self) -> int:
+        """The loopvars index of the run, or None if the stage has no loopvars"""
+        return int(self.suffix[1:]) if self.suffix else None
+
+    def script(self) -> dict:
+        """The run as a dict for the scripts list in the summary timings"""
+        return {
+            "manifest-id": self.manifest_id,
+            "stage": self.stage,
+            "stage-dir": f"{self.stage}{self.suffix}",
+            "exit-code": self.ecode,
+            **(self.usage or {}),
+        }
+
+    def __repr__(self):
+        return (
+            f"StageRun(manifest-id={self.manifest_id}, stage-dir={self.stage}{self.suffix}, "
+            f"ecode={self.ecode}, restored={self.restored})"
+        )
+
+class Ledger:
+    """
+    Every stage script run for each manifest row, recorded as its output is written, so
+    reports can be created without searching the workdir for the output of each row.
+    """
+    def __init__(self):
+        self.runs = defaultdict(list)
+        self._lock = threading.Lock()
+
+    # pylint: disable=too-many-arguments
+    def record(
+        self, manifest_id: str, stage: str, suffix: str, ecode: int, stagedir: str,
+        usage: dict=None, restored: bool=False
+    ) -> StageRun:
+        """
+        Record a script run after its output was written (or replayed from the stage cache)
+        args:
+            manifest_id: The manifest id of the row the script ran for
+            stage: The stage name
+            suffix: The stage suffix when using loopvars; e.g. '.0'
+            ecode: The script exit code
+            stagedir: The full path to the stage output directory
+            usage: The resource usage record from the script run
+            restored: If the output was replayed from the stage cache rather than run
+        """
+        outputs = []
+        for root, _, files in os.walk(stagedir):
+            outputs.extend(
+                os.path.relpath(os.path.join(root, fname), app.workdir) for fname in files
+            )
+        run = StageRun(
+            manifest_id, stage, suffix, ecode, os.path.relpath(stagedir, app.workdir),
+            outputs, usage, restored
+        )
+        with self._lock:
+            self.runs[manifest_id].append(run)
+        return run
+
+    def record_restored(self, manifest_id: str, stage: str, suffix: str, stagedir: str):
+        """
+        Record the output of a script run restored from the previous run's output zip
+        args:
+            manifest_id: The manifest id of the row the script ran for
+            stage: The stage name
+            suffix: The stage suffix when using loopvars; e.g. '.0'
+            stagedir: Stage output dir, relative to the workdir; e.g. '{mfid}/{stage}{suffix}'
+        """
+        with self._lock:
+            for ecode in app.retry.ecodes[stagedir]:
+                self.runs[manifest_id].append(StageRun(
+                    manifest_id, stage, suffix, int(ecode), stagedir,
+                    list(app.retry.members[stagedir]), restored=True
+                ))
+
+    def order_entry(self, manifest_id: str, stages: list):
+        """
+        Put the runs for a manifest row in stage order, as when its stages were run one at
+        a time; for after its stages were run concurrently
+        args:
+            manifest_id: The manifest id of the row
+            stages: The stage names, in order
+        """
+        positions = {stage: pos for pos, stage in enumerate(stages)}
+        with self._lock:
+            if manifest_id in self.runs:
+                # Stable, so loop runs of a stage stay in suffix order
+                self.runs[manifest_id].sort(key=lambda run: positions.get(run.stage, len(stages)))
+
+    def entry_runs(self, manifest_id: str) -> list:
+        """The runs for a manifest row, in the order they were run"""
+        return self.runs.get(manifest_id, [])
+
+    def ecode_counts(self, manifest_id: str) -> dict:
+        """
+        Count the runs for a manifest row by exit code
+        returns:
+            A dict of exit code (as a string, the same as the ecode.N files) to count
+        """
+        counts = defaultdict(int)
+        for run in self.entry_runs(manifest_id):
+            counts[str(run.ecode)] += 1
+        return dict(counts)
+
+    def outputs(self) -> list:
+        """All output files written or restored for script runs, relative to the workdir"""
+        return [output for runs in self.runs.values() for run in runs for output in run.outputs]
+
+    def __iter__(self):
+        return (run for runs in self.runs.values() for run in runs)
+
+    def __len__(self):
+        return sum(len(runs) for runs in self.runs.values())
+
+    def __repr__(self):
+        return f"Ledger(rows={len(self.runs)}, runs={len(self)})"
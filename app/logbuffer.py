@@ -3,6 +3,8 @@ Loging buffering
 """
 import logging
 import itertools
+import threading
+from contextlib import contextmanager
 from logging.handlers import BufferingHandler
 
 class LogBuffer(BufferingHandler):
@@ -76,3 +78,114 @@ class LogBuffer(BufferingHandler):
             self.buffer.clear()
         finally:
             self.release()
+
+class TaskLogBuffer(logging.Handler):
+    """
+    Buffer log entries per task while tasks run concurrently in worker threads, so that
+    the log entries for each task can be written together and in a deterministic order.
+    Log entries from threads not running a task are passed through immediately.
+    """
+    # pylint: disable=protected-access
+    buffered_handlers = []
+    the_buffer = None
+
+    @classmethod
+    def start_buffer(cls):
+        """Replace existing root loghandler(s) with an instance of TaskLogBuffer, which
+        will buffer log messages from tasks until flush_task() or end_buffer() is called.
+        Returns:
+            The TaskLogBuffer instance
+        """
+        if cls.the_buffer is not None:
+            raise RuntimeError(
+                "Called TaskLogBuffer.start_buffer() while a buffer is already started."
+            )
+
+        logger = logging.getLogger()
+        logging._acquireLock()
+        while logger.hasHandlers():
+            cls.buffered_handlers.append(logger.handlers.pop(0))
+        cls.the_buffer = cls(cls.buffered_handlers)
+        logger.addHandler(cls.the_buffer)
+        logging._releaseLock()
+        return cls.the_buffer
+
+    @classmethod
+    def end_buffer(cls):
+        """Write any remaining task log messages (ordered by task key) and restore the
+        original root loghandler(s)."""
+        if cls.the_buffer is None:
+            raise RuntimeError("Called TaskLogBuffer.end_buffer() while a no buffer was started.")
+
+        subkeys = {subkey for subkeys in cls.the_buffer.subtasks.values() for subkey in subkeys}
+        for key in sorted(set(cls.the_buffer.tasks) - subkeys):
+            cls.the_buffer.flush_task(key)
+        logger = logging.getLogger()
+        logging._acquireLock()
+        logger.removeHandler(cls.the_buffer)
+        cls.the_buffer = None
+        for handler in cls.buffered_handlers:
+            logger.addHandler(handler)
+        cls.buffered_handlers.clear()
+        logging._releaseLock()
+
+    def __init__(self, targets: list):
+        super().__init__()
+        self.targets = targets
+        self.tasks = {}
+        # Subtask keys of each task with subtasks
+        self.subtasks = {}
+        self.local = threading.local()
+
+    @contextmanager
+    def task(self, key, parent=None):
+        """
+        Buffer all log messages from the current thread under the given task key
+        Args:
+            key: A sortable key identifying the task
+            parent: If set, the key of a task (running in another thread) this task is
+                part of; its messages are written after those of the parent task, in
+                order of key, when the parent task is flushed
+        """
+        self.acquire()
+        try:
+            if parent is not None:
+                key = (parent, key)
+                self.subtasks.setdefault(parent, []).append(key)
+            self.tasks[key] = []
+        finally:
+            self.release()
+        self.local.key = key
+        try:
+            yield
+        finally:
+            self.local.key = None
+
+    def current_task(self):
+        """The key of the task running in the current thread, or None"""
+        return getattr(self.local, 'key', None)
+
+    def _write(self, record):
+        """Pass a record to the original loghandlers, respecting their levels"""
+        for target in self.targets:
+            if record.levelno >= target.level:
+                target.handle(record)
+
+    def emit(self, record):
+        """Buffer the record if emitted from within a task, otherwise write it"""
+        key = getattr(self.local, 'key', None)
+        if key is None:
+            self._write(record)
+        else:
+            self.tasks[key].append(record)
+
+    def flush_task(self, key):
+        """Write all buffered messages for a task, then its subtasks, to original loghandlers"""
+        self.acquire()
+        try:
+            for record in self.tasks.pop(key, []):
+                self._write(record)
+            for subkey in sorted(self.subtasks.pop(key, [])):
+                self.flush_task(subkey)
+        finally:
+            self.release()
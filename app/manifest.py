@@ -6,10 +6,56 @@ from collections.abc import MutableMapping, MutableSequence
 import csv
 import app
 
+class KeyTable:
+    """
+    An ordered table of field names shared by all manifest entries having the same fields
+    in the same order, so each entry only needs to hold a list of its values. Adding a
+    field to an entry moves it to the child table for that field, which is shared with
+    any other entry adding the same field.
+    """
+    __slots__ = ('keys', 'positions', 'root', '_children')
+
+    def __init__(self, keys: list, root: 'KeyTable'=None):
+        self.keys: tuple = tuple(keys)
+        self.positions: dict = {key: pos for pos, key in enumerate(self.keys)}
+        self.root: KeyTable = root if root else self
+        self._children: dict = {}
+
+    def add(self, key: str) -> 'KeyTable':
+        """Get the table with the key added to the end of this table's keys"""
+        if key not in self._children:
+            self._children.setdefault(key, KeyTable((*self.keys, key), self.root))
+        return self._children[key]
+
+    def remove(self, key: str) -> 'KeyTable':
+        """Get the table with the key removed from this table's keys"""
+        keys = [tkey for tkey in self.keys if tkey != key]
+        if keys[:len(self.root.keys)] != list(self.root.keys):
+            return KeyTable(keys)
+        table = self.root
+        for tkey in keys[len(table.keys):]:
+            table = table.add(tkey)
+        return table
+
+    def __repr__(self):
+        return f"KeyTable({list(self.keys)})"
+
 class ManifestEntry(MutableMapping):
     """Represent a single row in the Manifest"""
-    def __init__(self, headers, values):
-        self.rowmap = dict(zip(headers, values))
+    # Slots rather than grouped into further objects, as there is an entry for every row
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        '_table', '_values', 'filtered', 'ignored', 'failures', 'associated',
+        'manifest_id', '_id_fields'
+    )
+
+    def __init__(self, headers: list|KeyTable, values: list):
+        self._table: KeyTable = headers if isinstance(headers, KeyTable) else KeyTable(headers)
+        self._values: list = list(values)
+        if len(self._table.positions) != len(self._table.keys):
+            # Duplicate field names; the last value is kept, same as a dict would
+            rowmap = dict(zip(self._table.keys, self._values))
+            self._table, self._values = KeyTable(rowmap), list(rowmap.values())
         # Filtered entries are skipped; reason for being skipped stored here
         self.filtered: str = ""
         # Ignored entries are skipped due to there being no files matched.
@@ -18,75 +64,218 @@ class ManifestEntry(MutableMapping):
         self.failures: list = []
         # List of files associated with this entry
         self.associated: list = []
+        # The rendered manifest id, once set by the suite; see set_manifest_id()
+        self.manifest_id: str = None
+        self._id_fields: frozenset = None
+
+    def set_manifest_id(self, manifest_id: str, fields: frozenset=None):
+        """
+        Store the rendered manifest id, so it is only rendered again if changed
+        args:
+            manifest_id: The rendered id
+            fields: The fields the id was rendered from; if None, any change to the
+                entry will clear the stored id
+        """
+        self.manifest_id = manifest_id
+        self._id_fields = fields
+
+    def _field_changed(self, key: str):
+        """Clear the stored manifest id if rendered from the field"""
+        if self.manifest_id is not None and (self._id_fields is None or key in self._id_fields):
+            self.manifest_id = None
 
     @property
     def skipped(self):
         """Returns True if entry is either filtered or skipped"""
         return bool(self.filtered) or self.ignored
 
+    def copy(self) -> 'ManifestEntry':
+        """A copy of the fields of the entry, without the outcome of processing it"""
+        return ManifestEntry(self._table, self._values)
+
     def headers(self) -> list:
         """Keys for this row as a list"""
-        return list(self.rowmap.keys())
+        return list(self._table.keys)
 
     def values(self) -> list:
         """Values for this row as a list"""
-        return list(self.rowmap.values())
+        return list(self._values)
 
     def __iter__(self):
-        for key in self.rowmap:
-            yield key
+        yield from self._table.keys
 
     def __len__(self):
-        return len(self.rowmap)
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._table.positions
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            return list(self.rowmap.values())[key]
-        return self.rowmap[key]
+            return self._values[key]
+        return self._values[self._table.positions[key]]
 
     def __setitem__(self, key, val):
-        self.rowmap[key] = val
+        self._field_changed(key)
+        if (pos := self._table.positions.get(key)) is not None:
+            self._values[pos] = val
+            return
+        self._table = self._table.add(key)
+        self._values.append(val)
 
     def __delitem__(self, key):
-        del self.rowmap[key]
+        pos = self._table.positions[key]
+        self._field_changed(key)
+        self._table = self._table.remove(key)
+        del self._values[pos]
+
+    def __repr__(self):
+        return (
+            f"ManifestEntry({dict(zip(self._table.keys, self._values))}, "
+            f"files={len(self.associated)}, "
+            f"filtered={bool(self.filtered)}, ignored={self.ignored})"
+        )
+
+class EntryStatus:
+    """
+    The outcome for a manifest row; retained in place of the full ManifestEntry once
+    the row has been processed when streaming the manifest.
+    """
+    __slots__ = ('manifest_id', 'filtered', 'ignored', 'failures')
+
+    def __init__(self, manifest_id: str, entry: ManifestEntry):
+        self.manifest_id: str = manifest_id
+        self.filtered: str = entry.filtered
+        self.ignored: bool = entry.ignored
+        self.failures: list = entry.failures
+
+    @property
+    def skipped(self):
+        """Returns True if entry is either filtered or skipped"""
+        return bool(self.filtered) or self.ignored
 
     def __repr__(self):
         return (
-            f"ManifestEntry({self.rowmap}, files={len(self.associated)}, "
+            f"EntryStatus({self.manifest_id}, failures={len(self.failures)}, "
             f"filtered={bool(self.filtered)}, ignored={self.ignored})"
         )
 
 class Manifest(MutableSequence):
-    """The Manifest file wrapper"""
-    def __init__(self, filepath: str=None):
+    """
+    The Manifest file wrapper. When streaming, rows are not loaded up front; instead they
+    are read in chunks by chunks() and, once processed, only their status is retained.
+    """
+    def __init__(self, filepath: str=None, stream: bool=False):
         self.filepath = None
         self.headers = None
         self.manifest = None
+        self.stream = stream
+        self.rows = None
+        self.ids = None
+        # Number of rows whose ids were checked; see check_ids()
+        self.checked = 0
         if filepath:
             self.load(filepath)
 
-    def load(self, filepath: str=None):
-        """Load the manifest file"""
-        self.filepath = filepath.rstrip('/') if filepath else self.filepath
-        self.headers = None
-        self.manifest = None
+    def _read_rows(self):
+        """Read the manifest file, setting headers and yielding each data row"""
         try:
             with open(self.filepath, newline='', encoding='utf8') as mffile:
                 csvr = csv.reader(mffile, dialect='unix')
-                self.manifest = []
-                for row in csvr:
+                self.headers = None
+                for rownum, row in enumerate(csvr, start=1):
                     if self.headers is None:
                         self.headers = row
                         continue
                     if len(row) != len(self.headers):
                         raise app.ColophonException(
-                            f"Column count in row {len(self.manifest)+2} does not match header."
+                            f"Column count in row {rownum} does not match header."
                         )
-                    self.manifest.append(ManifestEntry(self.headers, row))
+                    yield row
         except FileNotFoundError:
             raise app.ColophonException(f"Unable to open manifest - file missing: {self.filepath}") from None
+
+    def load(self, filepath: str=None):
+        """Load the manifest file; when streaming, only validate and count the rows"""
+        self.filepath = filepath.rstrip('/') if filepath else self.filepath
+        # The file is read again when streaming, after changing into the source directory
+        self.filepath = os.path.abspath(self.filepath)
+        self.headers = None
+        self.manifest = []
+        self.rows = 0
+        self.ids = {}
+        self.checked = 0
+        keys = None
+        for row in self._read_rows():
+            self.rows += 1
+            if self.stream:
+                continue
+            # All entries share the same table of field names
+            keys = keys if keys else KeyTable(self.headers)
+            self.manifest.append(ManifestEntry(keys, row))
         app.logger.info(f"Loaded {self}")
 
+    def chunks(self, size: int):
+        """
+        Read the manifest file again, yielding lists of up to size new entries at a time.
+        args:
+            size: The maximum number of entries in each chunk
+        """
+        keys, chunk = None, []
+        for row in self._read_rows():
+            keys = keys if keys else KeyTable(self.headers)
+            chunk.append(ManifestEntry(keys, row))
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def copy(self) -> 'Manifest':
+        """
+        A copy of the loaded manifest with a copy of each entry, so another suite can be run
+        against the same rows without reading the manifest file again
+        """
+        mcopy = Manifest(stream=self.stream)
+        mcopy.filepath, mcopy.headers, mcopy.rows = self.filepath, self.headers, self.rows
+        mcopy.ids, mcopy.checked = {}, 0
+        mcopy.manifest = [entry.copy() for entry in self.manifest]
+        return mcopy
+
+    def check_ids(self, manifest_ids: list):
+        """
+        Check the manifest ids of the next rows are not the same as those of any previous
+        rows; must be called for every row in manifest order.
+        args:
+            manifest_ids: The manifest id of each row, or None for rows which are not run
+                (e.g. filtered rows), as they write no output so need not be unique
+        raises:
+            ColophonException listing every id which is not unique
+        """
+        duplicates = []
+        for manifest_id in manifest_ids:
+            self.checked += 1
+            if manifest_id is None:
+                continue
+            # Row numbers as in the file; the first row is the header
+            rownum = self.checked + 1
+            if (first := self.ids.setdefault(manifest_id, rownum)) != rownum:
+                duplicates.append(f"'{manifest_id}' of row {rownum} (same as row {first})")
+        if duplicates:
+            raise app.ColophonException(
+                "The suite's manifest.id must be unique for each row; rows have the same id "
+                f"as a previous row: {', '.join(duplicates)}"
+            )
+
+    def retain(self, entries: list):
+        """
+        Keep only the status of processed entries, allowing the entries to be released
+        args:
+            entries: The processed entries
+        """
+        for entry in entries:
+            self.manifest.append(EntryStatus(app.suite.manifest_id(entry), entry))
+
     def __getitem__(self, idx: int):
         return self.manifest[idx]
 
@@ -127,5 +316,5 @@ class Manifest(MutableSequence):
     def __repr__(self):
         return (
             f"Manifest(filename={os.path.basename(self.filepath)}, "
-            f"fields={len(self.headers)}, datarows={len(self.manifest)})"
+            f"fields={len(self.headers)}, datarows={self.rows})"
         )
@@ -0,0 +1,291 @@
+"""
+Colophon plugin stages, run in-process, along with the built-in check plugins
+"""
+import re
+import os
+import importlib
+import subprocess
+import app
+from app.hashing import verify_hash as _verify_hash
+
+# Loaded plugin functions, by 'module:function' name
+_PLUGINS = {}
+
+def load_plugin(name: str):
+    """
+    Import a plugin function, given as 'module:function'; e.g. 'app.plugins:validate_video'.
+    The module may be any module which can be imported, including from the install path.
+    args:
+        name: The plugin module and function name
+    returns:
+        The plugin function
+    """
+    if name in _PLUGINS:
+        return _PLUGINS[name]
+    modname, _, funcname = name.partition(':')
+    if not modname or not funcname:
+        raise app.ColophonException(
+            f"Invalid python stage '{name}'; must be in the format 'module:function'."
+        )
+    try:
+        module = importlib.import_module(modname)
+    except ImportError as exc:
+        raise app.ColophonException(f"Unable to load python stage '{name}': {exc}") from None
+    func = getattr(module, funcname, None)
+    if not callable(func):
+        raise app.ColophonException(
+            f"Unable to load python stage '{name}': no function '{funcname}' in module '{modname}'"
+        )
+    _PLUGINS[name] = func
+    return func
+
+class PluginCall:
+    """A 'python:' stage plugin function ready to be called, from SuiteStage.script()"""
+    __slots__ = ('name', 'args', 'context')
+
+    def __init__(self, name: str, args: dict, context: dict):
+        self.name: str = name
+        self.args: dict = args
+        self.context: dict = context
+
+    def run(self, results_path: str) -> tuple[int, list, list]:
+        """
+        Call the plugin in-process, adding its results to the results JSON. Plugins are
+        called as `function(args, context)` and must return a tuple of (exit code, stdout
+        lines, stderr lines, results), where the exit code uses the same bits as check
+        scripts and results is a dict of results key to a list of result items.
+        args:
+            results_path: The results JSON file for the stage
+        returns:
+            tuple(int, list, list): Exit code, stdout lines as list, stderr lines as list
+        """
+        app.logger.debug(f"Executing (python={self.name}): {self.args}")
+        try:
+            ecode, stdout, stderr, results = load_plugin(self.name)(self.args, self.context)
+        # A broken plugin fails its stage, the same as a broken script would
+        except Exception as exc: # pylint: disable=broad-except
+            msg = f"Python stage {self.name} raised an exception: {exc!r}"
+            app.logger.warning(msg)
+            return 1, [], [f"{msg}\n".encode()]
+        for key, items in (results or {}).items():
+            app.append_results(results_path, key, items)
+        app.logger.debug(f"Command exited with code: {ecode}")
+        return ecode, stdout, stderr
+
+    def __repr__(self):
+        return f"{self.name} {self.args}"
+
+def _arg_list(args: dict, key: str, lower: bool=False) -> list:
+    """A stage argument which may be a single value or a list of values, as a list of strings"""
+    values = args.get(key)
+    values = values if isinstance(values, list) else ([] if values is None else [values])
+    return [str(val).lower() if lower else str(val) for val in values]
+
+class _Checks:
+    """
+    Collects the property checks for a validate plugin, producing output and results
+    in the same form as the validate-* scripts
+    """
+    def __init__(self, check_file: str, index: str):
+        self.stdout, self.stderr = [], []
+        self.verified = True
+        self.result = {"image": check_file, "index": index, "verified": True}
+
+    def out(self, msg: str):
+        """Add a line to stdout"""
+        self.stdout.append(f"{msg}\n".encode())
+
+    def fail(self, ecode: int, msg: str) -> tuple[int, list, list, dict]:
+        """Stop checking, with the given exit code and message to stderr"""
+        self.stderr.append(f"{msg}\n".encode())
+        return ecode, self.stdout, self.stderr, {}
+
+    def check(self, prop: str, label: str, allowed: list, found: str):
+        """Verify a found property value is one of the allowed values, if any are set"""
+        if not allowed:
+            return
+        self.out(f"Verifying {label} is one of allowed values: {' '.join(allowed)}")
+        self.out(f"Detected {label}: {found}")
+        self.verified = self.verified and found in allowed
+        self.result[prop] = {"allowed": " ".join(allowed), "found": found}
+
+    def done(self, kind: str, key: str) -> tuple[int, list, list, dict]:
+        """Finish checking, returning the exit code, output, and results"""
+        self.result["verified"] = self.verified
+        self.out(f"{kind} verified okay." if self.verified else f"{kind} verification failed!")
+        return int(not self.verified), self.stdout, self.stderr, {key: [self.result]}
+
+# Message for a dimensions argument value not in the format WIDTHxHEIGHT
+_INVALID_DIMENSIONS = (
+    "Invalid dimensions format. Must be WIDTHxHEIGHT using positive integers. Invalid value: {}"
+)
+
+def _invalid(values: list, pattern: str) -> str:
+    """The first value not fully matching the pattern, or None"""
+    return next((val for val in values if not re.fullmatch(pattern, val)), None)
+
+def _arg_problem(check_file: str, formats: list, *properties: list) -> tuple[int, str]:
+    """
+    Check the arguments of a check plugin, the same as the check scripts do
+    args:
+        check_file: The file to check
+        formats: List of (values, pattern, message) for each argument; the message has
+            a {} placeholder for the first value not fully matching the pattern
+        properties: The allowed values of each property to validate
+    returns:
+        tuple(int, str): The exit code and failure message, or None if the arguments are okay
+    """
+    if not check_file:
+        return 5, "Failure: Missing required check-file"
+    if not os.path.isfile(check_file):
+        return 3, f"File to check does not exist: {check_file}"
+    for values, pattern, message in formats:
+        if (bad := _invalid(values, pattern)) is not None:
+            return 5, message.format(bad)
+    if not any(properties):
+        return 5, "Failure: Nothing set to be validated."
+    return None
+
+def _identify(check_file: str, index: str, checks: _Checks) -> tuple[tuple, str]:
+    """
+    Read the dimensions and compression of an image with ImageMagick's identify, adding
+    its stderr to the checks output if it fails
+    returns:
+        tuple(tuple, str): The exit code and failure message, or None if the image was
+            read; and the identify output
+    """
+    try:
+        proc = subprocess.run(
+            ['identify', '-format', r'%Wx%H\t%C', f"{check_file}[{index}]"],
+            capture_output=True, check=False
+        )
+    except OSError as exc:
+        return (3, f"Unable to run identify: {exc}"), ''
+    if proc.returncode != 0:
+        checks.stderr.extend(proc.stderr.splitlines(keepends=True))
+        return (3, f"Unable to read image properties of: {check_file}"), ''
+    return None, proc.stdout.decode('utf8', errors='replace').strip()
+
+def _media_track(check_file: str, track_type: str) -> dict:
+    """The properties of the first track of the type from mediainfo, or None if not probed"""
+    mediainfo = app.probes.mediainfo(check_file)
+    if mediainfo is None:
+        return None
+    tracks = [
+        track for track in mediainfo.get('media', {}).get('track', [])
+        if track.get('@type') == track_type
+    ]
+    return tracks[0] if tracks else {}
+
+def _found(track: dict, *props: str) -> list:
+    """Property values from a track, as strings the same as jq `tostring` would give"""
+    return [
+        'null' if track.get(prop) is None else str(track[prop]) for prop in props
+    ]
+
+def verify_hash(args: dict, _context: dict) -> tuple[int, list, list, dict]:
+    """
+    Verify a file's contents match the given hash(es); the same as the 'verify-hash:' stage.
+    args:
+        args: check-file, hash-file (string or list), hash-str, algo
+    """
+    ecode, stdout, stderr, results = _verify_hash(
+        args.get('check-file'), args.get('hash-file'), args.get('hash-str'), args.get('algo')
+    )
+    return ecode, stdout, stderr, {'verify-hash': results} if results else {}
+
+def validate_audio(args: dict, _context: dict) -> tuple[int, list, list, dict]:
+    """
+    Verify properties of the first audio stream of a media file; the same as the
+    validate-audio script, using the mediainfo output probed once per file.
+    args:
+        args: check-file, samplingrate, bitratemode, bitdepth (each a value or list
+            of allowed values)
+    """
+    check_file = args.get('check-file')
+    checks = _Checks(check_file, str(args.get('index', 0)))
+    samples = _arg_list(args, 'samplingrate')
+    bdepths = _arg_list(args, 'bitdepth')
+    brmodes = _arg_list(args, 'bitratemode')
+    problem = _arg_problem(check_file, [
+        (samples, r'[1-9][0-9]+', (
+            "Invalid samplingrate format. Must be rate in Hertz using only positive "
+            "integers. Invalid value: {}"
+        )),
+        (bdepths, r'[1-9][0-9]*|null', (
+            "Invalid bitdepth value. Must be a positive integer or 'null'. Invalid value: {}"
+        )),
+        ([mode.lower() for mode in brmodes], r'[acv]br', (
+            "Invalid bitratemode value. Must be either ABR, CBR, or VBR. Invalid value: {}"
+        )),
+    ], samples, bdepths, brmodes)
+    if problem is None and (track := _media_track(check_file, 'Audio')) is None:
+        problem = 3, f"Unable to read media properties of: {check_file}"
+    if problem is not None:
+        return checks.fail(*problem)
+
+    sample, bdepth, brmode = _found(track, 'SamplingRate', 'BitDepth', 'BitRate_Mode')
+    checks.check('samplingrate', 'sampling rate', samples, sample)
+    checks.check('bitdepth', 'bit depth', bdepths, bdepth)
+    checks.check('bitratemode', 'bitrate mode', brmodes, brmode)
+    return checks.done('Audio', 'validate-audio')
+
+def validate_video(args: dict, _context: dict) -> tuple[int, list, list, dict]:
+    """
+    Verify properties of the first video stream of a media file; the same as the
+    validate-video script, using the mediainfo output probed once per file.
+    args:
+        args: check-file, dimensions, bitdepth (each a value or list of allowed values)
+    """
+    check_file = args.get('check-file')
+    checks = _Checks(check_file, str(args.get('index', 0)))
+    dimens = _arg_list(args, 'dimensions', lower=True)
+    bdepths = _arg_list(args, 'bitdepth')
+    problem = _arg_problem(check_file, [
+        (dimens, r'[1-9][0-9]*x[1-9][0-9]*', _INVALID_DIMENSIONS),
+        (bdepths, r'[1-9][0-9]*', (
+            "Invalid bitdepth value. Must be a positive integer. Invalid value: {}"
+        )),
+    ], dimens, bdepths)
+    if problem is None and (track := _media_track(check_file, 'Video')) is None:
+        problem = 3, f"Unable to read media properties of: {check_file}"
+    if problem is not None:
+        return checks.fail(*problem)
+
+    width, height, bdepth = _found(track, 'Width', 'Height', 'BitDepth')
+    checks.check('dimensions', 'dimensions', dimens, f"{width}x{height}")
+    checks.check('bitdepth', 'bit depth', bdepths, bdepth)
+    return checks.done('Video', 'validate-video')
+
+def validate_image(args: dict, _context: dict) -> tuple[int, list, list, dict]:
+    """
+    Verify properties of an image; the same as the validate-image script, reading all
+    properties with a single run of ImageMagick's identify.
+    args:
+        args: check-file, index, dimensions, compression (each a value or list of
+            allowed values)
+    """
+    check_file = args.get('check-file')
+    index = str(args.get('index', 0))
+    checks = _Checks(check_file, index)
+    dimens = _arg_list(args, 'dimensions', lower=True)
+    comprs = _arg_list(args, 'compression', lower=True)
+    problem = _arg_problem(check_file, [
+        ([index], r'[0-9]+', (
+            "Value for index must be a non-negative integer. Invalid value: {}"
+        )),
+        (dimens, r'[1-9][0-9]*x[1-9][0-9]*', _INVALID_DIMENSIONS),
+        (comprs, r'(?s).+', (
+            "Empty compression value not allowed. Set to 'none' to validate no compression set."
+        )),
+    ], dimens, comprs)
+    output = ''
+    if problem is None:
+        problem, output = _identify(check_file, index, checks)
+    if problem is not None:
+        return checks.fail(*problem)
+
+    dimen, _, compr = output.partition('\t')
+    checks.check('dimensions', 'dimensions', dimens, dimen)
+    checks.check('compression', 'compression', comprs, compr.lower())
+    return checks.done('Image', 'validate-image')
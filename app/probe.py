@@ -0,0 +1,150 @@
+"""
+Colophon media file probe cache, so each file is only probed once per run
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import Future
+import app
+
+# Command to probe a media file; the file path is appended
+MEDIAINFO_COMMAND = ('mediainfo', '-f', '--Output=JSON')
+
+class ProbeCache:
+    """
+    The mediainfo JSON output for each media file probed during the run, saved to a
+    temp directory so scripts may read it instead of probing the file again. Files are
+    identified by path, size, modification time, and inode; stages running at the same
+    time which need the same file wait for a single probe.
+
+    Templates get the path the output will be saved to without probing the file; the
+    file is only probed once a script using that path is run (see run_probes()), so
+    stages which are not run (e.g. already completed, or replayed from a cache) never
+    probe their files.
+    """
+    def __init__(self, command: tuple=MEDIAINFO_COMMAND):
+        self.command = list(command)
+        self.cachedir = None
+        # Output path to [media file path, Future of the probe result once started]
+        self.probes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def identity(filepath: str) -> tuple:
+        """The identity of a file version; a changed file is probed again"""
+        fstat = os.stat(filepath)
+        return (os.path.realpath(filepath), fstat.st_size, fstat.st_mtime_ns, fstat.st_ino)
+
+    def output_path(self, filepath: str) -> str:
+        """
+        Get the path the mediainfo JSON output for a file is saved to, without probing it
+        args:
+            filepath: The media file
+        returns:
+            The path to the JSON file, or empty string if the file does not exist
+        """
+        try:
+            ident = self.identity(filepath)
+        except OSError:
+            return ''
+        with self._lock:
+            if self.cachedir is None:
+                self.cachedir = tempfile.mkdtemp(prefix='colophon_probes_')
+            probe_path = os.path.join(
+                self.cachedir, hashlib.sha1(repr(ident).encode()).hexdigest() + '.json'
+            )
+            self.probes.setdefault(probe_path, [filepath, None])
+        return probe_path
+
+    def mediainfo_path(self, filepath: str) -> str:
+        """
+        Get the path to the mediainfo JSON output for a file, probing the file if it
+        has not yet been probed
+        args:
+            filepath: The media file
+        returns:
+            The path to the JSON file, or empty string if the file could not be probed
+        """
+        probe_path = self.output_path(filepath)
+        return self._run_probe(probe_path) if probe_path else ''
+
+    def mediainfo(self, filepath: str) -> dict:
+        """
+        Get the mediainfo output for a file, probing the file if it has not yet been probed
+        returns:
+            The parsed JSON output, or None if the file could not be probed
+        """
+        if not (probe_path := self.mediainfo_path(filepath)):
+            return None
+        with open(probe_path, 'r', encoding='utf8') as probe_file:
+            return json.load(probe_file)
+
+    def run_probes(self, command: str):
+        """
+        Probe the files whose output paths (from output_path()) the command makes use of,
+        if not yet probed; must be called before running the command
+        """
+        if self.cachedir is None:
+            return
+        for probe_path in re.findall(re.escape(self.cachedir) + r"/[0-9a-f]{40}\.json", command):
+            self._run_probe(probe_path)
+
+    def _run_probe(self, probe_path: str) -> str:
+        """Probe the file for the output path if not yet probed, waiting for the result"""
+        with self._lock:
+            if (probe := self.probes.get(probe_path)) is None:
+                return ''
+            owner = probe[1] is None
+            if owner:
+                probe[1] = Future()
+        if owner:
+            result = ''
+            try:
+                result = self._probe(probe[0], probe_path)
+            finally:
+                probe[1].set_result(result)
+        return probe[1].result()
+
+    def _probe(self, filepath: str, probe_path: str) -> str:
+        """Run the probe command, saving the output; returns the output path or empty string"""
+        app.logger.debug(f"Probing media file: {filepath}")
+        try:
+            with open(probe_path, 'wb') as probe_file:
+                proc = subprocess.run(
+                    [*self.command, filepath],
+                    stdout=probe_file, stderr=subprocess.PIPE, check=False
+                )
+        except OSError as exc:
+            app.logger.warning(f"Unable to probe media file {filepath}: {exc}")
+            proc = None
+        if proc is not None and proc.returncode != 0:
+            app.logger.warning(
+                f"Unable to probe media file {filepath} (exit={proc.returncode}): "
+                f"{proc.stderr.decode('utf8', errors='replace').strip()}"
+            )
+        if proc is None or proc.returncode != 0:
+            # Scripts given the path run the probe themselves when there is no output
+            with contextlib.suppress(OSError):
+                os.remove(probe_path)
+            return ''
+        return probe_path
+
+    def close(self):
+        """Remove the saved probe output"""
+        with self._lock:
+            if self.cachedir is not None:
+                shutil.rmtree(self.cachedir, ignore_errors=True)
+            self.cachedir = None
+            self.probes = {}
+
+    def __len__(self):
+        return len(self.probes)
+
+    def __repr__(self):
+        return f"ProbeCache(command={self.command[0]}, probes={len(self)})"
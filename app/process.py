@@ -2,11 +2,15 @@
 Process handling
 """
 import os
+import json
 import subprocess
 import pathlib
 import app
 from app.helpers import ExitCode
 
+# Filename for results within each stage output directory
+RESULTS_FILE = "results.json"
+
 def exec_command(cmd: str|list, shell: bool=False, redirect_stderr: bool=False):
     """
     Run the given command or shell commands.
@@ -60,3 +64,39 @@ def write_output(
     with open(os.path.join(directory, stderr_file), 'ab') as sef:
         sef.writelines(stderr)
     return ecode
+
+def append_results(results_path: str, key: str, items: list):
+    """
+    Append items to the list under the given key in a results JSON file, in the
+    same way as scripts do.
+    Args:
+        results_path: The results JSON file for the stage; created if it doesn't exist
+        key: The top level key in the results; usually the name of the check
+        items: The result items to append to the list for the key
+    """
+    results = {}
+    if os.path.exists(results_path):
+        with open(results_path, 'r', encoding='utf8') as rfile:
+            results = json.load(rfile)
+    results.setdefault(key, []).extend(items)
+    with open(results_path, 'w', encoding='utf8') as rfile:
+        json.dump(results, rfile)
+
+def merge_results(results: dict, fragment: dict) -> dict:
+    """
+    Merge results from a single stage into the overall results. Lists under the same
+    key are concatenated, dicts are updated, and any other values are replaced.
+    Args:
+        results: The overall results, which are updated
+        fragment: The results from a single stage
+    Returns:
+        The updated overall results
+    """
+    for key, val in fragment.items():
+        if isinstance(val, list) and isinstance(results.get(key), list):
+            results[key].extend(val)
+        elif isinstance(val, dict) and isinstance(results.get(key), dict):
+            results[key].update(val)
+        else:
+            results[key] = val
+    return results
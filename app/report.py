@@ -6,9 +6,10 @@ import csv
 import json
 import shutil
 from datetime import datetime
-from collections import defaultdict
 import app
 from app.helpers import ExitCode
+from app.manifest import KeyTable, ManifestEntry
+from app.process import RESULTS_FILE, merge_results
 from app.template import render_template_string
 
 class ManifestReport:
@@ -17,6 +18,11 @@ class ManifestReport:
     def generate(savedir: str=None, filename: str="manifest.csv"):
         """Create report and save in workdir"""
         savedir = savedir if savedir else app.workdir
+        if app.manifest.stream:
+            # Rows were already written as each chunk completed
+            if not os.path.exists(os.path.join(app.workdir, filename)):
+                ManifestReport.append([], savedir, filename)
+            return
         # pylint: disable=unsubscriptable-object
         mfrows = [max(app.manifest, key=len).headers() if len(app.manifest) else app.manifest.headers]
         for entry in app.manifest:
@@ -26,36 +32,100 @@ class ManifestReport:
             mfcsv = csv.writer(mfcsv_file, quoting=csv.QUOTE_ALL)
             mfcsv.writerows(mfrows)
 
+    @staticmethod
+    def append(entries: list, savedir: str=None, filename: str="manifest.csv"):
+        """Append entries to the report in workdir, creating it with a header row if needed"""
+        savedir = savedir if savedir else app.workdir
+        mfcsv_path = os.path.join(app.workdir, filename)
+        new_report = not os.path.exists(mfcsv_path)
+        with open(mfcsv_path, 'a', newline='', encoding='utf8') as mfcsv_file:
+            mfcsv = csv.writer(mfcsv_file, quoting=csv.QUOTE_ALL)
+            if new_report:
+                mfcsv.writerow(max(entries, key=len).headers() if entries else app.manifest.headers)
+            mfcsv.writerows(entry.values() for entry in entries)
+
+def read_manifest_report(savedir: str=None, filename: str="manifest.csv"):
+    """Iterate over the rows of the manifest CSV report as entries"""
+    savedir = savedir if savedir else app.workdir
+    with open(os.path.join(savedir, filename), newline='', encoding='utf8') as mfcsv_file:
+        mfcsv = csv.reader(mfcsv_file)
+        keys = KeyTable(next(mfcsv, []))
+        for row in mfcsv:
+            yield ManifestEntry(keys, row)
+
 class IgnoredReport:
     """Report for files left unassociated"""
     @staticmethod
-    def generate(savedir: str=None, filename: str="ignored.json"):
-        """Create report and save in workdir"""
+    def generate(savedir: str=None, filename: str="ignored.json", ignored: list=None):
+        """
+        Create report and save in workdir
+        args:
+            ignored: The manifest ids of ignored rows, if already known from the summary
+        """
         savedir = savedir if savedir else app.workdir
-        ignored = []
-
-        for entry in app.manifest:
-            mfid = app.suite.manifest_id(entry)
-            if entry.ignored:
-                ignored.append(mfid)
+        if ignored is None:
+            ignored = [
+                app.suite.manifest_id(entry) for entry in app.manifest if entry.ignored
+            ]
 
         ignored_path = os.path.join(app.workdir, filename)
         with open(ignored_path, 'w', encoding='utf8') as ignored_file:
             json.dump(ignored, ignored_file, indent=2)
             ignored_file.write('\n')
 
-def ecode_counts(search_dir: str):
-    """
-    Given a directory, find all files in the form "ecode.N"
-    where N is a return code. Return a dict of key N to the
-    count of matching files grouped by N.
-    """
-    ecodes = defaultdict(int)
-    for _, _, files in os.walk(search_dir):
-        for fname in files:
-            if fname.startswith("ecode."):
-                ecodes[fname.removeprefix("ecode.")] += 1
-    return dict(ecodes)
+class UnassociatedReport:
+    """Report for files left unassociated by every suite, when running several suites"""
+    @staticmethod
+    def generate(runs: list, savedir: str=None, filename: str="unassociated.json") -> int:
+        """
+        Create report and save in workdir
+        args:
+            runs: The SuiteRun of each suite, none of which are active
+        returns:
+            The number of unassociated files
+        """
+        savedir = savedir if savedir else app.workdir
+        unassociated = [
+            fpath for fpath, _ in app.sourcedir
+            if not any(run.associated.get(fpath) for run in runs)
+        ]
+
+        unassociated_path = os.path.join(savedir, filename)
+        with open(unassociated_path, 'w', encoding='utf8') as unassociated_file:
+            json.dump(unassociated, unassociated_file, indent=2)
+            unassociated_file.write('\n')
+        return len(unassociated)
+
+class ResultsReport:
+    """Results from all stages, merged from the results file in each stage output directory"""
+    @staticmethod
+    def generate(savedir: str=None, filename: str=RESULTS_FILE):
+        """Create report and save in workdir"""
+        savedir = savedir if savedir else app.workdir
+        results = {}
+        for entry in app.manifest:
+            if entry.ignored:
+                continue
+            merged = set()
+            # Runs are recorded in stage order, and loop runs in suffix order
+            for run in app.ledger.entry_runs(app.suite.manifest_id(entry)):
+                fragment_relpath = os.path.join(run.stagedir, RESULTS_FILE)
+                if run.stagedir in merged or fragment_relpath not in run.outputs:
+                    continue
+                merged.add(run.stagedir)
+                fragment_path = os.path.join(app.workdir, fragment_relpath)
+                with open(fragment_path, 'r', encoding='utf8') as fragment_file:
+                    try:
+                        fragment = json.load(fragment_file)
+                    except json.JSONDecodeError:
+                        app.logger.warning(f"Unable to parse stage results: {fragment_path}")
+                        continue
+                if isinstance(fragment, dict):
+                    merge_results(results, fragment)
+
+        results_path = os.path.join(savedir, filename)
+        with open(results_path, 'w', encoding='utf8') as results_file:
+            json.dump(results, results_file)
 
 class SummaryReport:
     """Summary report of overall run"""
@@ -63,6 +133,7 @@ class SummaryReport:
         self.failed = None
         self.skipped = None
         self.unassociated = None
+        self.ignored = None
 
     def generate(self, savedir: str=None, filename: str="summary.json"):
         """Create report and save in workdir"""
@@ -75,16 +146,19 @@ class SummaryReport:
             'rows': {}
         }
 
-        ignored = 0
+        ignored = []
+        succeeded = 0
         for entry in app.manifest:
+            mfid = app.suite.manifest_id(entry)
             if entry.ignored:
-                ignored += 1
+                ignored.append(mfid)
                 continue
-            mfid = app.suite.manifest_id(entry)
+            if not entry.skipped and not entry.failures:
+                succeeded += 1
 
             # Exit-code summary per row
             summary['rows'][mfid] = (row := {})
-            if (exit_codes := ecode_counts(os.path.join(app.workdir, mfid))):
+            if (exit_codes := app.ledger.ecode_counts(mfid)):
                 ec_details = {
                     ec_val: {
                         "occurrences": ec_cnt,
@@ -106,6 +180,7 @@ class SummaryReport:
 
         self.failed = len(summary['failed'])
         self.skipped = len(summary['skipped'])
+        self.ignored = ignored
 
         # Unassociated files
         for fpath, _ in app.sourcedir.files(associated=False):
@@ -113,14 +188,16 @@ class SummaryReport:
         self.unassociated = len(summary['unassociated-files'])
 
         # Manifest row overview
-        succeeded = len([ent for ent in app.manifest if not ent.skipped and not ent.failures])
         summary['row-overview'] = {
             'succeeded': succeeded,
             'failed': self.failed,
             'skipped': self.skipped
         }
         if ignored:
-            summary['row-overview']['ignored'] = ignored
+            summary['row-overview']['ignored'] = len(ignored)
+
+        # Time taken by each phase of the run and each script run
+        summary['timings'] = app.timings.summary()
 
         # Write summary file
         summary_path = os.path.join(app.workdir, filename)
@@ -128,6 +205,18 @@ class SummaryReport:
             json.dump(summary, summary_file, indent=2)
             summary_file.write('\n')
 
+    @staticmethod
+    def update_timings(savedir: str=None, filename: str="summary.json"):
+        """Update the timings in the summary saved in workdir with the latest timings"""
+        savedir = savedir if savedir else app.workdir
+        summary_path = os.path.join(app.workdir, filename)
+        with open(summary_path, 'r', encoding='utf8') as summary_file:
+            summary = json.load(summary_file)
+        summary['timings'] = app.timings.summary()
+        with open(summary_path, 'w', encoding='utf8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+            summary_file.write('\n')
+
     def exit_code(self, strict: bool=False):
         """
         Return the appropriate exit code given the report generated
@@ -157,9 +246,14 @@ class OverviewPage:
     def generate(
         savedir: str=None,
         filename: str="overview.html",
-        template: str="overview.html.j2"
+        template: str="overview.html.j2",
+        logpath: str=None
     ):
-        """Create overview and save in workdir"""
+        """
+        Create overview and save in workdir
+        args:
+            logpath: The log file of the run; defaults to colophon.log in the workdir
+        """
         savedir = savedir if savedir else app.workdir
         filename = filename if filename else app.workdir
         template = template if template else app.workdir
@@ -170,16 +264,12 @@ class OverviewPage:
         with open(os.path.join(app.workdir, 'results.json'), 'r', encoding='utf8') as rfh:
             resdat = json.load(rfh)
 
-        with open(os.path.join(app.workdir, 'colophon.log'), 'r', encoding='utf8') as lfh:
+        logpath = logpath if logpath else os.path.join(app.workdir, 'colophon.log')
+        with open(logpath, 'r', encoding='utf8') as lfh:
             logdat = lfh.readlines()
 
-        fildat = []
-        for root, dirs, files in os.walk(app.workdir):
-            if root == app.workdir:
-                continue
-            for file in files:
-                fildat.append(os.path.join(root, file).removeprefix(f"{app.workdir}/"))
-        fildat.sort()
+        # Output of every script run, as recorded in the ledger
+        fildat = sorted(set(app.ledger.outputs()))
 
         # Read in external files for embedding
         js_data, css_data = [], []
@@ -200,7 +290,8 @@ class OverviewPage:
             "now": datetime.now().replace(microsecond=0).isoformat(),
             "summary": json.dumps(sumdat, indent=2),
             "results": json.dumps(resdat, indent=2),
-            "manifest": app.manifest,
+            "timings": sumdat.get('timings', {}),
+            "manifest": read_manifest_report() if app.manifest.stream else app.manifest,
             "files": fildat,
             "logs": logdat,
             "js_data": js_data,
@@ -0,0 +1,141 @@
+"""
+Colophon retry of stages from a previous run's output zip
+"""
+import os
+import json
+import shutil
+import zipfile
+import pathlib
+from collections import defaultdict
+import app
+from app.process import RESULTS_FILE
+
+# The start of a zstd compressed file, such as a .tar.zst output bundle
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+class RetryBundle:
+    """
+    The output zip file from a previous run, used to determine which stages already
+    passed (and so can have their output restored instead of running them again). The
+    zip file is kept open until close(), so restoring stages reads its central directory
+    only once.
+    """
+    def __init__(self, zippath: str=None):
+        self.zippath = None
+        self.summary = None
+        self.ecodes = None
+        self.members = None
+        self._zfile = None
+        if zippath:
+            self.load(zippath)
+
+    def load(self, zippath: str=None):
+        """Load summary, results, and stage exit codes from the output zip file"""
+        self.zippath = zippath if zippath else self.zippath
+        self.ecodes = defaultdict(list)
+        self.members = defaultdict(list)
+        fragments = False
+        self.close()
+        try:
+            # pylint: disable=consider-using-with
+            self._zfile = zipfile.ZipFile(self.zippath)
+            self.summary = json.loads(self._zfile.read('summary.json'))
+            results = json.loads(self._zfile.read(RESULTS_FILE))
+            for member in self._zfile.namelist():
+                parts = member.split('/')
+                # Stage output is always: {mfid}/{stage}{suffix}/{filename}
+                if len(parts) != 3 or not parts[2]:
+                    continue
+                stagedir = f"{parts[0]}/{parts[1]}"
+                self.members[stagedir].append(member)
+                # Results are within each stage output dir, rather than only merged
+                if parts[2] == RESULTS_FILE:
+                    fragments = True
+                if parts[2].startswith("ecode."):
+                    self.ecodes[stagedir].append(parts[2].removeprefix("ecode."))
+        except FileNotFoundError:
+            raise app.ColophonException(
+                f"Unable to open retry zip - file missing: {self.zippath}"
+            ) from None
+        except zipfile.BadZipFile:
+            with open(self.zippath, 'rb') as bfile:
+                zstd = bfile.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC
+            if zstd:
+                raise app.ColophonException(
+                    "Unable to use retry bundle - only zip files can be retried, not those "
+                    f"written with --compression zstd: {self.zippath}"
+                ) from None
+            raise app.ColophonException(
+                f"Unable to read retry zip - invalid zip: {self.zippath}"
+            ) from None
+        except KeyError as exc:
+            self.close()
+            raise app.ColophonException(
+                f"Unable to use retry zip - not a Colophon output file: {exc}"
+            ) from None
+        # Results of stages which are run again could not be told apart from the results
+        # of restored stages within the merged results
+        if results and not fragments:
+            self.close()
+            raise app.ColophonException(
+                "Unable to use retry zip - written by an earlier version of Colophon, "
+                f"without the results of each stage: {self.zippath}"
+            )
+        app.logger.info(f"Loaded {self}")
+
+    def passed(self, stagedir: str) -> bool:
+        """
+        Check if the script(s) for a stage all completed successfully in the previous run.
+        Scripts which requested their manifest row be skipped are not considered passed so
+        that they run again and skip the row again.
+        args:
+            stagedir: Stage output dir, relative to the workdir; e.g. '{mfid}/{stage}{suffix}'
+        """
+        ecodes = self.ecodes.get(stagedir)
+        return bool(ecodes) and all(ec.isdigit() and int(ec) & 17 == 0 for ec in ecodes)
+
+    def restore(self, stagedir: str, workdir: str) -> bool:
+        """
+        If the stage passed in the previous run, copy its output into the workdir.
+        args:
+            stagedir: Stage output dir, relative to the workdir; e.g. '{mfid}/{stage}{suffix}'
+            workdir: The workdir to restore the stage output into
+        returns:
+            True if the output was restored, False if the stage must be run again
+        """
+        if not self.passed(stagedir):
+            return False
+        # Only files directly within the stage output dir are restored, so a crafted zip
+        # file cannot write outside of it
+        stage_path = os.path.normpath(os.path.join(workdir, stagedir))
+        dest_paths = [
+            os.path.normpath(os.path.join(workdir, member)) for member in self.members[stagedir]
+        ]
+        if os.path.dirname(os.path.dirname(stage_path)) != os.path.normpath(workdir) or any(
+            os.path.dirname(dest_path) != stage_path for dest_path in dest_paths
+        ):
+            raise app.ColophonException(
+                f"Unable to use retry zip - stage output outside its stage directory: {stagedir}"
+            )
+        pathlib.Path(stage_path).mkdir(parents=True, exist_ok=True)
+        # The zip file may be read by several threads at once
+        for member, dest_path in zip(self.members[stagedir], dest_paths):
+            with (
+                self._zfile.open(member) as src,
+                open(dest_path, 'wb') as dst
+            ):
+                shutil.copyfileobj(src, dst)
+        return True
+
+    def close(self):
+        """Close the zip file, once no more stages are to be restored"""
+        if self._zfile is not None:
+            self._zfile.close()
+            self._zfile = None
+
+    def __repr__(self):
+        return (
+            f"RetryBundle(filename={os.path.basename(self.zippath)}, "
+            f"failed={len(self.summary.get('failed', []))}, "
+            f"passed-stages={len([sd for sd in self.ecodes if self.passed(sd)])})"
+        )
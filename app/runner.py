@@ -0,0 +1,204 @@
+"""
+Colophon asynchronous script runner, streaming script output to files
+"""
+import os
+import time
+import signal
+import asyncio
+import threading
+import subprocess
+import app
+from app.timings import read_io_chars, make_usage
+
+# Maximum bytes kept from the end of each script's stderr, for logging
+TAIL_SIZE = 8 * 1024
+# Lines from the end of stderr logged when a script does not succeed
+TAIL_LINES = 10
+# Seconds to wait for output still being written after a timed out script is killed
+KILL_GRACE = 5
+
+class OutputTail:
+    """The last bytes written to an output, up to a maximum size"""
+    def __init__(self, max_size: int=TAIL_SIZE):
+        self.max_size = max_size
+        self.data = bytearray()
+
+    def add(self, data: bytes):
+        """Add output data, dropping the oldest data beyond the maximum size"""
+        self.data += data
+        if len(self.data) > self.max_size:
+            del self.data[:len(self.data) - self.max_size]
+
+    def lines(self, count: int=TAIL_LINES) -> list:
+        """The last lines of the output, decoded"""
+        return [
+            line.decode('utf8', errors='replace')
+            for line in bytes(self.data).splitlines()[-count:]
+        ]
+
+class _OutputWriter(asyncio.Protocol):
+    """Writes data from a script's output pipe to a file as it arrives"""
+    def __init__(self, outfile, closed: asyncio.Future, tail: OutputTail=None):
+        self.outfile = outfile
+        self.closed = closed
+        self.tail = tail
+
+    def data_received(self, data: bytes):
+        self.outfile.write(data)
+        if self.tail is not None:
+            self.tail.add(data)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+class ScriptRunner:
+    """
+    Runs stage scripts from a single event loop in a background thread. Any number of
+    threads may run scripts at the same time, each waiting on its own script. Script
+    output is written straight to the stage's output files rather than held in memory,
+    with only the end of stderr kept for logging.
+    """
+    def __init__(self, timeout: float=None):
+        # Default number of seconds a script may run for before it is killed
+        self.timeout = timeout
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the event loop thread, if not already running"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='script-runner', daemon=True
+                )
+                self._thread.start()
+
+    # pylint: disable=too-many-arguments
+    def run(
+        self, cmd: str, stagedir: str, timeout: float=None, usage: dict=None,
+        stdout_file: str="stdout.txt", stderr_file: str="stderr.txt"
+    ) -> tuple[int, list, list]:
+        """
+        Run a shell command, appending its output to files within the stage directory.
+        Paths are relative to the install path, the same as exec_command().
+        args:
+            cmd: The shell command
+            stagedir: The stage output directory to write output files into
+            timeout: Seconds the command may run for before being killed; defaults to
+                the runner's timeout
+            usage: If set, this dict will be updated with the resource usage of the command
+        returns:
+            tuple(int, list, list): Exit code, and empty stdout and stderr lists as the
+                output was already written
+        """
+        self._start()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(
+                os.path.join(app.install_path, cmd),
+                os.path.join(stagedir, stdout_file),
+                os.path.join(stagedir, stderr_file),
+                timeout if timeout is not None else self.timeout,
+                usage if usage is not None else {}
+            ),
+            self._loop
+        )
+        return future.result(), [], []
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    async def _run(
+        self, cmd: str, stdout_path: str, stderr_path: str, timeout: float, usage: dict
+    ) -> int:
+        """Run the command and wait for it to exit, killing it if it times out"""
+        loop = asyncio.get_running_loop()
+        app.logger.debug(f"Executing (shell=True): {cmd}")
+        started = time.monotonic()
+        tail = OutputTail()
+        with (
+            open(stdout_path, 'ab') as stdout,
+            open(stderr_path, 'ab') as stderr
+        ):
+            # In its own session so any commands it starts are also killed on timeout
+            # pylint: disable=consider-using-with
+            proc = subprocess.Popen(
+                cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                start_new_session=True
+            )
+            readers = []
+            for pipe, outfile, ptail in ((proc.stdout, stdout, None), (proc.stderr, stderr, tail)):
+                closed = loop.create_future()
+                transport, _ = await loop.connect_read_pipe(
+                    lambda outfile=outfile, closed=closed, ptail=ptail:
+                        _OutputWriter(outfile, closed, ptail),
+                    pipe
+                )
+                readers.append((transport, closed))
+            exited = loop.create_task(self._wait_exit(proc, started, usage))
+            done, _ = await asyncio.wait([exited], timeout=timeout)
+            timed_out = exited not in done
+            if timed_out:
+                os.killpg(proc.pid, signal.SIGKILL)
+                await exited
+            # Output may still be buffered in the pipes after the script exits
+            await asyncio.wait(
+                [closed for _, closed in readers], timeout=KILL_GRACE if timed_out else None
+            )
+            for transport, _ in readers:
+                transport.close()
+            ecode = proc.returncode
+            if timed_out:
+                msg = f"Script timed out after {timeout} seconds and was killed."
+                stderr.write(f"{msg}\n".encode())
+                app.logger.warning(f"{msg} Command was: {cmd}")
+                ecode = 1
+        app.logger.debug(f"Command exited with code: {ecode}")
+        if ecode != 0 and (lines := tail.lines()):
+            app.logger.debug("End of stderr:\n" + "\n".join(lines))
+        return ecode
+
+    @staticmethod
+    async def _wait_exit(proc: subprocess.Popen, started: float, usage: dict):
+        """
+        Wait for the process to exit, then reap it using os.wait4() in order to get its
+        resource usage (which includes any children it waited for).
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+        # Wait without reaping, so the bytes read can still be found for the process
+        if pidfd is None:
+            await loop.run_in_executor(
+                None, os.waitid, os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT
+            )
+        else:
+            exited = loop.create_future()
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+        read_bytes = read_io_chars(f"/proc/{proc.pid}")
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        usage.update(make_usage(
+            time.monotonic() - started,
+            rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss, read_bytes
+        ))
+
+    def close(self):
+        """Stop the event loop thread"""
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop, self._thread = None, None
+
+    def __repr__(self):
+        return f"ScriptRunner(timeout={self.timeout}, running={self._loop is not None})"
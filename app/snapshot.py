@@ -0,0 +1,138 @@
+"""
+Colophon snapshot of a scanned source directory, kept between runs
+"""
+import os
+import time
+import marshal
+import hashlib
+import threading
+from array import array
+from collections import namedtuple
+import app
+from app.helpers import cache_path, replaced_file
+
+# Changing the snapshot format invalidates previously saved snapshots
+SNAPSHOT_FORMAT = 1
+# Directories modified this recently when scanned may still be changing within the same
+# mtime tick, so are scanned again next run regardless of their mtime
+RACY_NS = 2 * 1000 * 1000 * 1000
+
+# The file metadata kept in the snapshot, in place of an os.stat_result
+SnapshotStat = namedtuple('SnapshotStat', ('st_size', 'st_mtime_ns', 'st_ino'))
+
+class DirectorySnapshot:
+    """
+    The scanned files and subdirectories of each directory in a source directory tree,
+    saved in a marshal file so the next scan of the same tree only needs to scan the
+    directories which have changed. A directory is only scanned again if its mtime has
+    changed, which happens when files within it are created, removed, or renamed; files
+    modified in place are not noticed.
+    Each directory is saved as:
+        (MTIME_NS, NAMES, SIZES, MTIMES_NS, INODES, SUBDIRS)
+    where the file names are joined by NUL characters and the file sizes, mtimes, and
+    inodes are each packed as arrays of 64 bit integers, so a snapshot of millions of
+    files loads without creating an object for each value.
+    """
+    def __init__(self, filepath: str=None):
+        self.filepath = None
+        self.dirs = {}
+        self.reused = 0
+        self.scanned = 0
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        if filepath:
+            self.load(filepath)
+
+    @staticmethod
+    def default_path(dirpath: str, include: list=None, exclude: list=None) -> str:
+        """The default location of the snapshot for a directory and its scan globs"""
+        key = repr((os.path.realpath(dirpath), include or [], exclude or []))
+        return cache_path('snapshots', hashlib.sha1(key.encode()).hexdigest() + '.snap')
+
+    def load(self, filepath: str=None):
+        """Load the snapshot file; a missing or unreadable snapshot is the same as empty"""
+        self.filepath = os.path.abspath(filepath) if filepath else self.filepath
+        self.dirs = {}
+        try:
+            with open(self.filepath, 'rb') as sfile:
+                snapshot = marshal.load(sfile)
+            if snapshot[0] == SNAPSHOT_FORMAT:
+                self.dirs = snapshot[1]
+        except FileNotFoundError:
+            pass
+        except (OSError, EOFError, ValueError, TypeError, IndexError) as exc:
+            app.logger.warning(f"Unable to read directory snapshot {self.filepath}: {exc}")
+        app.logger.info(f"Loaded {self}")
+
+    def scan_dir(self, dirpath: str, scan_dir) -> tuple[str, list, list]:
+        """
+        Get the files and subdirectories of a directory from the snapshot if unchanged,
+        otherwise by scanning it.
+        args:
+            dirpath: The directory, relative to the source directory
+            scan_dir: The function to scan the directory; see Directory._scan_dir()
+        returns:
+            tuple(str, list, list): The directory, (filepath, stat) pairs, subdirectories
+        """
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return scan_dir(dirpath)
+        cached = self.dirs.get(dirpath)
+        with self._lock:
+            self._mtimes[dirpath] = mtime_ns if time.time_ns() - mtime_ns > RACY_NS else None
+            if cached is None or cached[0] != mtime_ns:
+                self.scanned += 1
+                cached = None
+            else:
+                self.reused += 1
+        if cached is None:
+            return scan_dir(dirpath)
+        _, names, sizes, mtimes, inodes, subdirs = cached
+        prefix = '' if dirpath == '.' else f"{dirpath}/"
+        return dirpath, [
+            (prefix + name, SnapshotStat(size, mtime, inode))
+            for name, size, mtime, inode in zip(
+                names.split('\0') if names else [],
+                array('Q', sizes), array('q', mtimes), array('Q', inodes)
+            )
+        ], list(subdirs)
+
+    def save(self, scanned: dict):
+        """
+        Save the snapshot of a scan, if any directories were scanned rather than re-used
+        args:
+            scanned: The scanned directories; see Directory.scan()
+        """
+        if not self.scanned and len(scanned) == len(self.dirs):
+            return
+        dirs = {}
+        for dirpath, (files, subdirs) in scanned.items():
+            if (mtime_ns := self._mtimes.get(dirpath)) is None:
+                # Not saved, so it is scanned again next run
+                continue
+            dirs[dirpath] = (
+                mtime_ns,
+                '\0'.join(os.path.basename(fpath) for fpath, _ in files),
+                array('Q', (fstat.st_size for _, fstat in files)).tobytes(),
+                array('q', (fstat.st_mtime_ns for _, fstat in files)).tobytes(),
+                array('Q', (fstat.st_ino for _, fstat in files)).tobytes(),
+                subdirs,
+            )
+        try:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            with replaced_file(self.filepath, 'wb') as tfile:
+                marshal.dump((SNAPSHOT_FORMAT, dirs), tfile)
+        except OSError as exc:
+            app.logger.warning(f"Unable to save directory snapshot {self.filepath}: {exc}")
+            return
+        self.dirs = dirs
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def __repr__(self):
+        return (
+            f"DirectorySnapshot(filename={os.path.basename(self.filepath or '')}, "
+            f"dirs={len(self)}, reused={self.reused}, scanned={self.scanned})"
+        )
@@ -0,0 +1,229 @@
+"""
+Colophon persistent cache of stage results, so unchanged work is not run again
+"""
+import os
+import json
+import hashlib
+import threading
+import app
+from app.hashing import verify_hash_stage
+from app.helpers import cache_path, replaced_file
+from app.plugins import PluginCall, load_plugin
+from app.process import RESULTS_FILE
+
+# Default maximum total size of the cache in MiB
+DEFAULT_MAX_SIZE_MB = 1024
+# When the cache exceeds its maximum size, least recently used results are removed
+# until it is under this fraction of the maximum size
+EVICT_TO = 0.9
+# Stands in for the workdir within cached output, as each run has its own workdir
+WORKDIR_MARKER = "\0workdir\0"
+# Stands in for the mediainfo output directory within cache keys, as each run has its own
+PROBES_MARKER = "\0probes\0"
+# Changing the cached result format invalidates previously cached results
+CACHE_FORMAT = 1
+
+class StageCache:
+    """
+    A persistent cache of the output of stage runs which did not fail, stored one file per
+    result within a cache directory. Results are keyed on the stage name, the rendered
+    script, and the identities (size, mtime, inode) of the script and all files associated
+    with the manifest row; a change to any of them means the stage is run again. When the
+    cache grows beyond its maximum size, the least recently used results are removed.
+    """
+    def __init__(self, dirpath: str=None, max_size: int=DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        self.dirpath = None
+        self.max_size = max_size
+        # Cache key to (last used time, size) of each cached result
+        self.entries = None
+        self.size = 0
+        self.hits = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        if dirpath:
+            self.load(dirpath)
+
+    @staticmethod
+    def default_path() -> str:
+        """The default location of the stage cache directory"""
+        return cache_path('stages')
+
+    def load(self, dirpath: str=None):
+        """Find the results in the cache directory, creating it if it does not yet exist"""
+        self.dirpath = os.path.abspath(dirpath) if dirpath else self.dirpath
+        self.entries, self.size = {}, 0
+        try:
+            os.makedirs(self.dirpath, exist_ok=True)
+            with os.scandir(self.dirpath) as subdirs:
+                for subdir in subdirs:
+                    if not subdir.is_dir():
+                        continue
+                    with os.scandir(subdir.path) as dentries:
+                        for dentry in dentries:
+                            if dentry.name.endswith('.json'):
+                                fstat = dentry.stat()
+                                self.entries[dentry.name[:-5]] = (fstat.st_mtime, fstat.st_size)
+                                self.size += fstat.st_size
+        except OSError as exc:
+            raise app.ColophonException(
+                f"Unable to use stage cache {self.dirpath}: {exc}"
+            ) from None
+        self.evict()
+        app.logger.info(f"Loaded {self}")
+
+    def _path(self, key: str) -> str:
+        """The path to the cached result file for a key"""
+        return os.path.join(self.dirpath, key[:2], f"{key}.json")
+
+    @staticmethod
+    def _code_identity(ready_script: str|dict|PluginCall) -> list:
+        """The identity of the script or Python source which runs the stage"""
+        if isinstance(ready_script, PluginCall):
+            codepath = load_plugin(ready_script.name).__code__.co_filename
+        elif isinstance(ready_script, dict):
+            codepath = verify_hash_stage.__code__.co_filename
+        else:
+            words = ready_script.split(maxsplit=1)
+            codepath = os.path.join(app.install_path or '', words[0]) if words else ''
+        try:
+            fstat = os.stat(codepath)
+        except OSError:
+            return [codepath]
+        return [codepath, fstat.st_size, fstat.st_mtime_ns, fstat.st_ino]
+
+    def key(self, stage: str, ready_script: str|dict|PluginCall, entry) -> str:
+        """
+        Get the cache key for a stage run
+        args:
+            stage: The stage name
+            ready_script: The rendered script (or arguments) from SuiteStage.script()
+            entry: The manifest entry the stage is run for
+        returns:
+            The key as a hex string, or None if a file could not be read
+        """
+        files = []
+        # Files are stat'ed again, as the directory may have been loaded from a snapshot
+        for filepath in sorted(entry.associated):
+            try:
+                fstat = os.stat(filepath)
+            except OSError:
+                return None
+            files.append([filepath, fstat.st_size, fstat.st_mtime_ns, fstat.st_ino])
+        script = str(ready_script).replace(app.workdir, WORKDIR_MARKER)
+        # Probe output paths are named for the identity of the media file, which is
+        # already part of the key; getting them does not probe the file
+        if app.probes.cachedir is not None:
+            script = script.replace(app.probes.cachedir, PROBES_MARKER)
+        keydata = [
+            CACHE_FORMAT,
+            stage,
+            script,
+            self._code_identity(ready_script),
+            os.path.realpath(os.getcwd()),
+            files,
+        ]
+        return hashlib.sha256(json.dumps(keydata).encode()).hexdigest()
+
+    def replay(self, key: str, stagedir: str) -> int:
+        """
+        If the result of a stage run is cached, write its output into the stage directory
+        in the same way as running the stage would have.
+        args:
+            key: The cache key from key()
+            stagedir: The output directory for this run of the stage
+        returns:
+            The exit code of the cached run, or None if there is no cached result
+        """
+        if key not in self.entries:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf8') as cfile:
+                cached = json.load(cfile)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            # Removed or replaced by another run, or incomplete
+            return None
+        def restore(text: str) -> str:
+            return text.replace(WORKDIR_MARKER, app.workdir)
+        if cached['results'] is not None:
+            os.makedirs(stagedir, exist_ok=True)
+            with open(os.path.join(stagedir, RESULTS_FILE), 'w', encoding='utf8') as rfile:
+                rfile.write(restore(cached['results']))
+        ecode = app.write_output(
+            stagedir,
+            cached['ecode'],
+            [restore(cached['stdout']).encode('utf8', errors='surrogateescape')],
+            [restore(cached['stderr']).encode('utf8', errors='surrogateescape')]
+        )
+        with self._lock:
+            self.entries[key] = (os.path.getmtime(self._path(key)), self.entries[key][1])
+            self.hits += 1
+        return ecode
+
+    def store(self, key: str, stagedir: str, ecode: int):
+        """
+        Add the output of a stage run to the cache; runs which failed are not cached, so
+        are run again even if nothing has changed.
+        args:
+            key: The cache key from key()
+            stagedir: The output directory of the stage run
+            ecode: The exit code of the run
+        """
+        if ecode & 1:
+            return
+        def read(fname: str) -> str:
+            fpath = os.path.join(stagedir, fname)
+            if not os.path.exists(fpath):
+                return None
+            with open(fpath, 'r', encoding='utf8', errors='surrogateescape') as ofile:
+                return ofile.read().replace(app.workdir, WORKDIR_MARKER)
+        cached = {
+            'ecode': ecode,
+            'stdout': read('stdout.txt') or '',
+            'stderr': read('stderr.txt') or '',
+            'results': read(RESULTS_FILE),
+        }
+        cpath = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(cpath), exist_ok=True)
+            with replaced_file(cpath) as tfile:
+                json.dump(cached, tfile)
+            fstat = os.stat(cpath)
+        except OSError as exc:
+            app.logger.warning(f"Unable to add to stage cache: {exc}")
+            return
+        with self._lock:
+            previous = self.entries.get(key)
+            self.size += fstat.st_size - (previous[1] if previous else 0)
+            self.entries[key] = (fstat.st_mtime, fstat.st_size)
+            self.stored += 1
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used results while the cache is over its maximum size"""
+        with self._lock:
+            if self.size <= self.max_size:
+                return
+            target = self.max_size * EVICT_TO
+            for key, (_, size) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+                if self.size <= target:
+                    break
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as exc:
+                    app.logger.warning(f"Unable to remove from stage cache: {exc}")
+                    continue
+                del self.entries[key]
+                self.size -= size
+
+    def __len__(self):
+        return len(self.entries) if self.entries is not None else 0
+
+    def __repr__(self):
+        return (
+            f"StageCache(results={len(self)}, size-mb={self.size / 1024 / 1024:.1f}, "
+            f"hits={self.hits}, stored={self.stored})"
+        )
@@ -6,25 +6,51 @@ from copy import deepcopy
 import yaml
 import cerberus
 import app
-from app.template import render_template_string
-from app.manifest import ManifestEntry
+from app.template import render_template_string, template_variables
+from app.manifest import ManifestEntry, EntryStatus
 from app.helpers import value_match
 from app.filematch import FileMatcher
+from app.hashing import verify_hash_stage
+from app.plugins import PluginCall, load_plugin
+from app.process import RESULTS_FILE
+from app.timings import thread_usage
 from schemas import suite
 
+# Stage types which run in-process rather than as a shell script
+NATIVE_STAGES = {
+    'verify-hash': verify_hash_stage,
+}
+
 class SuiteStage:
     """A Stage within the suite"""
+    # One attribute for each of the stage's settings in the suite file
+    # pylint: disable=too-many-instance-attributes
     def __init__(self, name, stage):
         self.name = name
-        self.raw_script = stage["script"]
+        self.raw_script = stage.get("script")
+        # For in-process stage types, the stage type and its (unrendered) arguments
+        self.native = next((ntype for ntype in NATIVE_STAGES if ntype in stage), None)
+        # For 'python:' plugin stages, the plugin 'module:function' name
+        self.plugin = stage.get("python")
+        self.raw_args = stage[self.native] if self.native else stage.get("args", {})
         self.loopvars = stage.get("loopvars", [])
+        # Seconds a script may run for; if not set, the runner's default timeout is used
+        self.timeout = stage.get("timeout")
+        # Names of stages which must complete before this stage is run
+        self.needs = stage.get("needs", [])
 
-    def script(self, context):
+    def script(self, context, stage_basedir: str=None):
         """
         Run the script for the given context, looping over loopvars if set, yielding the result(s).
+        args:
+            context: The manifest entry (or other context) to render the script with
+            stage_basedir: The stage output directory; if set, results_path will be the
+                results file within the output directory of each script run
         yields:
             tuple(
-                ready_script_string: The rendered string, ready to execute
+                ready_script_string: The rendered string, ready to execute (or for
+                    in-process stage types, the dict of rendered arguments, or for
+                    plugin stages, the PluginCall)
                 stage_suffix: A suffix string to append to the stage when using loopvar
             )
         """
@@ -53,7 +79,51 @@ class SuiteStage:
                 pairs.append((loopctx, f".{idx}"))
 
         for ctx, suf in pairs:
-            yield render_template_string(self.raw_script, {**ctx, **app.globalctx}, shell=True), suf
+            ctx = {**ctx, **app.globalctx}
+            if stage_basedir:
+                ctx['results_path'] = os.path.join(f"{stage_basedir}{suf}", RESULTS_FILE)
+            if self.native:
+                yield self._render_args(ctx), suf
+            elif self.plugin:
+                yield PluginCall(self.plugin, self._render_args(ctx), ctx), suf
+            else:
+                yield render_template_string(self.raw_script, ctx, shell=True), suf
+
+    def _render_args(self, context: dict) -> dict:
+        """Render the arguments for an in-process stage type; non-string values are kept as-is"""
+        def render(aval):
+            return render_template_string(aval, context) if isinstance(aval, str) else aval
+        return {
+            akey: [render(item) for item in aval] if isinstance(aval, list) else render(aval)
+            for akey, aval in self.raw_args.items()
+        }
+
+    def execute(
+        self, ready_script: str|dict|PluginCall, stagedir: str, usage: dict=None
+    ) -> tuple[int, list, list]:
+        """
+        Execute a ready script from script()
+        args:
+            ready_script: The rendered script (or arguments) from script()
+            stagedir: The output directory for this run of the script
+            usage: If set, this dict will be updated with the resource usage of the script
+        returns:
+            tuple(int, list, list): Exit code, stdout lines as list, stderr lines as list;
+                scripts write their output into the stagedir as they run, so for scripts
+                the lists are always empty
+        """
+        # Files are only probed once a script (or arguments) making use of their probe
+        # output is run
+        app.probes.run_probes(str(ready_script.args if self.plugin else ready_script))
+        if self.plugin:
+            with thread_usage(usage if usage is not None else {}):
+                return ready_script.run(os.path.join(stagedir, RESULTS_FILE))
+        if self.native:
+            with thread_usage(usage if usage is not None else {}):
+                return NATIVE_STAGES[self.native](
+                    ready_script, os.path.join(stagedir, RESULTS_FILE)
+                )
+        return app.runner.run(ready_script, stagedir, self.timeout, usage)
 
     def __repr__(self):
         return f"SuiteStage({self.name})"
@@ -65,6 +135,7 @@ class Suite:
     def __init__(self, filepath: str=None):
         self.filepath = None
         self.suite = None
+        self.order = None
         if filepath:
             self.load(filepath)
 
@@ -84,14 +155,62 @@ class Suite:
         cerbval = cerberus.Validator(suite)
         if not cerbval.validate(self.suite):
             raise app.ColophonException(f"Invalid suite structure: {cerbval.errors}")
+        # Plugins are loaded now, so a missing plugin is found before any stages are run
+        for stage in self.suite['stages'].values():
+            if 'python' in stage:
+                load_plugin(stage['python'])
+        self.order = self._stage_order()
         app.logger.info(f"Loaded {self}")
 
-    def manifest_id(self, manifest_entry: ManifestEntry) -> str:
+    def _stage_order(self) -> list:
         """
-        Get the identifier string for an entry. The id is a string that should uniquely identify
-        a manifest row
+        Order the stages so each stage comes after the stages it needs, otherwise keeping
+        the order of the suite file
+        returns:
+            The list of stage names
+        raises:
+            ColophonException if a stage needs an unknown stage, or stages need each other
         """
-        return render_template_string(self.suite['manifest']['id'], manifest_entry).replace('/','_')
+        stages = self.suite['stages']
+        for name, stage in stages.items():
+            for need in stage.get('needs', []):
+                if need not in stages:
+                    raise app.ColophonException(
+                        f"Invalid suite structure: stage '{name}' needs unknown stage '{need}'"
+                    )
+        order, pending = [], list(stages)
+        while pending:
+            ready = [
+                name for name in pending
+                if all(need in order for need in stages[name].get('needs', []))
+            ]
+            if not ready:
+                raise app.ColophonException(
+                    f"Invalid suite structure: stages need each other: {pending}"
+                )
+            order.append(ready[0])
+            pending.remove(ready[0])
+        return order
+
+    @property
+    def scan(self) -> dict:
+        """The include/exclude globs for scanning the source directory"""
+        scan = self.suite['manifest'].get('scan', {})
+        return {'include': scan.get('include', []), 'exclude': scan.get('exclude', [])}
+
+    def manifest_id(self, manifest_entry: ManifestEntry|EntryStatus) -> str:
+        """
+        Get the identifier string for an entry. The id is a string that uniquely identifies
+        a manifest row (see Manifest.check_ids()), and is stored on the entry once rendered.
+        """
+        # Rendered only once for each entry, unless a field the id is rendered from changes
+        if manifest_entry.manifest_id is None:
+            id_template = self.suite['manifest']['id']
+            manifest_entry.set_manifest_id(
+                render_template_string(id_template, manifest_entry).replace('/','_'),
+                template_variables(id_template)
+            )
+        return manifest_entry.manifest_id
 
     def filter(self, entry: ManifestEntry) -> str:
         """
@@ -131,8 +250,8 @@ class Suite:
         return total_files, total_failures
 
     def stages(self):
-        """Iterate and return SuiteStage instances for each stage"""
-        for name in self.suite['stages']:
+        """Iterate and return SuiteStage instances for each stage, after any stages it needs"""
+        for name in self.order:
             yield SuiteStage(name, self.suite['stages'][name])
 
     def __repr__(self):
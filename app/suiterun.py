@@ -0,0 +1,89 @@
+"""
+Colophon run of a suite, one of possibly several run against the same manifest and directory
+"""
+import os
+import app
+from app.ledger import Ledger
+from app.manifest import Manifest
+from app.suite import Suite
+
+class SuiteRun:
+    """
+    A suite run against the manifest and source directory loaded for the run. When several
+    suites are run together, each has its own copy of the manifest rows, its own ledger,
+    and its own output directory within the workdir named after the suite file.
+
+    While active (used as a context manager) the suite run replaces the suite, manifest,
+    workdir, and ledger app globals, so each step of the job and each report works the same
+    as for a single suite. When several suites are run, the files associated with rows by
+    a suite are put aside when it is no longer active, so each suite associates files
+    independently of the others.
+    """
+    def __init__(self, suite: Suite, manifest: Manifest, workdir: str, shared: bool=False):
+        self.suite = suite
+        self.manifest = manifest
+        self.workdir = workdir
+        self.ledger = Ledger()
+        # If set, other suites are run against the same directory, so associations are kept here
+        self.shared = shared
+        # The manifest id each file is associated with; only kept while not active
+        self.associated = {}
+        self._globals = None
+
+    @staticmethod
+    def suite_name(filepath: str) -> str:
+        """The name of the output directory for a suite file; the filename without extension"""
+        return os.path.splitext(os.path.basename(filepath))[0]
+
+    @classmethod
+    def for_suites(cls, suites: list, manifest: Manifest, workdir: str) -> list:
+        """
+        Create the suite runs for the suites of a run
+        args:
+            suites: The loaded suites
+            manifest: The loaded manifest, copied for each suite if there are several
+            workdir: The workdir of the run
+        returns:
+            A list of SuiteRun
+        """
+        if len(suites) == 1:
+            return [cls(suites[0], manifest, workdir)]
+        names = [cls.suite_name(suite.filepath) for suite in suites]
+        if len(set(names)) != len(names):
+            raise app.ColophonException(
+                f"Suites run together must each have a different filename: {names}"
+            )
+        runs = []
+        for suite, name in zip(suites, names):
+            suitedir = os.path.join(workdir, name)
+            os.makedirs(suitedir, exist_ok=True)
+            # Reports from an interrupted run are created again, same as in the workdir
+            if app.checkpoint.resumed:
+                for fname in os.listdir(suitedir):
+                    if os.path.isfile(fpath := os.path.join(suitedir, fname)):
+                        os.remove(fpath)
+            runs.append(cls(suite, manifest.copy(), suitedir, shared=True))
+        return runs
+
+    def __enter__(self):
+        self._globals = (app.suite, app.manifest, app.workdir, app.ledger)
+        app.suite, app.manifest, app.workdir, app.ledger = (
+            self.suite, self.manifest, self.workdir, self.ledger
+        )
+        if self.shared:
+            # pylint: disable=unsubscriptable-object
+            for fpath, manifest_id in self.associated.items():
+                app.sourcedir[fpath].associated = manifest_id
+            self.associated = {}
+        return self
+
+    def __exit__(self, *exc):
+        if self.shared:
+            for fpath, finfo in app.sourcedir.files():
+                self.associated[fpath] = finfo.associated
+                finfo.associated = ''
+        app.suite, app.manifest, app.workdir, app.ledger = self._globals
+        self._globals = None
+
+    def __repr__(self):
+        return f"SuiteRun(suite={self.suite}, workdir={os.path.basename(self.workdir)})"
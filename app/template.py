@@ -3,11 +3,13 @@ Template functionality
 """
 import os
 import jinja2
+from jinja2 import meta
 from jinja2.lexer import Token
 from jinja2.ext import Extension
 import app
 
 CACHED_TEMPLATES = {}
+CACHED_VARIABLES = {}
 
 def escape_shell_arg(arg: str):
     """
@@ -29,6 +31,61 @@ class ShellEscapeInjector(Extension):
                 yield Token(token.lineno, 'name', 'esh')
             yield token
 
+def mediainfo_path(filepath: str) -> str:
+    """
+    Filter to get the path to the mediainfo JSON output for a file; the file is probed
+    once a script using the path is run
+    """
+    return app.probes.output_path(filepath) if filepath else ''
+
+def make_environment(shell: bool=False) -> jinja2.Environment:
+    """
+    Create the Jinja environment templates are rendered with
+    args:
+        shell: If true, will escape all variables for use as shell arguments
+    """
+    env = jinja2.Environment(
+        autoescape=False,
+        extensions=([ShellEscapeInjector] if shell else [])
+    )
+    env.filters['esh'] = escape_shell_arg
+    env.filters['basename'] = os.path.basename
+    env.filters['mediainfo'] = mediainfo_path
+    return env
+
+# Environment only used to parse templates; has the same filters as when rendering
+_PARSE_ENV = make_environment()
+
+def template_variables(string: str) -> frozenset:
+    """
+    Get the variables the template string makes use of
+    args:
+        string: The template string
+    returns:
+        The set of variable names, or None if unable to parse the template string
+    """
+    if string not in CACHED_VARIABLES:
+        try:
+            CACHED_VARIABLES[string] = frozenset(
+                meta.find_undeclared_variables(_PARSE_ENV.parse(string))
+            )
+        except jinja2.exceptions.TemplateSyntaxError:
+            # Leave it to rendering to report the failure
+            CACHED_VARIABLES[string] = None
+    return CACHED_VARIABLES[string]
+
+def references_variable(string: str, name: str) -> bool:
+    """
+    Check if the template string makes use of the given variable
+    args:
+        string: The template string
+        name: The variable name; e.g. 'file'
+    returns:
+        True if the variable is used, or if unable to parse the template string
+    """
+    variables = template_variables(string)
+    return variables is None or name in variables
+
 def render_template_string(string: str, context: dict, shell=False) -> str:
     """
     Render the template string using the provided context.
@@ -43,13 +100,7 @@ def render_template_string(string: str, context: dict, shell=False) -> str:
     templ_key = (string, shell)
     try:
         if templ_key not in CACHED_TEMPLATES:
-            env = jinja2.Environment(
-                autoescape=False,
-                extensions=([ShellEscapeInjector] if shell else [])
-            )
-            env.filters['esh'] = escape_shell_arg
-            env.filters['basename'] = os.path.basename
-            CACHED_TEMPLATES[templ_key] = env.from_string(string)
+            CACHED_TEMPLATES[templ_key] = make_environment(shell).from_string(string)
         return CACHED_TEMPLATES[templ_key].render(context)
     except jinja2.exceptions.TemplateSyntaxError as exc:
         fmsg = f"Jinja syntax had {exc} in `{string}`"
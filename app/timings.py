@@ -0,0 +1,135 @@
+"""
+Colophon timing and resource usage instrumentation
+"""
+import os
+import time
+import resource
+import functools
+from contextlib import contextmanager
+import app
+
+def read_io_chars(procpath: str) -> int:
+    """
+    Get the bytes read by a process (including waited for children) from its /proc io file
+    args:
+        procpath: The /proc directory; e.g. '/proc/1234' or '/proc/thread-self'
+    returns:
+        The number of bytes read, or None if unavailable
+    """
+    try:
+        with open(os.path.join(procpath, 'io'), 'r', encoding='utf8') as iofile:
+            for line in iofile:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def make_usage(
+    wall: float, user: float=None, system: float=None, max_rss_kb: int=None, read_bytes: int=None
+) -> dict:
+    """
+    Create a resource usage record
+    args:
+        wall: Elapsed wall time in seconds
+        user: CPU time in user mode in seconds
+        system: CPU time in system mode in seconds
+        max_rss_kb: Maximum resident set size in kilobytes
+        read_bytes: Number of bytes read
+    """
+    return {
+        "wall-seconds": round(wall, 3),
+        "user-seconds": round(user, 3) if user is not None else None,
+        "system-seconds": round(system, 3) if system is not None else None,
+        "max-rss-kb": max_rss_kb,
+        "read-bytes": read_bytes,
+    }
+
+@contextmanager
+def thread_usage(usage: dict):
+    """
+    Measure the resources used by the current thread while in the context, for stages run
+    in-process. Max RSS is not measured, as it cannot be attributed to a single thread.
+    args:
+        usage: A dict which will be updated with the resource usage record
+    """
+    started = time.monotonic()
+    before = resource.getrusage(resource.RUSAGE_THREAD)
+    read_before = read_io_chars('/proc/thread-self')
+    try:
+        yield usage
+    finally:
+        after = resource.getrusage(resource.RUSAGE_THREAD)
+        read_after = read_io_chars('/proc/thread-self')
+        usage.update(make_usage(
+            time.monotonic() - started,
+            after.ru_utime - before.ru_utime,
+            after.ru_stime - before.ru_stime,
+            read_bytes=(
+                read_after - read_before if None not in (read_before, read_after) else None
+            )
+        ))
+
+def timed(phase: str):
+    """Decorator to time each call of the function as the given phase of the run"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with app.timings.phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Timings:
+    """
+    Collects the wall time of each phase of the run for the 'timings' section of the
+    summary, along with the resource usage of each script run from the ledger.
+    """
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the run phase while in the context; repeated phases are added together"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.phases[name] = round(self.phases.get(name, 0) + elapsed, 3)
+
+    @staticmethod
+    def scripts() -> list:
+        """The resource usage of each script run (excluding output restored by retry)"""
+        return [run.script() for run in app.ledger if not run.restored]
+
+    @classmethod
+    def stages(cls, scripts: list=None) -> dict:
+        """Totals of script runs per stage name"""
+        totals = {}
+        for script in (scripts if scripts is not None else cls.scripts()):
+            total = totals.setdefault(script['stage'], {
+                "runs": 0, "wall-seconds": 0.0, "user-seconds": 0.0, "system-seconds": 0.0,
+                "max-rss-kb": None, "read-bytes": 0,
+            })
+            total['runs'] += 1
+            for key in ("wall-seconds", "user-seconds", "system-seconds", "read-bytes"):
+                total[key] = total[key] + (script.get(key) or 0)
+            if script.get('max-rss-kb') is not None:
+                total['max-rss-kb'] = max(total['max-rss-kb'] or 0, script['max-rss-kb'])
+        for total in totals.values():
+            for key in ("wall-seconds", "user-seconds", "system-seconds"):
+                total[key] = round(total[key], 3)
+        return totals
+
+    def summary(self) -> dict:
+        """The timings as a dict for the summary"""
+        scripts = self.scripts()
+        return {
+            "phases": dict(self.phases),
+            "stages": self.stages(scripts),
+            "scripts": scripts,
+        }
+
+    def __repr__(self):
+        return f"Timings(phases={len(self.phases)})"
@@ -20,6 +20,13 @@ _file_match.update(
     }
 )
 
+_verify_hash = {
+    'check-file': { 'required': True, 'type': 'string' },
+    'hash-file': { 'type': ['string', 'list'], 'schema': { 'type': 'string' } },
+    'hash-str': { 'type': 'string' },
+    'algo': { 'type': 'string' }
+}
+
 suite = {
     'manifest': {
         'required': True,
@@ -37,6 +44,13 @@ suite = {
                     'schema': _label_match
                 }
             },
+            'scan': {
+                'type': 'dict',
+                'schema': {
+                    'include': { 'type': 'list', 'schema': { 'type': 'string' } },
+                    'exclude': { 'type': 'list', 'schema': { 'type': 'string' } }
+                }
+            },
             'files': {
                 'empty': False,
                 'type': 'list',
@@ -50,13 +64,47 @@ suite = {
     'stages': {
         'required': True,
         'type': 'dict',
-        'allow_unknown': True,
         'minlength': 1,
-        'schema': {
+        'valuesrules': {
+            'type': 'dict',
             'schema': {
                 'script': {
                     'required': True,
-                    'type': 'string'
+                    'type': 'string',
+                    'excludes': ['verify-hash', 'python']
+                },
+                'verify-hash': {
+                    'required': True,
+                    'type': 'dict',
+                    'excludes': ['script', 'python'],
+                    'schema': _verify_hash
+                },
+                'python': {
+                    'required': True,
+                    'type': 'string',
+                    'regex': r'[\w.]+:\w+',
+                    'excludes': ['script', 'verify-hash']
+                },
+                'args': {
+                    'type': 'dict',
+                    'dependencies': 'python',
+                    'keysrules': { 'type': 'string' },
+                    'valuesrules': {
+                        'type': ['string', 'number', 'boolean', 'list'],
+                        'schema': { 'type': ['string', 'number', 'boolean'] }
+                    }
+                },
+                'loopvars': {
+                    'type': 'list',
+                    'schema': { 'type': 'string' }
+                },
+                'timeout': {
+                    'type': 'number',
+                    'min': 0
+                },
+                'needs': {
+                    'type': 'list',
+                    'schema': { 'type': 'string' }
                 }
             }
         }
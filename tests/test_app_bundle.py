@@ -0,0 +1,97 @@
+import os
+import sys
+import zipfile
+import tarfile
+import pytest
+import app
+from app.bundle import OutputBundle, already_compressed
+
+def make_workdir(tmp_path):
+    workdir = os.path.join(tmp_path, 'work')
+    os.makedirs(os.path.join(workdir, 'ID1', 'stage1'))
+    with open(os.path.join(workdir, 'summary.json'), 'w', encoding='utf8') as sfile:
+        sfile.write('{}\n')
+    # The checkpoint journal is never bundled
+    with open(os.path.join(workdir, 'checkpoint.jsonl'), 'w', encoding='utf8') as jfile:
+        jfile.write('{}\n')
+    with open(os.path.join(workdir, 'ID1', 'stage1', 'stdout.txt'), 'w', encoding='utf8') as sfile:
+        sfile.write('okay\n' * 1000)
+    with open(os.path.join(workdir, 'ID1', 'stage1', 'random.bin'), 'wb') as rfile:
+        rfile.write(os.urandom(4096))
+    return workdir
+
+def test_already_compressed(tmp_path):
+    workdir = make_workdir(tmp_path)
+    assert already_compressed(os.path.join(workdir, 'ID1', 'stage1', 'random.bin'))
+    assert not already_compressed(os.path.join(workdir, 'ID1', 'stage1', 'stdout.txt'))
+
+def test_output_bundle_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'workdir', make_workdir(tmp_path))
+    bundle = OutputBundle('best')
+    bundle.add_tree(os.path.join(app.workdir, 'ID1'))
+    bundle.add(os.path.join(app.workdir, 'ID1', 'stage1', 'stdout.txt'))
+    partpath = bundle.partpath
+    zippath = bundle.close()
+    assert not os.path.exists(partpath) and zippath.endswith('.zip')
+    try:
+        with zipfile.ZipFile(zippath) as zfile:
+            assert zfile.testzip() is None
+            assert sorted(zfile.namelist()) == [
+                'ID1/stage1/random.bin', 'ID1/stage1/stdout.txt', 'summary.json'
+            ]
+            assert zfile.read('ID1/stage1/stdout.txt') == b'okay\n' * 1000
+            assert zfile.getinfo('ID1/stage1/stdout.txt').compress_type == zipfile.ZIP_DEFLATED
+            assert zfile.getinfo('ID1/stage1/random.bin').compress_type == zipfile.ZIP_STORED
+    finally:
+        os.unlink(zippath)
+
+def test_output_bundle_zip64(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'workdir', make_workdir(tmp_path))
+    with open(os.path.join(app.workdir, 'ID1', 'stage1', 'résumé.txt'), 'w', encoding='utf8') as sfile:
+        sfile.write('okay\n')
+    # Sizes, offsets, and the count of members past these limits use the zip64 extensions
+    bundle_module = sys.modules[OutputBundle.__module__]
+    monkeypatch.setattr(bundle_module, '_ZIP64_LIMIT', 1000)
+    monkeypatch.setattr(bundle_module, '_ZIP64_COUNT', 2)
+    zippath = OutputBundle('fast', workers=4).close()
+    try:
+        with zipfile.ZipFile(zippath) as zfile:
+            assert zfile.testzip() is None
+            assert sorted(zfile.namelist()) == [
+                'ID1/stage1/random.bin', 'ID1/stage1/résumé.txt', 'ID1/stage1/stdout.txt',
+                'summary.json'
+            ]
+            assert zfile.read('ID1/stage1/stdout.txt') == b'okay\n' * 1000
+            info = zfile.getinfo('ID1/stage1/random.bin')
+            assert info.file_size == 4096 and info.compress_type == zipfile.ZIP_STORED
+            assert info.external_attr >> 16 == os.stat(
+                os.path.join(app.workdir, 'ID1', 'stage1', 'random.bin')
+            ).st_mode
+    finally:
+        os.unlink(zippath)
+
+def test_output_bundle_zstd(tmp_path, monkeypatch):
+    zstandard = pytest.importorskip('zstandard')
+    monkeypatch.setattr(app, 'workdir', make_workdir(tmp_path))
+    tarpath = OutputBundle('zstd').close()
+    try:
+        with (
+            open(tarpath, 'rb') as zfile,
+            zstandard.ZstdDecompressor().stream_reader(zfile) as reader,
+            tarfile.open(fileobj=reader, mode='r|') as tfile
+        ):
+            assert sorted(tfile.getnames()) == [
+                'ID1/stage1/random.bin', 'ID1/stage1/stdout.txt', 'summary.json'
+            ]
+    finally:
+        os.unlink(tarpath)
+
+def test_output_bundle_abort(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'workdir', make_workdir(tmp_path))
+    bundle = OutputBundle('fast')
+    bundle.add_tree(os.path.join(app.workdir, 'ID1'))
+    assert bundle.partpath.endswith('.zip.part') and os.path.exists(bundle.partpath)
+    partpath = bundle.partpath
+    # A failed run leaves neither a partial nor an incomplete bundle
+    bundle.abort()
+    assert not os.path.exists(partpath) and bundle.filepath is None
@@ -0,0 +1,52 @@
+import os
+import logging
+import pytest
+import app
+from app.checkpoint import Checkpoint, JOURNAL_FILE
+
+def test_checkpoint_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    manifest, suite = os.path.join(tmp_path, 'manifest.csv'), os.path.join(tmp_path, 'suite.yml')
+    for fpath in (manifest, suite):
+        with open(fpath, 'w', encoding='utf8') as ifile:
+            ifile.write('x')
+    workdir = os.path.join(tmp_path, 'work')
+    os.mkdir(workdir)
+    identity = Checkpoint.run_identity(manifest, suite, str(tmp_path))
+
+    checkpoint = Checkpoint()
+    checkpoint.start(workdir, identity)
+    assert checkpoint.done(os.path.join(workdir, 'row1/stage1')) is None
+    checkpoint.record(os.path.join(workdir, 'row1/stage1'), 0, {'wall-seconds': 1.0})
+    checkpoint.record(os.path.join(workdir, 'row1/stage2'), 16, restored=True)
+    checkpoint.close()
+    # Interrupted while writing a record, and while running a stage
+    with open(os.path.join(workdir, JOURNAL_FILE), 'a', encoding='utf8') as jfile:
+        jfile.write('{"stage-dir": "row2/st')
+    os.makedirs(os.path.join(workdir, 'row2', 'stage1'))
+    with open(os.path.join(workdir, 'summary.json'), 'w', encoding='utf8') as sfile:
+        sfile.write('{}')
+
+    checkpoint = Checkpoint()
+    checkpoint.start(workdir, identity, resume=True)
+    assert checkpoint.done(os.path.join(workdir, 'row1/stage1'))['usage'] == {'wall-seconds': 1.0}
+    assert checkpoint.done(os.path.join(workdir, 'row1/stage2'))['ecode'] == 16
+    assert checkpoint.done(os.path.join(workdir, 'row2/stage1')) is None
+    assert not os.path.exists(os.path.join(workdir, 'row2', 'stage1'))
+    assert not os.path.exists(os.path.join(workdir, 'summary.json'))
+    checkpoint.record(os.path.join(workdir, 'row2/stage1'), 1)
+    checkpoint.close()
+
+    # Records after an incomplete line can still be read when resumed again
+    checkpoint = Checkpoint()
+    checkpoint.start(workdir, identity, resume=True)
+    assert len(checkpoint.completed) == 3
+    checkpoint.close()
+
+    # Only a run with the same inputs can be resumed
+    with open(suite, 'a', encoding='utf8') as sfile:
+        sfile.write('y')
+    with pytest.raises(app.ColophonException):
+        Checkpoint().start(workdir, Checkpoint.run_identity(manifest, suite, str(tmp_path)), resume=True)
+    with pytest.raises(app.ColophonException):
+        Checkpoint().start(str(tmp_path), identity, resume=True)
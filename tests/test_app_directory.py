@@ -0,0 +1,86 @@
+import os
+import logging
+import app
+from app.directory import Directory, FileInfo, glob_match
+from app.snapshot import DirectorySnapshot
+
+def make_tree(tmp_path):
+    for relpath in (
+        "a.mkv", "b.txt", "sub1/c.mkv", "sub1/deep/d.mkv", "sub2/e.mkv", "skip/f.mkv"
+    ):
+        os.makedirs(os.path.join(tmp_path, os.path.dirname(relpath)), exist_ok=True)
+        with open(os.path.join(tmp_path, relpath), 'w', encoding='utf8') as tfile:
+            tfile.write(relpath)
+
+def walk_order(top):
+    walked = []
+    for root, _, files in os.walk(top):
+        for filename in files:
+            walked.append(os.path.relpath(os.path.join(root, filename), top))
+    return walked
+
+def test_glob_match():
+    assert glob_match("batch1/a.mkv", ["*.mkv"])
+    assert glob_match("batch1/scratch", ["batch*/scratch"])
+    assert glob_match("batch1/.snapshot", [".snapshot"])
+    assert not glob_match("batch1/a.mkv", ["a.mkv.md5", "batch2/*"])
+
+def test_directory_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(Directory, '_instantiated', False)
+    monkeypatch.chdir(tmp_path)
+    make_tree(tmp_path)
+    sourcedir = Directory(str(tmp_path))
+    # Same files in the same order as os.walk()
+    assert [fpath for fpath, _ in sourcedir] == walk_order(str(tmp_path))
+    assert sourcedir["sub1/deep/d.mkv"]["size"] == len("sub1/deep/d.mkv")
+
+    monkeypatch.setattr(Directory, '_instantiated', False)
+    sourcedir = Directory(str(tmp_path), include=["*.mkv"], exclude=["skip", "sub1/deep"])
+    assert sorted(fpath for fpath, _ in sourcedir) == ["a.mkv", "sub1/c.mkv", "sub2/e.mkv"]
+
+def test_file_info(tmp_path):
+    make_tree(tmp_path)
+    finfo = FileInfo(os.path.join(tmp_path, "sub1/c.mkv"))
+    assert dict(finfo) == {
+        "name": "c.mkv", "path": os.path.join(tmp_path, "sub1"), "base": "c", "ext": "mkv",
+        "size": len("sub1/c.mkv"),
+    }
+    assert not hasattr(finfo, '__dict__')
+    finfo["extra"] = 1
+    assert finfo["extra"] == 1 and len(finfo) == 6
+    del finfo["extra"]
+    assert "extra" not in finfo
+
+def test_directory_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.chdir(tmp_path)
+    sourcedir = os.path.join(tmp_path, 'source')
+    make_tree(sourcedir)
+    def age_dirs(mtime_ns):
+        for root, _, _ in os.walk(sourcedir):
+            os.utime(root, ns=(mtime_ns, mtime_ns))
+    age_dirs(1_000_000_000_000_000_000)
+    snapshot_path = os.path.join(tmp_path, 'source.snap')
+
+    def load():
+        monkeypatch.setattr(Directory, '_instantiated', False)
+        snapshot = DirectorySnapshot(snapshot_path)
+        return Directory(sourcedir, snapshot=snapshot), snapshot
+    loaded, snapshot = load()
+    assert snapshot.scanned == 5 and os.path.isfile(snapshot_path)
+    # Unchanged directories are re-used from the snapshot, giving the same files in order
+    reloaded, snapshot = load()
+    assert snapshot.scanned == 0 and snapshot.reused == 5
+    assert [(fpath, finfo.size, finfo.inode) for fpath, finfo in reloaded] == [
+        (fpath, finfo.size, finfo.inode) for fpath, finfo in loaded
+    ]
+
+    # Only changed directories are scanned again
+    with open(os.path.join(sourcedir, 'sub1', 'new.mkv'), 'w', encoding='utf8') as nfile:
+        nfile.write('new')
+    age_dirs(1_100_000_000_000_000_000)
+    os.utime(os.path.join(sourcedir, 'sub2'), ns=(1_000_000_000_000_000_000,) * 2)
+    reloaded, snapshot = load()
+    assert snapshot.scanned == 4 and snapshot.reused == 1
+    assert [fpath for fpath, _ in reloaded] == walk_order(sourcedir)
@@ -0,0 +1,74 @@
+import fcntl
+import logging
+import app
+from app.directory import Directory
+from app.diskorder import DiskOrder
+from app.job import ColophonJob
+from app.manifest import Manifest
+from app.suite import Suite
+
+SUITE = """
+manifest:
+  id: "{{ name }}"
+  files:
+    - label: media
+      equals: "{{ name }}.mkv"
+    - label: audio
+      equals: "{{ name }}.wav"
+stages:
+  report:
+    script: "true"
+    needs: [probe_audio]
+  probe_media:
+    script: "cat {{ media }}"
+  probe_audio:
+    script: "cat {{ audio }}"
+  hash:
+    script: "md5sum {{ media }} {{ audio }}"
+"""
+
+def test_position(tmp_path, monkeypatch):
+    (tmp_path / 'a.mkv').write_text('a.mkv')
+    order = DiskOrder()
+    position = order.position(str(tmp_path / 'a.mkv'))
+    assert position and order.position(str(tmp_path / 'a.mkv')) is position
+    assert order.position(str(tmp_path / 'missing.mkv')) == ()
+
+    # Without extents from the filesystem, files are ordered by directory and inode
+    def unsupported(*args):
+        raise OSError(95, "Operation not supported")
+    monkeypatch.setattr(fcntl, 'ioctl', unsupported)
+    position = DiskOrder().position(str(tmp_path / 'a.mkv'))
+    assert position[1:] == (str(tmp_path), (tmp_path / 'a.mkv').stat().st_ino)
+
+def test_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(Directory, '_instantiated', False)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'src').mkdir()
+    # Larger files are what decide the order
+    for fname, size in (('a.mkv', 9), ('a.wav', 1), ('b.mkv', 1), ('b.wav', 9)):
+        (tmp_path / 'src' / fname).write_text('x' * size)
+    (tmp_path / 'manifest.csv').write_text('name\nc\na\nb\n')
+    (tmp_path / 'suite.yml').write_text(SUITE)
+    monkeypatch.setattr(app, 'suite', Suite(str(tmp_path / 'suite.yml')))
+    monkeypatch.setattr(app, 'manifest', Manifest(str(tmp_path / 'manifest.csv')))
+    monkeypatch.setattr(app, 'sourcedir', Directory(str(tmp_path / 'src')))
+    ColophonJob.apply_filters()
+    ColophonJob.label_files(True)
+
+    order = DiskOrder()
+    order.positions = {
+        'a.mkv': (0, '', 30), 'a.wav': (0, '', 10), 'b.mkv': (0, '', 40), 'b.wav': (0, '', 20)
+    }
+    # Rows without files first, then by their largest file
+    assert [entry['name'] for entry in order.order_entries(list(app.manifest))] == ['c', 'b', 'a']
+
+    entry = app.manifest[2]
+    stages = list(app.suite.stages())
+    assert sorted(DiskOrder.stage_files(stages[-1], entry)) == ['b.mkv', 'b.wav']
+    # Stages reading the same largest file are grouped, but still after the stages they need
+    order.positions['b.wav'] = (0, '', 50)
+    assert [stage.name for stage in order.order_stages(stages, entry)] == [
+        'probe_media', 'probe_audio', 'report', 'hash'
+    ]
@@ -0,0 +1,58 @@
+from app import fileindex
+
+def make_index():
+    filelist = {
+        "b/UP-F00002.mkv": {"name": "UP-F00002.mkv"},
+        "a/UP-F00001.mkv": {"name": "UP-F00001.mkv"},
+        "a/UP-F00001.MKV.md5": {"name": "UP-F00001.MKV.md5"},
+        "a/UP-F00001_Asset.tif": {"name": "UP-F00001_Asset.tif"},
+        "a/notes.txt": {"name": "notes.txt"},
+    }
+    return fileindex.FileIndex(filelist)
+
+def test_plan_conditions():
+    assert fileindex.plan_conditions(
+        {"startswith": "{{ basename }}", "regex": r"\.mkv$"}
+    ) == ["startswith", "regex"]
+    assert fileindex.plan_conditions(
+        {"value": "{{file.name}}", "equals": "{{ basename }}.mkv", "endswith": ".mkv"}
+    ) == ["equals", "endswith"]
+    # Conditions depending on the file itself cannot be looked up
+    assert fileindex.plan_conditions({"startswith": "{{ file.base }}"}) == []
+    # Values other than the file name cannot be looked up
+    assert fileindex.plan_conditions({"value": "{{ file.path }}", "equals": "a"}) == []
+
+def test_candidates():
+    index = make_index()
+    ctx = {"basename": "UP-F00001"}
+
+    cands = index.candidates({"startswith": "{{ basename }}"}, ["startswith"], ctx)
+    assert [fpath for fpath, _ in cands] == [
+        "a/UP-F00001.mkv", "a/UP-F00001.MKV.md5", "a/UP-F00001_Asset.tif"
+    ]
+    cands = index.candidates(
+        {"startswith": "{{ basename }}", "endswith": ".mkv"}, ["startswith", "endswith"], ctx
+    )
+    assert [fpath for fpath, _ in cands] == ["b/UP-F00002.mkv", "a/UP-F00001.mkv"]
+    cands = index.candidates(
+        {"endswith": ".mkv.md5", "ignorecase": True}, ["endswith"], ctx
+    )
+    assert [fpath for fpath, _ in cands] == ["a/UP-F00001.MKV.md5"]
+    cands = index.candidates({"equals": "{{ basename }}.mkv"}, ["equals"], ctx)
+    assert [fpath for fpath, _ in cands] == ["a/UP-F00001.mkv"]
+    assert index.candidates({"equals": "nothing"}, ["equals"], ctx) == []
+    # Regex patterns are matched against every file once, then re-used for every row
+    cands = index.candidates({"regex": r"\.mkv(\.md5)?$", "ignorecase": True}, ["regex"], ctx)
+    assert [fpath for fpath, _ in cands] == [
+        "b/UP-F00002.mkv", "a/UP-F00001.mkv", "a/UP-F00001.MKV.md5"
+    ]
+    assert index.candidates({"regex": r"\.MKV"}, ["regex"], {}) == [
+        ("a/UP-F00001.MKV.md5", {"name": "UP-F00001.MKV.md5"})
+    ]
+    # Only looked up when no other condition gives candidates
+    cands = index.candidates(
+        {"startswith": "{{ basename }}", "regex": r"\.txt$"}, ["startswith", "regex"], ctx
+    )
+    assert len(cands) == 3 and (r"\.txt$", False) not in index._regexes
+    # Unplanned rules fall back to a full scan
+    assert index.candidates({"regex": "."}, [], ctx) is None
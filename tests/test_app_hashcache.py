@@ -0,0 +1,41 @@
+import os
+import hashlib
+import logging
+import app
+from app.hashcache import HashCache
+from app.hashing import file_digest
+
+def test_hash_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    datafile = os.path.join(tmp_path, 'data.bin')
+    with open(datafile, 'wb') as dfile:
+        dfile.write(b"colophon" * 1000)
+    md5 = hashlib.md5(b"colophon" * 1000).hexdigest()
+    assert file_digest(datafile, 'md5') == md5
+
+    cachefile = os.path.join(tmp_path, 'cache', 'hashes.tsv')
+    cache = HashCache(cachefile)
+    assert len(cache) == 0
+    assert cache.lookup(datafile, 'md5') is None
+    assert cache.digest(datafile, 'md5') == md5
+    assert cache.lookup(datafile, 'md5') == md5
+    assert cache.lookup(datafile, 'sha1') is None
+
+    # Cached hashes persist between loads
+    cache = HashCache(cachefile)
+    assert cache.lookup(datafile, 'md5') == md5
+
+    # Changed files invalidate the cached hash
+    with open(datafile, 'ab') as dfile:
+        dfile.write(b"!")
+    assert cache.lookup(datafile, 'md5') is None
+    assert cache.digest(datafile, 'md5') == hashlib.md5(b"colophon" * 1000 + b"!").hexdigest()
+
+    # Superseded lines are compacted on load
+    with open(cachefile, encoding='utf8') as cfile:
+        assert len(cfile.readlines()) == 2
+    for _ in range(3):
+        cache.store(datafile, 'md5', cache.lookup(datafile, 'md5'))
+    cache = HashCache(cachefile)
+    with open(cachefile, encoding='utf8') as cfile:
+        assert len(cfile.readlines()) == 1
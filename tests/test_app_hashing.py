@@ -0,0 +1,43 @@
+import os
+import hashlib
+from app import hashing
+
+def test_multi_digest(tmp_path):
+    data = os.urandom(1024 * 1024 + 123)
+    datafile = os.path.join(tmp_path, 'data.bin')
+    with open(datafile, 'wb') as dfile:
+        dfile.write(data)
+    expected = {algo: hashlib.new(algo, data).hexdigest() for algo in ('md5', 'sha1', 'sha256')}
+    # Small chunk size to exercise reading and hashing over many chunks
+    assert hashing.multi_digest(datafile, list(expected), chunk_size=64 * 1024) == expected
+    assert hashing.multi_digest(datafile, ['sha1'], chunk_size=64 * 1024) == {'sha1': expected['sha1']}
+    assert hashing.file_digest(datafile, 'md5') == expected['md5']
+
+def test_verify_hash(tmp_path):
+    datafile = os.path.join(tmp_path, 'data.bin')
+    with open(datafile, 'wb') as dfile:
+        dfile.write(b"colophon")
+    md5 = hashlib.md5(b"colophon").hexdigest()
+    sha256 = hashlib.sha256(b"colophon").hexdigest()
+    with open(f"{datafile}.md5", 'w', encoding='utf8') as hfile:
+        hfile.write(f"{md5.upper()}  data.bin\n")
+    with open(f"{datafile}.sha256", 'w', encoding='utf8') as hfile:
+        hfile.write(f"{sha256}\n")
+
+    ecode, _, _, results = hashing.verify_hash(datafile, f"{datafile}.md5")
+    assert ecode == 0
+    assert results == [{
+        "filepath": datafile, "algorithm": "md5", "expected": md5, "computed": md5, "matched": True
+    }]
+    ecode, _, _, results = hashing.verify_hash(datafile, [f"{datafile}.md5", f"{datafile}.sha256"])
+    assert ecode == 0
+    assert [res["algorithm"] for res in results] == ["md5", "sha256"]
+    ecode, _, _, results = hashing.verify_hash(datafile, hash_str="0123abcd", algo="md5")
+    assert ecode == 1
+    assert results[0]["matched"] is False
+    # Hash file assumed from algorithm
+    assert hashing.verify_hash(datafile, algo="sha256")[0] == 0
+    # Missing files and bad arguments
+    assert hashing.verify_hash(f"{datafile}.nope", f"{datafile}.md5")[0] == 3
+    assert hashing.verify_hash(datafile, f"{datafile}.md5", algo="crc32")[0] == 5
+    assert hashing.verify_hash(datafile, f"{datafile}.md5", hash_str=md5)[0] == 5
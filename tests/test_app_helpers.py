@@ -12,3 +12,47 @@ def test_value_match():
     assert helpers.value_match(value, conditions, ctx) == False
     conditions = { "greaterthan": "256", "lessthan": "384" }
     assert helpers.value_match(value, conditions, ctx) == False
+
+def test_compiled_match():
+    conditions = {
+        "label": "pres", "startswith": "{{ basename }}", "endswith": ".{{ file.ext | upper }}",
+        "regex": r"^up-", "ignorecase": True,
+    }
+    compiled = helpers.compiled_match("{{ file.name }}", conditions)
+    assert compiled is helpers.compiled_match("{{ file.name }}", conditions)
+    assert compiled.file_refs == [ "name", None, None, True, None ]
+
+    bound = compiled.bind({"basename": "UP-F00001"})
+    files = [
+        {"name": "UP-F00001.mkv", "ext": "mkv"},
+        {"name": "up-f00001.MKV", "ext": "MKV"},
+        {"name": "UP-F00002.mkv", "ext": "mkv"},
+        {"name": "UP-F00001.mkv.md5", "ext": "mkv"},
+    ]
+    for finfo in files:
+        expected = helpers.value_match("{{ file.name }}", conditions, {"basename": "UP-F00001", "file": finfo})
+        assert bound.matches(finfo) == expected
+    assert [bound.matches(finfo) for finfo in files] == [True, True, False, False]
+
+def test_cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert helpers.cache_path('stages') == str(tmp_path / 'colophon' / 'stages')
+    monkeypatch.delenv('XDG_CACHE_HOME')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert helpers.cache_path('a', 'b') == str(tmp_path / '.cache' / 'colophon' / 'a' / 'b')
+
+def test_replaced_file(tmp_path):
+    fpath = tmp_path / 'file.txt'
+    fpath.write_text('old')
+    with helpers.replaced_file(str(fpath)) as tfile:
+        tfile.write('new')
+        assert fpath.read_text() == 'old'
+    assert fpath.read_text() == 'new'
+    try:
+        with helpers.replaced_file(str(fpath), 'wb') as tfile:
+            tfile.write(b'partial')
+            raise OSError('full')
+    except OSError:
+        pass
+    assert fpath.read_text() == 'new'
+    assert [path.name for path in tmp_path.iterdir()] == ['file.txt']
@@ -0,0 +1,167 @@
+import os
+import sys
+import logging
+import pytest
+import app
+from app.checkpoint import Checkpoint, JOURNAL_FILE
+from app.directory import Directory
+from app.job import ColophonJob
+from app.ledger import Ledger
+from app.manifest import Manifest
+from app.probe import ProbeCache
+from app.runner import ScriptRunner
+from app.stagecache import StageCache
+from app.suite import Suite
+
+SUITE = """
+manifest:
+  id: "{{{{ name }}}}"
+  files:
+    - label: media
+      equals: "{{{{ name }}}}.wav"
+stages:
+{stages}
+"""
+
+@pytest.fixture(name='load_job')
+def fixture_load_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(Directory, '_instantiated', False)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'install_path', str(tmp_path))
+    monkeypatch.setattr(app, 'checkpoint', Checkpoint())
+    runner = ScriptRunner()
+    monkeypatch.setattr(app, 'runner', runner)
+    (tmp_path / 'src').mkdir()
+    for name in ('a', 'b', 'c', 'd'):
+        (tmp_path / 'src' / f'{name}.wav').write_text(name)
+    (tmp_path / 'manifest.csv').write_text('name\na\nb\nc\nd\n')
+    monkeypatch.setattr(app, 'sourcedir', Directory(str(tmp_path / 'src')))
+
+    def load_job(stages: str, workdir: str='work'):
+        """Load the manifest and suite, then filter and label files, ready to run stages"""
+        (tmp_path / 'suite.yml').write_text(SUITE.format(stages=stages))
+        os.makedirs(tmp_path / workdir, exist_ok=True)
+        monkeypatch.setattr(app, 'workdir', str(tmp_path / workdir))
+        monkeypatch.setattr(app, 'ledger', Ledger())
+        monkeypatch.setattr(app, 'suite', Suite(str(tmp_path / 'suite.yml')))
+        monkeypatch.setattr(app, 'manifest', Manifest(str(tmp_path / 'manifest.csv')))
+        for _, finfo in app.sourcedir:
+            finfo.associated = ''
+        ColophonJob.apply_filters()
+        ColophonJob.label_files(False)
+        return tmp_path / workdir
+
+    yield load_job
+    runner.close()
+
+def stage_runs() -> list:
+    return [
+        (run.manifest_id, f"{run.stage}{run.suffix}", run.ecode)
+        for entry in app.manifest for run in app.ledger.runs[app.suite.manifest_id(entry)]
+    ]
+
+STAGES = """
+  echo:
+    script: "/bin/echo {{ name }} {{ media }}"
+  check:
+    script: "/bin/sh -c 'test {{ name }} != b'"
+"""
+
+def test_run_stages_jobs(load_job):
+    load_job(STAGES, 'work1')
+    ColophonJob.run_stages()
+    expected = stage_runs()
+    assert expected[:4] == [
+        ('a', 'echo', 0), ('a', 'check', 0), ('b', 'echo', 0), ('b', 'check', 1)
+    ]
+
+    # Running rows concurrently gives the same output, failures, and stage runs
+    workdir = load_job(STAGES, 'work2')
+    ColophonJob.run_stages(jobs=3)
+    assert stage_runs() == expected
+    assert (workdir / 'c' / 'echo' / 'stdout.txt').read_text() == 'c c.wav\n'
+    assert [bool(entry.failures) for entry in app.manifest] == [False, True, False, False]
+    assert "stage=check" in app.manifest[1].failures[0]
+
+def test_run_stages_cached_probes(load_job, tmp_path, monkeypatch):
+    # Stand-in for mediainfo which counts how many times it was run
+    calls = tmp_path / 'calls'
+    probe_cmd = (
+        sys.executable, '-c',
+        f"import sys; open({str(calls)!r}, 'a').write('x'); print('{{\"media\": {{}}}}')"
+    )
+    stages = """
+  probe:
+    script: "/bin/cat {{ media | mediainfo }}"
+"""
+    for workdir in ('work1', 'work2'):
+        # Each run has its own probe output directory
+        probes = ProbeCache(probe_cmd)
+        monkeypatch.setattr(app, 'probes', probes)
+        monkeypatch.setattr(app, 'stagecache', StageCache(str(tmp_path / 'cache')))
+        try:
+            workdir = load_job(stages, workdir)
+            ColophonJob.run_stages()
+        finally:
+            probes.close()
+        assert (workdir / 'a' / 'probe' / 'stdout.txt').read_text() == '{"media": {}}\n'
+    # The second run replays every stage from the cache, without probing any files
+    assert app.stagecache.hits == 4 and calls.read_text() == 'xxxx'
+
+def test_run_stages_resume(load_job, tmp_path, monkeypatch):
+    runs = tmp_path / 'runs.txt'
+    stages = f"""
+  echo:
+    script: "/bin/sh -c 'echo {{{{ name }}}} >> {runs}; echo {{{{ name }}}}'"
+  check:
+    script: "/bin/sh -c 'test {{{{ name }}}} != b'"
+"""
+    identity = {'run': 'test'}
+    workdir = load_job(stages)
+    monkeypatch.setattr(app, 'checkpoint', Checkpoint())
+    app.checkpoint.start(str(workdir), identity)
+    ColophonJob.run_stages()
+    app.checkpoint.close()
+    expected = stage_runs()
+    # Interrupted after the stages of the first two rows completed
+    journal = workdir / JOURNAL_FILE
+    journal.write_text(''.join(journal.read_text().splitlines(keepends=True)[:5]))
+    runs.write_text('')
+
+    workdir = load_job(stages)
+    monkeypatch.setattr(app, 'checkpoint', Checkpoint())
+    app.checkpoint.start(str(workdir), identity, resume=True)
+    ColophonJob.run_stages(jobs=2)
+    app.checkpoint.close()
+    # Only stages which had not completed are run again, with the same stage runs
+    assert sorted(runs.read_text().split()) == ['c', 'd']
+    assert stage_runs() == expected
+    assert [bool(entry.failures) for entry in app.manifest] == [False, True, False, False]
+    assert len(journal.read_text().splitlines()) == 9
+
+def test_run_stages_needs(load_job, tmp_path):
+    # Each stage reads the file written by the stage it needs; row c skips its later stages
+    stages = f"""
+  make:
+    script: "/bin/sh -c 'sleep 0.2; echo {{{{ name }}}} > {tmp_path}/{{{{ name }}}}.made'"
+  use:
+    script: "/bin/sh -c 'cat {tmp_path}/{{{{ name }}}}.made'"
+    needs: [make]
+  skip:
+    script: "/bin/sh -c 'test {{{{ name }}}} != c || exit 16'"
+  later:
+    script: "/bin/sh -c 'echo later'"
+    needs: [skip]
+"""
+    workdir = load_job(stages)
+    ColophonJob.run_stages(jobs=2, stage_jobs=2)
+    runs = stage_runs()
+    # Runs are in stage order, the same as running stages in turn
+    assert runs[:4] == [('a', 'make', 0), ('a', 'use', 0), ('a', 'skip', 0), ('a', 'later', 0)]
+    assert ('c', 'make', 0) in runs and ('c', 'skip', 16) in runs
+    assert ('c', 'use', 0) not in runs and ('c', 'later', 0) not in runs
+    assert len(runs) == 14
+    assert not any(entry.failures for entry in app.manifest)
+    assert (workdir / 'd' / 'use' / 'stdout.txt').read_text() == 'd\n'
+    assert "exit=16" in app.manifest[2].filtered
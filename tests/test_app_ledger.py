@@ -0,0 +1,34 @@
+import os
+from types import SimpleNamespace
+import app
+from app.ledger import Ledger
+
+def test_ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'workdir', str(tmp_path))
+    ledger = Ledger()
+    for suffix, ecode in (('.0', 0), ('.1', 1)):
+        stagedir = os.path.join(tmp_path, 'ID1', f"stage1{suffix}")
+        os.makedirs(stagedir)
+        app.write_output(stagedir, ecode, [b"out\n"], [])
+        ledger.record('ID1', 'stage1', suffix, ecode, stagedir, {"wall-seconds": 0.1})
+    run = ledger.entry_runs('ID1')[1]
+    assert run.stagedir == 'ID1/stage1.1' and run.loop_index == 1
+    assert sorted(run.outputs) == ['ID1/stage1.1/ecode.1', 'ID1/stage1.1/stderr.txt', 'ID1/stage1.1/stdout.txt']
+    assert ledger.ecode_counts('ID1') == {'0': 1, '1': 1}
+    assert ledger.ecode_counts('ID2') == {}
+
+    # Output restored from a previous run
+    monkeypatch.setattr(app, 'retry', SimpleNamespace(
+        ecodes={'ID2/stage1': ['0']}, members={'ID2/stage1': ['ID2/stage1/ecode.0']}
+    ))
+    ledger.record_restored('ID2', 'stage1', '', 'ID2/stage1')
+    assert ledger.entry_runs('ID2')[0].restored and ledger.entry_runs('ID2')[0].loop_index is None
+    assert len(ledger) == 3 and len(ledger.outputs()) == 7
+
+    # Runs recorded as stages completed concurrently are put back in stage order
+    for stage in ('stage3', 'stage2'):
+        ledger.record('ID1', stage, '', 0, os.path.join(tmp_path, 'ID1', stage))
+    ledger.order_entry('ID1', ['stage1', 'stage2', 'stage3'])
+    assert [(run.stage, run.suffix) for run in ledger.entry_runs('ID1')] == [
+        ('stage1', '.0'), ('stage1', '.1'), ('stage2', ''), ('stage3', '')
+    ]
@@ -1,7 +1,7 @@
 import logging
 import pytest
 import tempfile
-from app import LogBuffer
+from app import LogBuffer, TaskLogBuffer
 
 def line_count(text):
     return len(text.splitlines())
@@ -34,3 +34,44 @@ def test_app_logbuffer(caplog):
 
     logger.debug("007")
     assert line_count(caplog.text) == 5
+
+def test_app_tasklogbuffer(caplog):
+    caplog.set_level(logging.DEBUG)
+    logger = logging.getLogger()
+
+    logbuf = TaskLogBuffer.start_buffer()
+    logger.debug("001")
+    assert line_count(caplog.text) == 1
+
+    with logbuf.task(1):
+        logger.debug("task1-a")
+    with logbuf.task(0):
+        logger.debug("task0-a")
+        logger.debug("task0-b")
+    assert line_count(caplog.text) == 1
+
+    logbuf.flush_task(0)
+    assert caplog.text.splitlines()[1:] == [
+        line for line in caplog.text.splitlines() if "task0" in line
+    ]
+    assert line_count(caplog.text) == 3
+
+    # Subtasks (e.g. from other threads) are written after their task, in subtask order
+    with logbuf.task(2):
+        parent = logbuf.current_task()
+        logger.debug("task2-a")
+        with logbuf.task(1, parent):
+            logger.debug("task2.1-a")
+        with logbuf.task(0, parent):
+            logger.debug("task2.0-a")
+    assert logbuf.current_task() is None
+    assert line_count(caplog.text) == 3
+
+    TaskLogBuffer.end_buffer()
+    assert line_count(caplog.text) == 7
+    assert [line.split()[-1] for line in caplog.text.splitlines()[-4:]] == [
+        "task1-a", "task2-a", "task2.0-a", "task2.1-a"
+    ]
+
+    logger.debug("002")
+    assert line_count(caplog.text) == 8
@@ -0,0 +1,66 @@
+import os
+import logging
+from unittest.mock import Mock
+import pytest
+import app
+from app.manifest import KeyTable, ManifestEntry, Manifest
+
+def test_manifest_entry():
+    keys = KeyTable(["id", "title"])
+    entry1 = ManifestEntry(keys, ["1", "One"])
+    entry2 = ManifestEntry(keys, ["2", "Two"])
+    assert entry1[1] == "One" and entry2["id"] == "2"
+    entry1["pres"] = "a.mkv"
+    entry2["pres"] = "b.mkv"
+    # Entries with the same fields share the same table of field names
+    assert entry1._table is entry2._table
+    assert entry1.headers() == ["id", "title", "pres"]
+    assert entry2.values() == ["2", "Two", "b.mkv"]
+    del entry1["title"]
+    assert dict(entry1) == {"id": "1", "pres": "a.mkv"}
+    assert "title" not in entry1 and "title" in entry2
+
+def test_manifest_entry_duplicate_headers():
+    entry = ManifestEntry(["id", "id", "title"], ["1", "2", "Two"])
+    assert dict(entry) == {"id": "2", "title": "Two"}
+    assert entry.values() == ["2", "Two"]
+
+def test_manifest_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    mfpath = os.path.join(tmp_path, 'manifest.csv')
+    with open(mfpath, 'w', encoding='utf8') as mffile:
+        mffile.write('"id","title"\n"1","One"\n"2","Two"\n"3","Three"\n')
+    manifest = Manifest(mfpath, stream=True)
+    assert manifest.rows == 3 and len(manifest) == 0
+    chunks = list(manifest.chunks(2))
+    assert [[entry["id"] for entry in chunk] for chunk in chunks] == [["1", "2"], ["3"]]
+
+    monkeypatch.setattr(app, 'suite', Mock(manifest_id=lambda entry: f"ID{entry['id']}"))
+    chunks[0][1].filtered = "Filter did not match"
+    manifest.retain(chunks[0])
+    assert [status.manifest_id for status in manifest] == ["ID1", "ID2"]
+    assert manifest.skipped() == 1 and manifest.selected() == 1
+
+def test_manifest_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    entry = ManifestEntry(["id", "title"], ["1", "One"])
+    entry.set_manifest_id("ID1", frozenset(["id"]))
+    # Only cleared when a field the id is rendered from changes
+    entry["pres"] = "a.mkv"
+    assert entry.manifest_id == "ID1"
+    entry["id"] = "2"
+    assert entry.manifest_id is None
+    entry.set_manifest_id("ID2")
+    entry["title"] = "Two"
+    assert entry.manifest_id is None
+
+    mfpath = os.path.join(tmp_path, 'manifest.csv')
+    with open(mfpath, 'w', encoding='utf8') as mffile:
+        mffile.write('"id","title"\n"1","One"\n"2","Two"\n"1","Three"\n"1","Four"\n"2","Five"\n')
+    manifest = Manifest(mfpath)
+    # Rows which are not run may share an id
+    manifest.check_ids(["1", "2", None])
+    # Every duplicate id is reported
+    duplicates = r"'1' of row 5 \(same as row 2\), '2' of row 6 \(same as row 3\)"
+    with pytest.raises(app.ColophonException, match=duplicates):
+        manifest.check_ids(["1", "2"])
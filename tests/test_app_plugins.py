@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import pytest
+import app
+from app.probe import ProbeCache
+from app.plugins import PluginCall, load_plugin
+from app.suite import SuiteStage
+
+def test_load_plugin():
+    assert load_plugin('app.plugins:validate_video').__name__ == 'validate_video'
+    for name in ('app.plugins', 'app.plugins:no_such_function', 'no_such_module:run'):
+        with pytest.raises(app.ColophonException):
+            load_plugin(name)
+
+def test_plugin_stage(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    datafile = os.path.join(tmp_path, 'data.bin')
+    with open(datafile, 'wb') as dfile:
+        dfile.write(b"colophon")
+    with open(f"{datafile}.md5", 'w', encoding='utf8') as hfile:
+        hfile.write(hashlib.md5(b"colophon").hexdigest())
+
+    stage = SuiteStage('hash', {
+        'python': 'app.plugins:verify_hash',
+        'args': {'check-file': "{{ pres }}", 'hash-file': ["{{ pres_hash }}"]},
+    })
+    (call, suffix), = stage.script({'pres': datafile, 'pres_hash': f"{datafile}.md5"}, str(tmp_path))
+    assert isinstance(call, PluginCall) and suffix == ''
+    assert call.args == {'check-file': datafile, 'hash-file': [f"{datafile}.md5"]}
+    assert call.context['results_path'] == os.path.join(tmp_path, 'results.json')
+    ecode, stdout, _ = stage.execute(call, str(tmp_path), usage := {})
+    assert ecode == 0 and stdout and 'wall-seconds' in usage
+    with open(os.path.join(tmp_path, 'results.json'), encoding='utf8') as rfile:
+        assert json.load(rfile)['verify-hash'][0]['matched'] is True
+
+    # Exceptions raised by a plugin fail the stage
+    ecode, _, stderr = PluginCall('app.plugins:validate_video', None, {}).run(
+        os.path.join(tmp_path, 'results.json')
+    )
+    assert ecode == 1 and b'raised an exception' in stderr[0]
+
+def test_validate_media(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    media = os.path.join(tmp_path, 'media.mkv')
+    with open(media, 'wb') as mfile:
+        mfile.write(b'0' * 100)
+    mediainfo = {"media": {"track": [
+        {"@type": "General"},
+        {"@type": "Video", "Width": "1280", "Height": "720", "BitDepth": "8"},
+        {"@type": "Audio", "SamplingRate": "48000", "BitRate_Mode": "CBR"},
+    ]}}
+    probes = ProbeCache((sys.executable, '-c', f"print({json.dumps(mediainfo)!r})"))
+    monkeypatch.setattr(app, 'probes', probes)
+    video = load_plugin('app.plugins:validate_video')
+    audio = load_plugin('app.plugins:validate_audio')
+    try:
+        ecode, _, _, results = video({'check-file': media, 'dimensions': ['640x480', '1280X720'], 'bitdepth': 8}, {})
+        assert ecode == 0
+        assert results == {'validate-video': [{
+            "image": media, "index": "0", "verified": True,
+            "dimensions": {"allowed": "640x480 1280x720", "found": "1280x720"},
+            "bitdepth": {"allowed": "8", "found": "8"},
+        }]}
+        ecode, _, _, results = audio({'check-file': media, 'samplingrate': 44100, 'bitdepth': 'null'}, {})
+        assert ecode == 1 and results['validate-audio'][0]['verified'] is False
+        assert results['validate-audio'][0]['bitdepth']['found'] == 'null'
+        assert audio({'check-file': media, 'bitratemode': 'CBR'}, {})[0] == 0
+
+        # Same exit codes as the scripts for bad arguments and missing files
+        assert video({'check-file': media, 'dimensions': '1280'}, {})[0] == 5
+        assert video({'check-file': media}, {})[0] == 5
+        assert audio({'check-file': os.path.join(tmp_path, 'missing.wav'), 'samplingrate': 44100}, {})[0] == 3
+    finally:
+        probes.close()
@@ -0,0 +1,56 @@
+import os
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import app
+from app.probe import ProbeCache
+from app.template import render_template_string
+
+def test_probe_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    media = os.path.join(tmp_path, 'media.mkv')
+    with open(media, 'wb') as mfile:
+        mfile.write(b'0' * 100)
+    # Stand-in for mediainfo which counts how many times it was run
+    calls = os.path.join(tmp_path, 'calls')
+    probe_cmd = (
+        sys.executable, '-c',
+        f"import sys; open({calls!r}, 'a').write('x'); print('{{\"media\": {{\"track\": []}}}}')"
+    )
+    probes = ProbeCache(probe_cmd)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            paths = list(pool.map(probes.mediainfo_path, [media] * 4))
+        assert len(set(paths)) == 1 and os.path.isfile(paths[0])
+        assert probes.mediainfo(media) == {"media": {"track": []}}
+        with open(calls, encoding='utf8') as cfile:
+            assert cfile.read() == 'x'
+
+        # Changed files are probed again; missing files are not probed
+        with open(media, 'ab') as mfile:
+            mfile.write(b'1')
+        assert probes.mediainfo_path(media) != paths[0]
+        assert probes.mediainfo_path(os.path.join(tmp_path, 'missing.mkv')) == ''
+
+        # Available to templates as a filter; only probed once a script using it is run
+        monkeypatch.setattr(app, 'probes', probes)
+        media = os.path.join(tmp_path, 'other.mkv')
+        with open(media, 'wb') as mfile:
+            mfile.write(b'0' * 100)
+        script = render_template_string("check -M {{ pres | mediainfo }}", {"pres": media}, True)
+        probe_path = probes.output_path(media)
+        assert script == f"check -M '{probe_path}'" and not os.path.exists(probe_path)
+        probes.run_probes(script)
+        assert os.path.isfile(probe_path) and probes.mediainfo_path(media) == probe_path
+        with open(calls, encoding='utf8') as cfile:
+            assert cfile.read() == 'xxx'
+    finally:
+        probes.close()
+    assert probes.cachedir is None and not os.path.exists(paths[0])
+
+def test_probe_cache_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    probes = ProbeCache((sys.executable, '-c', "import sys; sys.exit(1)"))
+    assert probes.mediainfo_path(sys.executable) == ''
+    assert probes.mediainfo(sys.executable) is None
+    probes.close()
@@ -0,0 +1,15 @@
+import os
+import json
+from app.process import append_results, merge_results
+
+def test_append_results(tmp_path):
+    results_path = os.path.join(tmp_path, 'results.json')
+    append_results(results_path, 'verify-hash', [{"matched": True}])
+    append_results(results_path, 'verify-hash', [{"matched": False}])
+    with open(results_path, encoding='utf8') as rfile:
+        assert json.load(rfile) == {"verify-hash": [{"matched": True}, {"matched": False}]}
+
+def test_merge_results():
+    results = {"a": [1], "b": {"x": 1}, "c": 1}
+    merge_results(results, {"a": [2], "b": {"y": 2}, "c": 2, "d": [3]})
+    assert results == {"a": [1, 2], "b": {"x": 1, "y": 2}, "c": 2, "d": [3]}
@@ -0,0 +1,81 @@
+import os
+import json
+import logging
+import zipfile
+import pytest
+import app
+from app.retry import RetryBundle, ZSTD_MAGIC
+
+def make_zip(zippath):
+    with zipfile.ZipFile(zippath, 'w') as zfile:
+        zfile.writestr('summary.json', json.dumps({"failed": ["ID1"]}))
+        zfile.writestr('results.json', json.dumps({"verify-hash": [{"matched": False}]}))
+        zfile.writestr('ID1/stage1/ecode.0', "0 = success\n")
+        zfile.writestr('ID1/stage1/stdout.txt', "okay\n")
+        zfile.writestr('ID1/stage1/results.json', json.dumps({"verify-hash": []}))
+        zfile.writestr('ID1/stage2.0/ecode.0', "0 = success\n")
+        zfile.writestr('ID1/stage2.1/ecode.1', "1 = failure\n")
+        zfile.writestr('ID1/stage3/ecode.16', "16 = success,skip_manfest_row\n")
+        zfile.writestr('ID1/stage4/ecode.8', "8 = success,warning_logged\n")
+
+def test_retry_bundle(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    zippath = os.path.join(tmp_path, 'output.zip')
+    make_zip(zippath)
+    retry = RetryBundle(zippath)
+    assert retry.passed('ID1/stage1')
+    assert retry.passed('ID1/stage2.0')
+    assert not retry.passed('ID1/stage2.1')
+    assert not retry.passed('ID1/stage3')
+    assert retry.passed('ID1/stage4')
+    assert not retry.passed('ID2/stage1')
+
+    workdir = os.path.join(tmp_path, 'work')
+    assert retry.restore('ID1/stage1', workdir)
+    assert not retry.restore('ID1/stage2.1', workdir)
+    assert sorted(os.listdir(os.path.join(workdir, 'ID1'))) == ['stage1']
+    with open(os.path.join(workdir, 'ID1/stage1/stdout.txt'), encoding='utf8') as sof:
+        assert sof.read() == "okay\n"
+    # The zip file is opened once, for all stages restored
+    assert retry.restore('ID1/stage2.0', workdir)
+    retry.close()
+    assert retry._zfile is None
+
+def test_retry_bundle_legacy(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    zippath = os.path.join(tmp_path, 'output.zip')
+    with zipfile.ZipFile(zippath, 'w') as zfile:
+        zfile.writestr('summary.json', json.dumps({"failed": ["ID1"]}))
+        zfile.writestr('results.json', json.dumps({"verify-hash": [{"matched": False}]}))
+        zfile.writestr('ID1/stage1/ecode.1', "1 = failure\n")
+    # Only merged results, so those of stages run again would be included twice
+    with pytest.raises(app.ColophonException, match="earlier version"):
+        RetryBundle(zippath)
+
+def test_retry_bundle_zstd(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    tarpath = os.path.join(tmp_path, 'output.tar.zst')
+    with open(tarpath, 'wb') as tfile:
+        tfile.write(ZSTD_MAGIC + bytes(16))
+    with pytest.raises(app.ColophonException, match="--compression zstd"):
+        RetryBundle(tarpath)
+
+def test_retry_bundle_outside_workdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    zippath = os.path.join(tmp_path, 'output.zip')
+    with zipfile.ZipFile(zippath, 'w') as zfile:
+        zfile.writestr('summary.json', json.dumps({"failed": []}))
+        zfile.writestr('results.json', json.dumps({}))
+        for stagedir in ('../ID1', 'ID1/..', 'ID1/stage1'):
+            zfile.writestr(f"{stagedir}/ecode.0", "0 = success\n")
+        zfile.writestr('ID1/stage1/..', "escaped\n")
+    retry = RetryBundle(zippath)
+    workdir = os.path.join(tmp_path, 'work')
+    # Members are only ever written within their stage output dir
+    for stagedir in ('../ID1', 'ID1/..', 'ID1/stage1'):
+        assert retry.passed(stagedir)
+        with pytest.raises(app.ColophonException, match="outside its stage directory"):
+            retry.restore(stagedir, workdir)
+    retry.close()
+    assert not os.path.exists(os.path.join(tmp_path, 'ID1'))
+    assert not os.path.exists(os.path.join(workdir, 'ID1'))
@@ -0,0 +1,50 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import app
+from app.runner import ScriptRunner, OutputTail
+
+def test_output_tail():
+    tail = OutputTail(max_size=10)
+    tail.add(b"one\ntwo\n")
+    tail.add(b"three\n")
+    assert bytes(tail.data) == b"two\nthree\n"
+    assert tail.lines(1) == ["three"]
+
+def test_script_runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(app, 'install_path', str(tmp_path))
+    runner = ScriptRunner()
+    try:
+        # Output is written to the stage files rather than returned
+        readpath = os.path.join(tmp_path, 'read.bin')
+        with open(readpath, 'wb') as rfile:
+            rfile.write(b'0' * 100000)
+        usage = {}
+        ecode, stdout, stderr = runner.run(
+            f"/bin/cat {readpath} >/dev/null; /bin/seq 1 100000; echo err >&2; exit 3",
+            str(tmp_path), usage=usage
+        )
+        assert (ecode, stdout, stderr) == (3, [], [])
+        with open(os.path.join(tmp_path, 'stdout.txt'), 'rb') as sof:
+            assert sof.read().splitlines()[-1] == b"100000"
+        with open(os.path.join(tmp_path, 'stderr.txt'), 'rb') as sef:
+            assert sef.read() == b"err\n"
+        assert usage['max-rss-kb'] > 0 and usage['wall-seconds'] >= 0
+        assert usage['read-bytes'] >= 100000
+
+        # Scripts from many threads run at the same time
+        dirs = [os.path.join(tmp_path, f"stage.{idx}") for idx in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for sdir in dirs:
+                os.makedirs(sdir)
+            results = list(pool.map(lambda sdir: runner.run("/bin/sleep 0.5; echo done", sdir), dirs))
+        assert [ecode for ecode, _, _ in results] == [0, 0, 0, 0]
+
+        # Timed out scripts are killed, including any commands they started
+        ecode, _, _ = runner.run("/bin/echo start; sleep 30 & wait", dirs[0], timeout=0.2)
+        assert ecode == 1
+        with open(os.path.join(dirs[0], 'stderr.txt'), 'rb') as sef:
+            assert b"timed out after 0.2 seconds" in sef.read()
+    finally:
+        runner.close()
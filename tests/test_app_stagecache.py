@@ -0,0 +1,61 @@
+import os
+import json
+import logging
+import app
+from app.manifest import ManifestEntry
+from app.stagecache import StageCache
+
+def test_stage_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.chdir(tmp_path)
+    with open('media.wav', 'wb') as mfile:
+        mfile.write(b'0' * 100)
+    entry = ManifestEntry(['id'], ['media'])
+    entry.associated.append('media.wav')
+
+    # A stage run in one workdir
+    workdir = os.path.join(tmp_path, 'work1')
+    monkeypatch.setattr(app, 'workdir', workdir)
+    stagedir = os.path.join(workdir, 'media', 'stage1')
+    script = f"/bin/true -c media.wav -J {stagedir}/results.json"
+    cache = StageCache(os.path.join(tmp_path, 'cache'))
+    key = cache.key('stage1', script, entry)
+    assert cache.replay(key, stagedir) is None
+    app.write_output(stagedir, 8, [f"Wrote {stagedir}/results.json\n".encode(), b'\xff\n'], [b'warn\n'])
+    with open(os.path.join(stagedir, 'results.json'), 'w', encoding='utf8') as rfile:
+        json.dump({"check": [{"ok": True}]}, rfile)
+    cache.store(key, stagedir, 8)
+
+    # Replayed into another workdir by a later run, the same as write_output() would
+    workdir = os.path.join(tmp_path, 'work2')
+    monkeypatch.setattr(app, 'workdir', workdir)
+    stagedir = os.path.join(workdir, 'media', 'stage1')
+    cache = StageCache(os.path.join(tmp_path, 'cache'))
+    key = cache.key('stage1', f"/bin/true -c media.wav -J {stagedir}/results.json", entry)
+    assert cache.replay(key, stagedir) == 8 and cache.hits == 1
+    assert sorted(os.listdir(stagedir)) == ['ecode.8', 'results.json', 'stderr.txt', 'stdout.txt']
+    with open(os.path.join(stagedir, 'stdout.txt'), 'rb') as ofile:
+        assert ofile.read() == f"Wrote {stagedir}/results.json\n".encode() + b'\xff\n'
+    with open(os.path.join(stagedir, 'results.json'), encoding='utf8') as rfile:
+        assert json.load(rfile) == {"check": [{"ok": True}]}
+
+    # Changed files and failed runs are not re-used
+    with open('media.wav', 'ab') as mfile:
+        mfile.write(b'1')
+    assert cache.key('stage1', script, entry) != key
+    cache.store(key := cache.key('stage2', script, entry), stagedir, 1)
+    assert cache.replay(key, stagedir) is None
+
+def test_stage_cache_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(app, 'workdir', str(tmp_path))
+    stagedir = os.path.join(tmp_path, 'stage')
+    app.write_output(stagedir, 0, [b'x' * 1000], [])
+    cache = StageCache(os.path.join(tmp_path, 'cache'), max_size=5000)
+    for idx in range(4):
+        cache.store(f"{idx:02d}key", stagedir, 0)
+    # Using the oldest result makes it the most recently used
+    assert cache.replay("00key", stagedir) == 0
+    cache.store("04key", stagedir, 0)
+    assert cache.size <= 5000
+    assert "00key" in cache.entries and "01key" not in cache.entries and "04key" in cache.entries
@@ -0,0 +1,52 @@
+import logging
+import pytest
+import app
+from app.suite import Suite
+
+SUITE = """
+manifest:
+  id: "{{{{ name }}}}"
+  files:
+    - label: media
+      equals: "{{{{ name }}}}.wav"
+stages:
+{stages}
+"""
+
+def load_suite(tmp_path, stages: str) -> Suite:
+    (tmp_path / 'suite.yml').write_text(SUITE.format(stages=stages))
+    return Suite(str(tmp_path / 'suite.yml'))
+
+def test_stage_needs(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    suite = load_suite(tmp_path, """
+  report:
+    script: "true"
+    needs: [hash, probe]
+  probe:
+    script: "true"
+    needs: [hash]
+  hash:
+    script: "true"
+  other:
+    script: "true"
+""")
+    # Stages come after the stages they need, otherwise in suite order
+    assert [stage.name for stage in suite.stages()] == ['hash', 'probe', 'report', 'other']
+    assert next(suite.stages()).needs == []
+
+    with pytest.raises(app.ColophonException, match="unknown stage"):
+        load_suite(tmp_path, """
+  probe:
+    script: "true"
+    needs: [hash]
+""")
+    with pytest.raises(app.ColophonException, match="need each other"):
+        load_suite(tmp_path, """
+  probe:
+    script: "true"
+    needs: [report]
+  report:
+    script: "true"
+    needs: [probe]
+""")
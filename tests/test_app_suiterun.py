@@ -0,0 +1,63 @@
+import os
+import json
+import logging
+import pytest
+import app
+from app.directory import Directory
+from app.job import ColophonJob
+from app.manifest import Manifest
+from app.report import UnassociatedReport
+from app.suite import Suite
+from app.suiterun import SuiteRun
+
+SUITE = """
+manifest:
+  id: "{{{{ name }}}}"
+  files:
+    - label: media
+      equals: "{{{{ name }}}}.{ext}"
+    - label: media_hash
+      equals: "{{{{ name }}}}.{ext}.md5"
+      optional: true
+stages:
+  check:
+    script: "true"
+"""
+
+def test_suite_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'logger', logging.getLogger())
+    monkeypatch.setattr(Directory, '_instantiated', False)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'workdir', str(tmp_path / 'work'))
+    for fname in ('a.wav', 'a.mkv', 'a.mkv.md5', 'notes.txt'):
+        (tmp_path / 'src').mkdir(exist_ok=True)
+        (tmp_path / 'src' / fname).write_text(fname)
+    (tmp_path / 'manifest.csv').write_text('name\na\n')
+    for name, ext in (('audio', 'wav'), ('video', 'mkv')):
+        (tmp_path / f'{name}.yml').write_text(SUITE.format(ext=ext))
+    suites = [Suite(str(tmp_path / 'audio.yml')), Suite(str(tmp_path / 'video.yml'))]
+    monkeypatch.setattr(app, 'manifest', Manifest(str(tmp_path / 'manifest.csv')))
+    monkeypatch.setattr(app, 'sourcedir', Directory(str(tmp_path / 'src')))
+
+    runs = SuiteRun.for_suites(suites, app.manifest, app.workdir)
+    assert [os.path.basename(run.workdir) for run in runs] == ['audio', 'video']
+    for run in runs:
+        with run:
+            assert app.suite is run.suite and app.workdir == run.workdir
+            ColophonJob.apply_filters()
+            ColophonJob.label_files(False)
+        # Associations of a suite are put aside once it is no longer active
+        assert not list(app.sourcedir.files())
+    assert app.workdir == str(tmp_path / 'work')
+    assert runs[0].manifest[0]['media'] == 'a.wav' and not runs[0].manifest[0].failures
+    assert runs[1].manifest[0]['media'] == 'a.mkv' and 'media' not in app.manifest[0]
+    with runs[1]:
+        assert sorted(fpath for fpath, _ in app.sourcedir.files()) == ['a.mkv', 'a.mkv.md5']
+
+    assert UnassociatedReport.generate(runs) == 1
+    with open(os.path.join(app.workdir, 'unassociated.json'), encoding='utf8') as ufile:
+        assert json.load(ufile) == ['notes.txt']
+
+    # Each suite has its own output directory, named after the suite file
+    with pytest.raises(app.ColophonException):
+        SuiteRun.for_suites([suites[0], Suite(str(tmp_path / 'audio.yml'))], app.manifest, app.workdir)
@@ -28,3 +28,10 @@ def test_render_template_string():
         ctx2,
         shell=True
     ) == "=='Special '\\''chars'\\'' found $ here!! <> $?.'=="
+
+def test_references_variable():
+    assert template.references_variable("{{ file.name }}", "file")
+    assert not template.references_variable("{{ basename }}", "file")
+    # Custom filters are known when parsing
+    assert not template.references_variable("{{ asset | basename }}", "file")
+    assert template.references_variable("{{ file.path | basename }}", "file")
@@ -0,0 +1,32 @@
+import os
+import app
+from app.ledger import Ledger
+from app.timings import Timings, thread_usage
+
+def test_timings(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'workdir', str(tmp_path))
+    monkeypatch.setattr(app, 'ledger', Ledger())
+    timings = Timings()
+    with timings.phase('label_files'):
+        pass
+    with timings.phase('label_files'):
+        pass
+    assert list(timings.phases) == ['label_files']
+    usage = {"wall-seconds": 1.5, "user-seconds": 1.0, "system-seconds": 0.25,
+             "max-rss-kb": 100, "read-bytes": 10}
+    stagedir = os.path.join(tmp_path, 'ID1', 'stage1')
+    app.ledger.record('ID1', 'stage1', '.0', 0, f"{stagedir}.0", usage)
+    app.ledger.record('ID1', 'stage1', '.1', 1, f"{stagedir}.1", {**usage, "max-rss-kb": 200})
+    app.ledger.record('ID1', 'stage2', '', 0, stagedir, {**usage, "max-rss-kb": None, "read-bytes": None})
+    summary = timings.summary()
+    assert summary['scripts'][1]['stage-dir'] == 'stage1.1'
+    assert summary['stages']['stage1'] == {
+        "runs": 2, "wall-seconds": 3.0, "user-seconds": 2.0, "system-seconds": 0.5,
+        "max-rss-kb": 200, "read-bytes": 20,
+    }
+    assert summary['stages']['stage2']['max-rss-kb'] is None
+
+def test_thread_usage():
+    with thread_usage(usage := {}):
+        sum(range(1000))
+    assert usage['max-rss-kb'] is None and usage['user-seconds'] is not None
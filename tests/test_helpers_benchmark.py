@@ -0,0 +1,23 @@
+import os
+import importlib.machinery
+import importlib.util
+
+def load_benchmark():
+    install_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(install_path, 'helpers', 'benchmark')
+    loader = importlib.machinery.SourceFileLoader('benchmark', path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader('benchmark', loader))
+    loader.exec_module(module)
+    return module
+
+def test_colophon_version(tmp_path, monkeypatch):
+    benchmark = load_benchmark()
+    # The version of this install, as set in the colophon command
+    assert benchmark.colophon_version() not in (None, '')
+    monkeypatch.setattr(benchmark, 'INSTALL_PATH', str(tmp_path))
+    for line, version in (
+        ('VERSION = "0.2.0"', '0.2.0'), ('VERSION="1.0"', '1.0'), ('VERSION=1.1', '1.1'),
+        ('# No version', None),
+    ):
+        (tmp_path / 'colophon').write_text(f"import os\n{line}\n")
+        assert benchmark.colophon_version() == version